@@ -0,0 +1,150 @@
+"""
+Collapses repeated events from one source into summaries.
+
+The first event for a (src_host, logtype, dst_port) key is logged as
+usual and opens a window. Further events for the key inside the window
+are only counted, with a sample of the credentials they carried, and
+when the window closes a single summary event is logged if anything
+was absorbed. Downstream load then grows with the number of sources
+rather than the number of packets.
+
+The window slides: it closes once the key has been quiet for window
+seconds, so a burst is summarised once however it falls on the clock.
+So that a source that never stops still gets reported, an event that
+arrives more than max_duration seconds after its window opened closes
+that window and is logged as the first of a new one.
+"""
+
+from collections import OrderedDict
+
+from twisted.internet import reactor, task
+
+
+class Window(object):
+    __slots__ = (
+        "opened",
+        "expires",
+        "dst_host",
+        "first",
+        "last",
+        "count",
+        "credentials",
+    )
+
+    def __init__(self, opened, expires, dst_host, first):
+        self.opened = opened
+        self.expires = expires
+        self.dst_host = dst_host
+        self.first = first
+        self.last = first
+        self.count = 1
+        self.credentials = []
+
+
+class EventAggregator(object):
+    """
+    Windows are kept in an OrderedDict in the order of their latest
+    event, a window being moved to the end whenever an event extends
+    it. As every window expires the same time after its latest event
+    this is also the order in which they expire, so expiry only ever
+    looks at the head of the table and a full table evicts (and
+    summarises) its least recently active window.
+
+    Time and scheduling come from clock, the reactor unless a test hands
+    in a fake one.
+    """
+
+    def __init__(
+        self,
+        summarise,
+        window=60,
+        max_keys=10000,
+        sample_size=5,
+        max_duration=None,
+        clock=reactor,
+    ):
+        self.summarise = summarise
+        self.clock = clock
+        self.window = window
+        self.max_duration = max_duration or window * 10
+        self.max_keys = max_keys
+        self.sample_size = sample_size
+        self.table = OrderedDict()
+
+        self.expiry = task.LoopingCall(self.expire)
+        self.expiry.clock = clock
+        clock.callWhenRunning(self.expiry.start, 1, now=False)
+        clock.addSystemEventTrigger("before", "shutdown", self.flush)
+
+    def key(self, logdata):
+        return (logdata["src_host"], logdata["logtype"], logdata["dst_port"])
+
+    def add(self, logdata):
+        """Return True if logdata should be logged now, False if absorbed"""
+        if not logdata.get("src_host") or logdata.get("honeycred"):
+            return True
+
+        now = self.clock.seconds()
+        self.expire(now)
+        key = self.key(logdata)
+        window = self.table.get(key)
+        if window is not None and now - window.opened >= self.max_duration:
+            del self.table[key]
+            self.close(key, window)
+            window = None
+        if window is None:
+            while len(self.table) >= self.max_keys:
+                self.close(*self.table.popitem(last=False))
+            window = self.table[key] = Window(
+                now, now + self.window, logdata["dst_host"], logdata["utc_time"]
+            )
+            self.sample(window, logdata.get("logdata"))
+            return True
+
+        window.expires = now + self.window
+        self.table.move_to_end(key)
+        window.count += 1
+        window.last = logdata["utc_time"]
+        self.sample(window, logdata.get("logdata"))
+        return False
+
+    def sample(self, window, data):
+        if len(window.credentials) >= self.sample_size or not isinstance(data, dict):
+            return
+        if "USERNAME" not in data and "PASSWORD" not in data:
+            return
+        cred = {"USERNAME": data.get("USERNAME"), "PASSWORD": data.get("PASSWORD")}
+        if cred not in window.credentials:
+            window.credentials.append(cred)
+
+    def expire(self, now=None):
+        if now is None:
+            now = self.clock.seconds()
+        while self.table:
+            key, window = next(iter(self.table.items()))
+            if window.expires > now:
+                break
+            del self.table[key]
+            self.close(key, window)
+
+    def close(self, key, window):
+        if window.count == 1:
+            return
+        src_host, logtype, dst_port = key
+        self.summarise(
+            src_host,
+            window.dst_host,
+            dst_port,
+            {
+                "logtype": logtype,
+                "count": window.count,
+                "first_time": window.first,
+                "last_time": window.last,
+                "credentials": window.credentials,
+            },
+        )
+
+    def flush(self):
+        """Summarise every open window, e.g. on shutdown"""
+        while self.table:
+            self.close(*self.table.popitem(last=False))
@@ -169,6 +169,33 @@ class Config:
                     "Please use only characters, digits, spaces and any of the following: + - # _",
                 )
 
+        if key == "workers.count":
+            if not isinstance(val, int) or isinstance(val, bool) or val < 1:
+                raise ConfigException(
+                    key, "Invalid worker count (%s). Must be a positive integer." % val
+                )
+
+        if key == "workers.pinning":
+            count = self.__config.get("workers.count", 1)
+            if not isinstance(count, int):
+                # Reported against workers.count
+                count = 1
+            if not isinstance(val, dict) or not all(
+                isinstance(workers, list) for workers in val.values()
+            ):
+                raise ConfigException(
+                    key, "Invalid pinning (%s). Must map modules to lists." % val
+                )
+            for module, workers in val.items():
+                for index in workers:
+                    valid = isinstance(index, int) and not isinstance(index, bool)
+                    if not valid or not 0 <= index < count:
+                        raise ConfigException(
+                            key,
+                            "%s is pinned to worker %s, but workers are numbered "
+                            "0 to %s." % (module, index, count - 1),
+                        )
+
         if key in SERVICE_REGEXES.keys():
             if not re.match(SERVICE_REGEXES[key], val):
                 raise ConfigException(key, f"{val} is not valid.")
@@ -208,9 +235,22 @@ class ConfigException(Exception):
         return "<%s %s (%s)>" % (self.__class__.__name__, self.key, self.msg)
 
 
-config = Config()
-errors = config.checkValues()
-if errors:
-    for error in errors:
-        print(error)
-    sys.exit(1)
+def loadConfig():
+    """Load and validate the config file, exiting if it is invalid"""
+    config = Config()
+    errors = config.checkValues()
+    if errors:
+        for error in errors:
+            print(error)
+        sys.exit(1)
+    return config
+
+
+def __getattr__(name):
+    # The config is loaded when it is first imported rather than when this
+    # module is, so modules can import ConfigException without a config file
+    if name == "config":
+        global config
+        config = loadConfig()
+        return config
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,70 @@
+"""
+Receive buffer for the length-prefixed binary protocols.
+
+Appending to bytes and then slicing consumed frames off the front copies
+the whole of the unconsumed data on every dataReceived and every frame,
+which turns quadratic for a client that drips a large message in a byte
+at a time or pipelines many small ones. FrameBuffer appends to a
+bytearray and consumes by advancing an offset, copying out only the
+frames that are taken and dropping the consumed prefix once it makes up
+half of the buffer, so each byte received is copied a bounded number of
+times.
+"""
+
+import struct
+
+# Below this a bytearray slice is cheaper than setting up a memoryview,
+# even though it copies the frame twice
+SMALL_FRAME = 4096
+
+
+class FrameBuffer(object):
+    __slots__ = ("buf", "pos")
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.pos = 0
+
+    def __len__(self):
+        return len(self.buf) - self.pos
+
+    def append(self, data):
+        if self.pos and self.pos * 2 >= len(self.buf):
+            del self.buf[: self.pos]
+            self.pos = 0
+        self.buf += data
+
+    def unpack_from(self, fmt, offset=0):
+        """struct.unpack_from() of the unconsumed data, without consuming it"""
+        if isinstance(fmt, struct.Struct):
+            return fmt.unpack_from(self.buf, self.pos + offset)
+        return struct.unpack_from(fmt, self.buf, self.pos + offset)
+
+    def find(self, sub, start=0):
+        """Index of sub in the unconsumed data, or -1"""
+        i = self.buf.find(sub, self.pos + start)
+        return i - self.pos if i >= 0 else -1
+
+    def peek(self, n):
+        """Up to n bytes of the unconsumed data, without consuming them"""
+        if n <= SMALL_FRAME:
+            return bytes(self.buf[self.pos : self.pos + n])
+        with memoryview(self.buf) as view:
+            return bytes(view[self.pos : self.pos + n])
+
+    def take(self, n, skip=0):
+        """Consume and return up to n bytes, then discard skip more"""
+        pos = self.pos
+        if n <= SMALL_FRAME:
+            data = bytes(self.buf[pos : pos + n])
+        else:
+            data = self.peek(n)
+        self.pos = min(pos + len(data) + skip, len(self.buf))
+        return data
+
+    def skip(self, n):
+        self.pos = min(self.pos + n, len(self.buf))
+
+    def clear(self):
+        self.buf = bytearray()
+        self.pos = 0
@@ -1,15 +1,38 @@
-import functools
+import hashlib
+from collections import OrderedDict
 from passlib.context import CryptContext
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
 
-__all__ = ["buildHoneyCredHook", "cryptcontext"]
+__all__ = ["buildHoneyCredHook", "cryptcontext", "HoneyCredChecker"]
 
 cryptcontext = CryptContext(
     schemes=["pbkdf2_sha512", "bcrypt", "sha512_crypt", "plaintext"]
 )
 
+# Shared by every module's checker, created on first use
+_threadpool = None
+
+
+def getThreadPool():
+    global _threadpool
+    if _threadpool is None:
+        _threadpool = ThreadPool(minthreads=0, maxthreads=2, name="honeycred")
+        _threadpool.start()
+        reactor.addSystemEventTrigger("during", "shutdown", _threadpool.stop)
+    return _threadpool
+
 
 def buildHoneyCredHook(creds):
-    return functools.partial(testManyCreds, creds)
+    return HoneyCredChecker(creds)
+
+
+def usernameMatches(cred, username=None):
+    cred_username = cred.get("username", None)
+    return cred_username is None or cred_username.encode() == username
 
 
 def testCred(cred, username=None, password=None):
@@ -20,12 +43,9 @@ def testCred(cred, username=None, password=None):
     will still match on the other.
 
     """
-    cred_username = cred.get("username", None)
     cred_password = cred.get("password", None)
 
-    user_match = True
-    if cred_username is not None:
-        user_match = cred_username.encode() == username
+    user_match = usernameMatches(cred, username)
 
     password_match = True
     if cred_password is not None:
@@ -39,3 +59,63 @@ def testManyCreds(creds, username=None, password=None):
         if testCred(c, username, password):
             return True
     return False
+
+
+class HoneyCredChecker(object):
+    """
+    Test credentials against a module's honeycreds without blocking.
+
+    Verifying a pbkdf2 or bcrypt hash takes tens of milliseconds, so it is
+    done on a small thread pool and the result is returned as a Deferred.
+    Creds are first narrowed down by username, which is cheap, so most
+    attempts never reach a hash at all. Results are kept in a bounded LRU
+    cache keyed on the username and a digest of the password, so repeated
+    attempts with the same credentials are answered immediately, and
+    identical attempts that arrive while a check is running share it.
+    """
+
+    def __init__(self, creds, cache_size=1024):
+        self.creds = creds
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.waiting = {}
+
+    def cacheKey(self, username, password):
+        if password is None:
+            return (username, None)
+        if not isinstance(password, bytes):
+            password = str(password).encode("utf-8")
+        return (username, hashlib.sha256(password).digest())
+
+    def __call__(self, username=None, password=None):
+        creds = [c for c in self.creds if usernameMatches(c, username)]
+        if not creds:
+            return succeed(False)
+        if any(c.get("password", None) is None for c in creds):
+            return succeed(True)
+
+        key = self.cacheKey(username, password)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return succeed(self.cache[key])
+
+        if key in self.waiting:
+            d = Deferred()
+            self.waiting[key].append(d)
+            return d
+
+        self.waiting[key] = []
+        d = deferToThreadPool(
+            reactor, getThreadPool(), testManyCreds, creds, username, password
+        )
+        d.addBoth(self.remember, key)
+        return d
+
+    def remember(self, result, key):
+        if not isinstance(result, Failure):
+            self.cache[key] = result
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        for d in self.waiting.pop(key, []):
+            d.callback(result)
+        return result
@@ -0,0 +1,103 @@
+"""
+Registry of the built-in modules, imported only when enabled.
+
+Importing every module up front pulls in conch, cryptography, jinja2,
+ntlmlib and the rest even on a sensor running two services, so the
+registry maps each module's NAME to the import path of its class and
+the tac imports just the enabled ones. Every import, instantiation and
+getService/startYourEngines call is timed, and the timings are printed
+when OpenCanary is started with --profile-startup.
+"""
+
+import importlib
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+MODULES = {
+    "ftp": "opencanary.modules.ftp.CanaryFTP",
+    "git": "opencanary.modules.git.CanaryGit",
+    "http": "opencanary.modules.http.CanaryHTTP",
+    "https": "opencanary.modules.https.CanaryHTTPS",
+    "mongodb": "opencanary.modules.mongodb.CanaryMongoDB",
+    "mysql": "opencanary.modules.mysql.CanaryMySQL",
+    "ntp": "opencanary.modules.ntp.CanaryNtp",
+    "rdp": "opencanary.modules.rdp.CanaryRDP",
+    "redis": "opencanary.modules.redis.CanaryRedis",
+    "SIP": "opencanary.modules.sip.CanarySIP",
+    "ssh": "opencanary.modules.ssh.CanarySSH",
+    "tcpbanner": "opencanary.modules.tcpbanner.CanaryTCPBanner",
+    "tftp": "opencanary.modules.tftp.CanaryTftp",
+    "VNC": "opencanary.modules.vnc.CanaryVNC",
+    "httpproxy": "opencanary.modules.httpproxy.HTTPProxy",
+    "mssql": "opencanary.modules.mssql.MSSQL",
+    "telnet": "opencanary.modules.telnet.Telnet",
+    # "example0": "opencanary.modules.example0.CanaryExample0",
+    # "example1": "opencanary.modules.example1.CanaryExample1",
+    # Modules need Scapy, but the rest of OpenCanary doesn't
+    "SNMP": "opencanary.modules.snmp.CanarySNMP",
+    "llmnr": "opencanary.modules.llmnr.CanaryLLMNR",
+    # NB: these depend on inotify, only available on linux
+    "smb": "opencanary.modules.samba.CanarySamba",
+    "portscan": "opencanary.modules.portscan.CanaryPortscan",
+}
+
+NEEDS_SCAPY = ("SNMP", "llmnr")
+LINUX_ONLY = ("smb", "portscan")
+
+PROFILE_ENV = "OPENCANARY_PROFILE_STARTUP"
+
+
+def loadModule(path):
+    """Import and return the class at a "package.module.Class" path"""
+    modname, classname = path.rsplit(".", 1)
+    return getattr(importlib.import_module(modname), classname)
+
+
+def enabledModules(config, is_docker, profile):
+    """Import and return the classes of the enabled built-in modules"""
+    modules = []
+    for name, path in MODULES.items():
+        if not config.moduleEnabled(name):
+            continue
+        if name in LINUX_ONLY and not sys.platform.startswith("linux"):
+            continue
+        if name == "portscan" and is_docker():
+            # Remove portscan if running in DOCKER (specified in Dockerfile)
+            print("Can't use portscan in Docker. Portscan module disabled.")
+            continue
+        try:
+            with profile.timed(name, "import"):
+                modules.append(loadModule(path))
+        except ImportError:
+            if name not in NEEDS_SCAPY:
+                raise
+            print("Can't import %s. Please ensure you have Scapy installed." % name)
+    return modules
+
+
+class StartupProfile(object):
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.steps = []
+
+    @contextmanager
+    def timed(self, module, step):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((module, step, time.perf_counter() - start))
+
+    def enabled(self):
+        return bool(os.environ.get(PROFILE_ENV))
+
+    def report(self):
+        lines = ["Startup profile (slowest first):"]
+        for module, step, duration in sorted(self.steps, key=lambda s: -s[2]):
+            lines.append("%9.1fms %-12s %s" % (duration * 1000, module, step))
+        lines.append(
+            "%9.1fms total" % ((time.perf_counter() - self.start) * 1000),
+        )
+        return "\n".join(lines)
@@ -1,16 +1,97 @@
 from copy import deepcopy
-import simplejson as json
+import json
 import logging.config
-import socket
 import hpfeeds
+import socket
+import struct
 import sys
+import threading
+import time
 
-from datetime import datetime
-from logging.handlers import SocketHandler
+from collections import deque
 from twisted.internet import reactor
+from twisted.internet.interfaces import IHalfCloseableProtocol, IPushProducer
+from twisted.internet.protocol import Protocol, ReconnectingClientFactory
+from zope.interface import implementer
 import requests
+from requests.adapters import HTTPAdapter
+
+from opencanary.aggregate import EventAggregator
+from opencanary.iphelper import IPRangeSet
+from opencanary.metrics import instrumentHandler, registry
+from opencanary.spool import MemorySpool, SegmentSpool
+
+try:
+    # Optional, much faster JSON encoder
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import fcntl
+    import termios
+
+    # On Linux, the bytes in a TCP socket's send queue that the peer has
+    # not acknowledged yet (SIOCOUTQ)
+    TIOCOUTQ = termios.TIOCOUTQ if sys.platform.startswith("linux") else None
+except ImportError:
+    fcntl = TIOCOUTQ = None
+
+
+def _json_default(obj):
+    # Modules log some values (e.g. SSH and MySQL usernames) as raw bytes.
+    # These are decoded as UTF-8, with undecodable bytes written as \xNN
+    # escapes, so that a malformed username never costs us the event.
+    if isinstance(obj, (bytes, bytearray)):
+        return bytes(obj).decode("utf-8", "backslashreplace")
+    raise TypeError(
+        "Object of type %s is not JSON serializable" % obj.__class__.__name__
+    )
+
+
+def json_dumps(data):
+    """
+    Serialize an event to a compact JSON string with sorted keys.
 
-from opencanary.iphelper import check_ip
+    Uses orjson when it is installed, otherwise the standard library,
+    which is set up to give the same output byte for byte: no spaces
+    after separators and non-ASCII characters written as they are.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(
+                data,
+                default=_json_default,
+                option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+            ).decode("utf-8")
+        except TypeError:
+            # e.g. integers wider than 64 bits, which orjson refuses
+            pass
+    return json.dumps(
+        data,
+        sort_keys=True,
+        default=_json_default,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+
+
+def record_event(record):
+    """
+    Return the event dict behind a log record emitted by PyLogger.log,
+    falling back to parsing the message for records from elsewhere.
+    """
+    event = getattr(record, "event", None)
+    if event is None:
+        event = json.loads(record.getMessage())
+    return event
+
+
+def text(value):
+    """Render a logged value for display in a chat message"""
+    if isinstance(value, (bytes, bytearray)):
+        return _json_default(value)
+    return str(value)
 
 
 class Singleton(type):
@@ -61,6 +142,8 @@ class LoggerBase(object):
     LOG_BASE_PING = 1004
     LOG_BASE_CONFIG_SAVE = 1005
     LOG_BASE_EXAMPLE = 1006
+    LOG_BASE_SUMMARY = 1007
+    LOG_BASE_RATE_LIMITED = 1008
     LOG_FTP_LOGIN_ATTEMPT = 2000
     LOG_FTP_AUTH_ATTEMPT_INITIATED = 2001
     LOG_HTTP_GET = 3000
@@ -109,11 +192,49 @@ class LoggerBase(object):
     LOG_USER_8 = 99008
     LOG_USER_9 = 99009
 
+    TIMESTAMP_MODES = (None, "epoch", "iso8601")
+
+    # Optional extra "timestamp" field: None, "epoch" or "iso8601"
+    timestamp_mode = None
+
+    # Formatted second prefixes are cached; only microseconds change
+    # between events logged within the same second
+    _stamp_second = None
+    _stamp_utc = None
+    _stamp_local = None
+    _stamp_iso = None
+
+    def timestamps(self):
+        """
+        Read the clock once and return (seconds, microseconds, utc, local)
+        """
+        second, micro = divmod(time.time_ns() // 1000, 1000000)
+        if second != self._stamp_second:
+            utc = time.gmtime(second)
+            self._stamp_utc = time.strftime("%Y-%m-%d %H:%M:%S", utc)
+            self._stamp_iso = time.strftime("%Y-%m-%dT%H:%M:%S", utc)
+            self._stamp_local = time.strftime(
+                "%Y-%m-%d %H:%M:%S", time.localtime(second)
+            )
+            self._stamp_second = second
+        fraction = ".%06d" % micro
+        return (
+            second,
+            micro,
+            self._stamp_utc + fraction,
+            self._stamp_local + fraction,
+        )
+
     def sanitizeLog(self, logdata):
+        second, micro, utc, local = self.timestamps()
         logdata["node_id"] = self.node_id
-        logdata["local_time"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
-        logdata["utc_time"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
-        logdata["local_time_adjusted"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+        logdata["local_time"] = utc
+        logdata["utc_time"] = utc
+        logdata["local_time_adjusted"] = local
+        if self.timestamp_mode == "epoch":
+            logdata["timestamp"] = second + micro / 1000000
+        elif self.timestamp_mode == "iso8601":
+            logdata["timestamp"] = "%s.%06dZ" % (self._stamp_iso, micro)
         if "src_host" not in logdata:
             logdata["src_host"] = ""
         if "src_port" not in logdata:
@@ -136,8 +257,11 @@ class PyLogger(LoggerBase):
 
     __metaclass__ = Singleton
 
-    def __init__(self, config, handlers, formatters={}):
+    def __init__(self, config, handlers, formatters={}, timestamp=None):
         self.node_id = config.getVal("device.node_id")
+        if timestamp not in self.TIMESTAMP_MODES:
+            raise ValueError("Unknown timestamp mode %r" % timestamp)
+        self.timestamp_mode = timestamp
 
         # Build config dict to initialise
         # Ensure all handlers don't drop logs based on severity level
@@ -161,14 +285,27 @@ class PyLogger(LoggerBase):
             exit(1)
 
         # Check if ignorelist is populated
-        self.ip_ignorelist = config.getVal("ip.ignorelist", default=[])
+        self.ip_ignorelist = IPRangeSet(config.getVal("ip.ignorelist", default=[]))
         self.logtype_ignorelist = config.getVal("logtype.ignorelist", default=[])
 
+        self.aggregator = None
+        if config.getVal("aggregate.enabled", default=False):
+            self.aggregator = EventAggregator(
+                self.logSummary,
+                window=config.getVal("aggregate.window", default=60),
+                max_keys=config.getVal("aggregate.max_keys", default=10000),
+                sample_size=config.getVal("aggregate.sample_size", default=5),
+                max_duration=config.getVal("aggregate.max_duration", default=0),
+            )
+
         self.logger = logging.getLogger(self.node_id)
+        if config.getVal("metrics.enabled", default=False):
+            for handler in self.logger.handlers:
+                instrumentHandler(handler)
 
     def error(self, data):
-        data["local_time"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
-        msg = "[ERR] %r" % json.dumps(data, sort_keys=True)
+        data["local_time"] = self.timestamps()[2]
+        msg = "[ERR] %r" % json_dumps(data)
         print(msg, file=sys.stderr)
         self.logger.warn(msg)
 
@@ -176,59 +313,341 @@ class PyLogger(LoggerBase):
         logdata = self.sanitizeLog(logdata)
         # Log only if not in ignorelist
         notify = True
-        if "src_host" in logdata:
-            for ip in self.ip_ignorelist:
-                if check_ip(logdata["src_host"], ip) is True:
-                    notify = False
-                    break
+        if "src_host" in logdata and logdata["src_host"] in self.ip_ignorelist:
+            notify = False
+            registry.countIgnored(logdata, "ip")
 
-        if "logtype" in logdata and logdata["logtype"] in self.logtype_ignorelist:
+        elif "logtype" in logdata and logdata["logtype"] in self.logtype_ignorelist:
             notify = False
+            registry.countIgnored(logdata, "logtype")
 
         if notify is True:
-            self.logger.warn(json.dumps(logdata, sort_keys=True))
+            if self.aggregator is not None and not self.aggregator.add(logdata):
+                registry.countAggregated(logdata)
+                return
+            self.emit(logdata)
+
+    def emit(self, logdata):
+        registry.countEvent(logdata)
+        # The event dict rides along on the record so handlers that
+        # need structured data don't have to parse the message again
+        self.logger.warn(json_dumps(logdata), extra={"event": logdata})
+
+    def logSummary(self, src_host, dst_host, dst_port, summary):
+        """Log the summary of events absorbed by the aggregator"""
+        self.emit(
+            self.sanitizeLog(
+                {
+                    "logtype": self.LOG_BASE_SUMMARY,
+                    "src_host": src_host,
+                    "dst_host": dst_host,
+                    "dst_port": dst_port,
+                    "logdata": summary,
+                }
+            )
+        )
+
+
+def unacknowledgedBytes(transport):
+    """The kernel's count of bytes the peer has yet to acknowledge, or None"""
+    if TIOCOUTQ is None:
+        return None
+    try:
+        fd = transport.getHandle().fileno()
+        return struct.unpack("i", fcntl.ioctl(fd, TIOCOUTQ, b"\0" * 4))[0]
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+@implementer(IHalfCloseableProtocol)
+class SocketJSONProtocol(Protocol):
+    """Client side of the connection to a SocketJSONHandler collector"""
+
+    def connectionMade(self):
+        self.transport.setTcpKeepAlive(1)
+        self.factory.handler.connectionMade(self.transport)
+
+    def readConnectionLost(self):
+        # The collector has closed its end. The socket is still open, so
+        # the kernel can say what was acknowledged before it went.
+        self.factory.handler.confirm()
+        self.transport.loseConnection()
+
+    def writeConnectionLost(self):
+        pass
+
+    def connectionLost(self, reason):
+        self.factory.handler.connectionLost()
+
 
+class SocketJSONFactory(ReconnectingClientFactory):
+    protocol = SocketJSONProtocol
+    noisy = False
 
-class SocketJSONHandler(SocketHandler):
-    """Emits JSON messages over TCP delimited by newlines ('\n')"""
+    def __init__(self, handler, retry_interval):
+        self.handler = handler
+        self.initialDelay = self.maxDelay = retry_interval
+        self.factor = 1
 
-    def makeSocket(self, timeout=1):
-        s = SocketHandler.makeSocket(self, timeout)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-        return s
+    def buildProtocol(self, addr):
+        self.resetDelay()
+        return ReconnectingClientFactory.buildProtocol(self, addr)
 
-    def __init__(self, *args, **kwargs):
-        SocketHandler.__init__(self, *args, **kwargs)
-        self.retryStart = 0
-        self.retryMax = 0
-        self.retryFactor = 0
 
-    def send(self, s, attempt=0):
-        if attempt >= 10:
-            print("Dropping log message due to too many failed sends")
+@implementer(IPushProducer)
+class SocketJSONHandler(logging.Handler):
+    """
+    Emits JSON messages over TCP delimited by newlines ('\n')
+
+    The connection is an ordinary non-blocking Twisted client. Messages
+    logged during one reactor iteration are coalesced into a single write,
+    or written straight away once flush_bytes or flush_count of them have
+    queued up. The handler is registered as the transport's producer, so
+    when the collector can't keep up it is paused and messages accumulate
+    in the spool instead of in the transport's buffer.
+
+    Messages that can't be sent while the collector is unreachable are
+    buffered in a spool and replayed in order once a single reconnect loop
+    (every retry_interval seconds) gets through again. The spool lives in
+    memory by default; set spool_dir to keep it on disk, which also
+    survives restarts. spool_max_bytes bounds either kind of spool, oldest
+    messages being dropped first.
+
+    A write to the transport only means the data reached the transport's
+    buffer. Until the collector has acknowledged it, it could still be
+    lost with the connection, so the handler keeps the messages it wrote
+    that may not have been acknowledged and, if the connection drops,
+    writes them again ahead of the spool. How much that is comes from the
+    bytes still in the transport's buffer, which the handler counts, plus
+    the kernel's count of unacknowledged bytes in the socket's send queue
+    (SIOCOUTQ). The kept messages are checked against it as they are
+    written, confirm_interval seconds later and when the collector closes
+    the connection, so only messages sent just before a connection is cut
+    are written twice. Where the kernel's count is not available, as
+    many bytes as the transport's buffer and SO_SNDBUF can hold are kept.
+    """
+
+    def __init__(
+        self,
+        host,
+        port,
+        spool_dir=None,
+        spool_max_bytes=64 * 1024 * 1024,
+        spool_segment_bytes=4 * 1024 * 1024,
+        retry_interval=1.5,
+        flush_bytes=64 * 1024,
+        flush_count=256,
+        confirm_interval=1.0,
+    ):
+        logging.Handler.__init__(self)
+        self.host = host
+        self.port = int(port)
+        self.flush_bytes = flush_bytes
+        self.flush_count = flush_count
+        self.confirm_interval = confirm_interval
+
+        if spool_dir is None:
+            self.spool = MemorySpool(spool_max_bytes)
+        else:
+            self.spool = SegmentSpool(spool_dir, spool_max_bytes, spool_segment_bytes)
+
+        self.pending = []
+        self.pending_bytes = 0
+        self.flush_call = None
+        self.transport = None
+        self.paused = False
+        # Written but possibly not yet acknowledged by the collector
+        self.unconfirmed = deque()
+        self.unconfirmed_bytes = 0
+        self.unconfirmed_max = 0
+        self.sndbuf = 0
+        self.confirm_call = None
+        # Bytes written to the transport, and passed on to the kernel by
+        # it, on the current connection; None if the latter is unknown
+        self.written = 0
+        self.sent = None
+        # Unconfirmed messages from a lost connection, to write first
+        self.resend = deque()
+
+        self.factory = SocketJSONFactory(self, retry_interval)
+        reactor.callWhenRunning(reactor.connectTCP, self.host, self.port, self.factory)
+
+    def stats(self):
+        """Queue and in-flight gauges"""
+        return {
+            "connected": self.transport is not None,
+            "paused": self.paused,
+            "queued": len(self.pending),
+            "queued_bytes": self.pending_bytes,
+            "spooled_bytes": len(self.spool),
+            "in_flight_bytes": self.unconfirmed_bytes,
+            "resend_bytes": sum(map(len, self.resend)),
+            "dropped": self.spool.dropped,
+        }
+
+    def connectionMade(self, transport):
+        self.transport = transport
+        self.paused = False
+        try:
+            self.sndbuf = transport.getHandle().getsockopt(
+                socket.SOL_SOCKET, socket.SO_SNDBUF
+            )
+        except (AttributeError, OSError):
+            self.sndbuf = 4 * 1024 * 1024
+        # The transport pauses us once it holds more than bufferSize, which
+        # the write that crossed the line can overshoot by flush_bytes
+        buffer_size = getattr(transport, "bufferSize", 64 * 1024)
+        self.unconfirmed_max = self.sndbuf + buffer_size + self.flush_bytes
+        self.countSent(transport)
+        transport.registerProducer(self, True)
+        self.replay()
+
+    def countSent(self, transport):
+        """Count the bytes the transport hands on to the kernel"""
+        self.written = 0
+        self.sent = None
+        writeSomeData = getattr(transport, "writeSomeData", None)
+        if writeSomeData is None:
             return
+        self.sent = 0
 
-        if self.sock is None:
-            self.createSocket()
+        def countingWriteSomeData(data):
+            n = writeSomeData(data)
+            if isinstance(n, int) and n > 0:
+                self.sent += n
+            return n
 
-        if self.sock:
-            try:
-                # TODO: Weirdly, one the other ends drops the
-                # connection for the next msg, sendall still reports
-                # successful write on a disconnected socket but then
-                # on subsequent writes it fails correctly.
-                self.sock.sendall(s.encode("utf-8"))
-                return
-            except socket.error:
-                self.sock.close()
-                self.sock = None
+        transport.writeSomeData = countingWriteSomeData
+
+    def connectionLost(self):
+        self.transport = None
+        if self.confirm_call is not None and self.confirm_call.active():
+            self.confirm_call.cancel()
+        self.confirm_call = None
+        # Older than anything left in resend from an earlier connection
+        self.resend.extendleft(reversed(self.unconfirmed))
+        self.unconfirmed.clear()
+        self.unconfirmed_bytes = 0
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self.confirm(drained=True)
+        self.replay()
+
+    def stopProducing(self):
+        self.paused = True
+
+    def writable(self):
+        return self.transport is not None and not self.paused
+
+    def write(self, data):
+        self.transport.write(data)
+        self.written += len(data)
+        self.unconfirmed.append(data)
+        self.unconfirmed_bytes += len(data)
+        self.confirm()
+
+    def unacknowledged(self, drained=False):
+        """How many of the bytes last written the collector may not have"""
+        queued = None
+        if self.sent is not None:
+            queued = unacknowledgedBytes(self.transport)
+        if queued is not None:
+            return self.written - self.sent + queued
+        # Assume the worst, though once the transport has resumed us its
+        # buffer is empty and only the kernel's send buffer can hold any
+        return self.sndbuf if drained else self.unconfirmed_max
+
+    def confirm(self, drained=False):
+        """Forget the written messages the collector has acknowledged"""
+        if self.transport is None:
+            return
+        limit = self.unacknowledged(drained)
+        while (
+            self.unconfirmed
+            and self.unconfirmed_bytes - len(self.unconfirmed[0]) >= limit
+        ):
+            self.unconfirmed_bytes -= len(self.unconfirmed.popleft())
+        if self.unconfirmed and self.confirm_call is None:
+            self.confirm_call = reactor.callLater(
+                self.confirm_interval, self.confirmLater
+            )
 
-        # Here, we've failed to send s so retry
-        reactor.callLater(1.5, lambda x: self.send(s, attempt + 1), None)
+    def confirmLater(self):
+        self.confirm_call = None
+        self.confirm()
+
+    def replay(self):
+        """Write out the spool in order, for as long as the transport allows"""
+        while self.writable() and self.resend:
+            self.write(self.resend.popleft())
+        while self.writable() and len(self.spool):
+            chunk = self.spool.peek(self.flush_bytes)
+            if not chunk:
+                break
+            self.write(chunk)
+            self.spool.ack(len(chunk))
+        if self.pending:
+            self.flush()
+
+    def flush(self):
+        if self.flush_call is not None and self.flush_call.active():
+            self.flush_call.cancel()
+        self.flush_call = None
+        if not self.pending:
+            return
+
+        pending = self.pending
+        self.pending = []
+        self.pending_bytes = 0
+        # Anything already spooled has to go out first to keep the order
+        if self.writable() and not self.resend and not len(self.spool):
+            self.write(b"".join(pending))
+            return
+
+        dropped = self.spool.dropped
+        for data in pending:
+            self.spool.append(data)
+        if self.spool.dropped != dropped:
+            print("Dropping log messages as the spool is full")
+
+    def send(self, s):
+        data = s.encode("utf-8")
+        self.pending.append(data)
+        self.pending_bytes += len(data)
+        if (
+            self.pending_bytes >= self.flush_bytes
+            or len(self.pending) >= self.flush_count
+        ):
+            self.flush()
+        elif self.flush_call is None:
+            self.flush_call = reactor.callLater(0, self.flush)
 
     def makePickle(self, record):
         return record.getMessage() + "\n"
 
+    def emit(self, record):
+        try:
+            self.send(self.makePickle(record))
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        # Whatever hasn't been written yet belongs in the spool. Messages
+        # from a lost connection go to the back of a disk spool, which is
+        # the one case where they can be replayed out of order.
+        self.paused = True
+        while self.resend:
+            self.spool.append(self.resend.popleft())
+        self.flush()
+        self.factory.stopTrying()
+        if self.transport is not None:
+            self.transport.loseConnection()
+        logging.Handler.close(self)
+
 
 class HpfeedsHandler(logging.Handler):
     def __init__(self, host, port, ident, secret, channels):
@@ -250,38 +669,316 @@ class HpfeedsHandler(logging.Handler):
             print("Error on publishing to server")
 
 
-class SlackHandler(logging.Handler):
-    def __init__(self, webhook_url):
+class AsyncHTTPHandler(logging.Handler):
+    """
+    Base class for handlers that deliver alerts over HTTP.
+
+    emit() runs on the reactor thread, so it only queues the record. A
+    small pool of worker threads performs the requests using a shared
+    keep-alive session, which means a slow or dead endpoint can no longer
+    stall the honeypot services.
+
+    The queue is bounded by queue_size. When it is full, the overflow
+    policy decides whether the new alert ("drop_new") or the oldest queued
+    alert ("drop_oldest") is discarded. Requests that fail with a
+    connection error or a 5xx/429 response are retried up to retries times.
+
+    Setting batch_size above 1 turns on batching: a worker collects up to
+    batch_size alerts (or batch_max_bytes of message text) for at most
+    batch_window_ms milliseconds and hands them to deliver_batch() as a
+    single request. deliver_batch() is then used for every request, even a
+    batch of one, so receivers always see the same payload format.
+    """
+
+    OVERFLOW_POLICIES = ("drop_new", "drop_oldest")
+
+    def __init__(
+        self,
+        queue_size=1000,
+        workers=2,
+        overflow="drop_new",
+        retries=2,
+        retry_delay=1.0,
+        batch_size=1,
+        batch_window_ms=1000,
+        batch_max_bytes=None,
+    ):
         logging.Handler.__init__(self)
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(
+                "Unknown overflow policy %r (expected one of %s)"
+                % (overflow, ", ".join(self.OVERFLOW_POLICIES))
+            )
+        if int(retries) < 0:
+            raise ValueError("retries must be 0 or more, not %r" % (retries,))
+        self.queue_size = int(queue_size)
+        self.overflow = overflow
+        self.retries = int(retries)
+        self.retry_delay = float(retry_delay)
+        self.batch_size = max(1, int(batch_size))
+        self.batch_window = float(batch_window_ms) / 1000
+        self.batch_max_bytes = batch_max_bytes
+
+        self.queue = deque()
+        self.queue_cond = threading.Condition()
+        self.stats_lock = threading.Lock()
+        self.delivered = 0
+        self.dropped = 0
+        self.retried = 0
+
+        workers = max(1, int(workers))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.shutting_down = False
+        self.workers = []
+        for i in range(workers):
+            t = threading.Thread(
+                target=self.worker,
+                name="%s-%d" % (self.__class__.__name__, i),
+                daemon=True,
+            )
+            t.start()
+            self.workers.append(t)
+
+    def stats(self):
+        """Delivery counters and current queue depth"""
+        with self.stats_lock:
+            return {
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+                "retried": self.retried,
+                "queued": len(self.queue),
+            }
+
+    def count(self, counter, n=1):
+        with self.stats_lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def prepare(self, record):
+        """
+        Turn a log record into a queue item, or return None to skip it.
+
+        Called on the reactor thread, so keep it cheap.
+        """
+        return record
+
+    def item_size(self, item):
+        """Approximate payload size of a queue item, for batch_max_bytes"""
+        if isinstance(item, logging.LogRecord):
+            return len(item.getMessage())
+        return len(item)
+
+    def deliver(self, item):
+        """Send one queue item and return the requests response"""
+        raise NotImplementedError
+
+    def deliver_batch(self, items):
+        """Send several queue items as one request and return the response"""
+        raise NotImplementedError
+
+    def is_success(self, response):
+        return response.status_code == 200
+
+    def report_failure(self, response):
+        print(
+            "Error %s sending %s payload, the response was:\n%s"
+            % (response.status_code, self.__class__.__name__, response.text)
+        )
+
+    def emit(self, record):
+        item = self.prepare(record)
+        if item is None:
+            return
+
+        with self.queue_cond:
+            if len(self.queue) >= self.queue_size:
+                self.count("dropped")
+                if self.overflow == "drop_new":
+                    return
+                self.queue.popleft()
+            self.queue.append(item)
+            self.queue_cond.notify()
+
+    def worker(self):
+        while True:
+            with self.queue_cond:
+                while not self.queue and not self.shutting_down:
+                    self.queue_cond.wait()
+                if not self.queue:
+                    return
+                batch = self.take_batch()
+            self.send(batch)
+
+    def take_batch(self):
+        """
+        Pop the next batch off the queue. Must be called with queue_cond held.
+        """
+        batch = [self.queue.popleft()]
+        if self.batch_size == 1:
+            return batch
+
+        size = self.item_size(batch[0]) if self.batch_max_bytes else 0
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.batch_size:
+            if not self.queue:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self.shutting_down:
+                    break
+                self.queue_cond.wait(remaining)
+                continue
+            if self.batch_max_bytes:
+                size += self.item_size(self.queue[0])
+                if size > self.batch_max_bytes:
+                    break
+            batch.append(self.queue.popleft())
+        return batch
+
+    def send(self, batch):
+        n = len(batch)
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.count("retried", n)
+                time.sleep(self.retry_delay * attempt)
+            try:
+                if self.batch_size == 1:
+                    response = self.deliver(batch[0])
+                else:
+                    response = self.deliver_batch(batch)
+            except requests.RequestException as e:
+                error = e
+                continue
+            except Exception as e:
+                # Not worth retrying (e.g. a record we can't render), but it
+                # mustn't take the worker thread down with it
+                print("Error building %s payload: %s" % (self.__class__.__name__, e))
+                self.count("dropped", n)
+                return
+
+            if self.is_success(response):
+                self.count("delivered", n)
+                return
+            if response.status_code < 500 and response.status_code != 429:
+                self.report_failure(response)
+                self.count("dropped", n)
+                return
+            error = None
+
+        if error is None:
+            self.report_failure(response)
+        else:
+            print("Error sending %s payload: %s" % (self.__class__.__name__, error))
+        self.count("dropped", n)
+
+    def close(self):
+        """Let the workers drain the queue before shutting down"""
+        with self.queue_cond:
+            self.shutting_down = True
+            self.queue_cond.notify_all()
+        for t in self.workers:
+            t.join(timeout=5)
+        self.session.close()
+        logging.Handler.close(self)
+
+
+class SlackHandler(AsyncHTTPHandler):
+    def __init__(self, webhook_url, timeout=10, **kwargs):
+        AsyncHTTPHandler.__init__(self, **kwargs)
         self.webhook_url = webhook_url
+        self.timeout = timeout
 
-    def generate_msg(self, alert):
+    def attachment(self, alert):
         msg = {}
         msg["pretext"] = "OpenCanary Alert"
-        data = json.loads(alert.msg)
+        data = record_event(alert)
         msg["fields"] = []
-        for k, v in data.items():
-            msg["fields"].append(
-                {"title": k, "value": json.dumps(v) if type(v) is dict else v}
-            )
-        return {"attachments": [msg]}
+        for k, v in sorted(data.items()):
+            if isinstance(v, dict):
+                v = json_dumps(v)
+            elif isinstance(v, (bytes, bytearray)):
+                v = text(v)
+            msg["fields"].append({"title": k, "value": v})
+        return msg
 
-    def emit(self, record):
+    def generate_msg(self, alert):
+        return {"attachments": [self.attachment(alert)]}
+
+    def generate_digest(self, alerts):
+        return {
+            "text": "%d OpenCanary Alerts" % len(alerts),
+            "attachments": [self.attachment(alert) for alert in alerts],
+        }
+
+    def deliver(self, record):
         data = self.generate_msg(record)
-        response = requests.post(self.webhook_url, json=data)
-        if response.status_code != 200:
-            print(
-                "Error %s sending Slack message, the response was:\n%s"
-                % (response.status_code, response.text)
-            )
+        return self.session.post(self.webhook_url, json=data, timeout=self.timeout)
 
+    def deliver_batch(self, records):
+        if len(records) == 1:
+            return self.deliver(records[0])
+        data = self.generate_digest(records)
+        return self.session.post(self.webhook_url, json=data, timeout=self.timeout)
 
-class TeamsHandler(logging.Handler):
-    def __init__(self, webhook_url):
-        logging.Handler.__init__(self)
+    def report_failure(self, response):
+        print(
+            "Error %s sending Slack message, the response was:\n%s"
+            % (response.status_code, response.text)
+        )
+
+
+class TeamsHandler(AsyncHTTPHandler):
+    def __init__(self, webhook_url, timeout=10, **kwargs):
+        AsyncHTTPHandler.__init__(self, **kwargs)
         self.webhook_url = webhook_url
+        self.timeout = timeout
 
     def message(self, data):
+        return self.card([data], "OpenCanary Alert")
+
+    def card(self, alerts, title):
+        body = [
+            {
+                "type": "ColumnSet",
+                "columns": [
+                    {
+                        "type": "Column",
+                        "width": "auto",
+                        "items": [
+                            {
+                                "type": "Image",
+                                "url": "https://resources.canary.tools/images/open-canary-green_logo.png",
+                                "width": "82px",
+                                "horizontalAlignment": "Left",
+                            }
+                        ],
+                    },
+                    {
+                        "type": "Column",
+                        "items": [
+                            {
+                                "type": "TextBlock",
+                                "text": "\u00a0",
+                                "size": "Small",
+                            },
+                            {
+                                "type": "TextBlock",
+                                "text": title,
+                                "weight": "Bolder",
+                                "size": "ExtraLarge",
+                            },
+                        ],
+                    },
+                ],
+            },
+        ]
+        for i, data in enumerate(alerts):
+            factset = {"type": "FactSet", "facts": self.facts(data)}
+            if i:
+                factset["separator"] = True
+            body.append(factset)
+
         return {
             "attachments": [
                 {
@@ -290,42 +987,7 @@ class TeamsHandler(logging.Handler):
                         "type": "AdaptiveCard",
                         "$schema": "https://adaptivecards.io/schemas/adaptive-card.json",
                         "version": "1.5",
-                        "body": [
-                            {
-                                "type": "ColumnSet",
-                                "columns": [
-                                    {
-                                        "type": "Column",
-                                        "width": "auto",
-                                        "items": [
-                                            {
-                                                "type": "Image",
-                                                "url": "https://resources.canary.tools/images/open-canary-green_logo.png",
-                                                "width": "82px",
-                                                "horizontalAlignment": "Left",
-                                            }
-                                        ],
-                                    },
-                                    {
-                                        "type": "Column",
-                                        "items": [
-                                            {
-                                                "type": "TextBlock",
-                                                "text": "\u00a0",
-                                                "size": "Small",
-                                            },
-                                            {
-                                                "type": "TextBlock",
-                                                "text": "OpenCanary Alert",
-                                                "weight": "Bolder",
-                                                "size": "ExtraLarge",
-                                            },
-                                        ],
-                                    },
-                                ],
-                            },
-                            {"type": "FactSet", "facts": self.facts(data)},
-                        ],
+                        "body": body,
                     },
                 }
             ]
@@ -333,25 +995,39 @@ class TeamsHandler(logging.Handler):
 
     def facts(self, data, prefix=None):
         facts = []
-        for k, v in data.items():
+        for k, v in sorted(data.items(), key=lambda item: str(item[0])):
             key = str(k).lower() if prefix is None else prefix + "__" + str(k).lower()
-            if type(v) is not dict:
-                facts.append({"title": key, "value": str(v)})
+            if not isinstance(v, dict):
+                facts.append({"title": key, "value": text(v)})
             else:
                 nested = self.facts(v, key)
                 facts.extend(nested)
         return facts
 
-    def emit(self, record):
-        data = json.loads(record.msg)
-        payload = self.message(data)
+    def deliver(self, record):
+        data = record_event(record)
+        return self.post(self.message(data))
+
+    def deliver_batch(self, records):
+        if len(records) == 1:
+            return self.deliver(records[0])
+        alerts = [record_event(record) for record in records]
+        return self.post(self.card(alerts, "%d OpenCanary Alerts" % len(alerts)))
+
+    def post(self, payload):
         headers = {"Content-Type": "application/json"}
-        response = requests.post(self.webhook_url, headers=headers, json=payload)
-        if response.status_code != 202:
-            print(
-                "Error %s sending Teams message, the response was:\n%s"
-                % (response.status_code, response.text)
-            )
+        return self.session.post(
+            self.webhook_url, headers=headers, json=payload, timeout=self.timeout
+        )
+
+    def is_success(self, response):
+        return response.status_code == 202
+
+    def report_failure(self, response):
+        print(
+            "Error %s sending Teams message, the response was:\n%s"
+            % (response.status_code, response.text)
+        )
 
 
 def map_string(data, mapping):
@@ -375,46 +1051,95 @@ def map_string(data, mapping):
     return data
 
 
-class WebhookHandler(logging.Handler):
+class WebhookHandler(AsyncHTTPHandler):
     def __init__(
-        self, url, method="POST", data=None, status_code=200, ignore=None, **kwargs
+        self,
+        url,
+        method="POST",
+        data=None,
+        status_code=200,
+        ignore=None,
+        queue_size=1000,
+        workers=2,
+        overflow="drop_new",
+        retries=2,
+        retry_delay=1.0,
+        batch_size=1,
+        batch_window_ms=1000,
+        batch_max_bytes=None,
+        batch_format="json",
+        **kwargs,
     ):
-        logging.Handler.__init__(self)
+        AsyncHTTPHandler.__init__(
+            self,
+            queue_size=queue_size,
+            workers=workers,
+            overflow=overflow,
+            retries=retries,
+            retry_delay=retry_delay,
+            batch_size=batch_size,
+            batch_window_ms=batch_window_ms,
+            batch_max_bytes=batch_max_bytes,
+        )
+        if batch_format not in ("json", "ndjson"):
+            raise ValueError("Unknown batch_format %r" % batch_format)
+        self.batch_format = batch_format
         self.url = url
         self.method = method
         self.data = data
         self.status_code = status_code
         self.ignore = ignore
         self.kwargs = kwargs
+        # A worker blocked forever on a dead endpoint would never recover
+        self.kwargs.setdefault("timeout", 10)
 
-    def emit(self, record):
+    def prepare(self, record):
         message = self.format(record)
         if self.ignore is not None:
             if any(e in message for e in self.ignore):
-                return
+                return None
+        return message
 
+    def payload(self, message):
         mapping = {"message": message}
         if self.data is None:
-            data = mapping
+            return mapping
+        if isinstance(self.data, dict):
+            # Casting logging.config.ConvertingDict to a standard dict
+            data = dict(self.data)
         else:
-            if isinstance(self.data, dict):
-                # Casting logging.config.ConvertingDict to a standard dict
-                data = dict(self.data)
-            else:
-                data = self.data
-            data = map_string(deepcopy(data), mapping)
+            data = self.data
+        return map_string(deepcopy(data), mapping)
+
+    def deliver_batch(self, messages):
+        payloads = [self.payload(message) for message in messages]
+        if self.batch_format == "ndjson":
+            kwargs = dict(self.kwargs)
+            kwargs["headers"] = dict(kwargs.get("headers", {}))
+            kwargs["headers"]["Content-Type"] = "application/x-ndjson"
+            body = "\n".join(json_dumps(p) for p in payloads) + "\n"
+            return self.session.request(
+                method=self.method, url=self.url, data=body.encode("utf-8"), **kwargs
+            )
+        return self.session.request(
+            method=self.method, url=self.url, json=payloads, **self.kwargs
+        )
 
+    def deliver(self, message):
+        data = self.payload(message)
         if "application/json" in self.kwargs.get("headers", {}).values():
-            response = requests.request(
+            return self.session.request(
                 method=self.method, url=self.url, json=data, **self.kwargs
             )
-        else:
-            response = requests.request(
-                method=self.method, url=self.url, data=data, **self.kwargs
-            )
+        return self.session.request(
+            method=self.method, url=self.url, data=data, **self.kwargs
+        )
 
-        if response.status_code != self.status_code:
-            print(
-                "Error %s sending Requests payload, the response was:\n%s"
-                % (response.status_code, response.text)
-            )
+    def is_success(self, response):
+        return response.status_code == self.status_code
+
+    def report_failure(self, response):
+        print(
+            "Error %s sending Requests payload, the response was:\n%s"
+            % (response.status_code, response.text)
+        )
@@ -0,0 +1,292 @@
+"""
+Internal counters, exported in the Prometheus text format.
+
+The registry below is always kept up to date by CanaryService.log and
+PyLogger.log, which is cheap (a dict update per event). With
+metrics.enabled set, a MetricsService additionally times every log
+handler, probes reactor lag, and serves the registry over HTTP on a
+loopback port and/or writes it to a file for node_exporter's textfile
+collector.
+"""
+
+import os
+import sys
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from twisted.application import internet, service
+from twisted.internet import reactor
+from twisted.web import resource, server
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+
+HELP = {
+    "opencanary_connections_total": ("counter", "TCP connections accepted"),
+    "opencanary_connections_active": ("gauge", "TCP connections currently open"),
+    "opencanary_connections_rejected_total": (
+        "counter",
+        "TCP connections refused by ratelimit settings",
+    ),
+    "opencanary_events_total": ("counter", "Events logged"),
+    "opencanary_events_ignored_total": (
+        "counter",
+        "Events not logged because of ip.ignorelist or logtype.ignorelist",
+    ),
+    "opencanary_events_aggregated_total": (
+        "counter",
+        "Events absorbed into an aggregate.window summary",
+    ),
+    "opencanary_handler_seconds": ("histogram", "Time spent in each log handler"),
+    "opencanary_handler_stat": (
+        "gauge",
+        "Queue depths and delivery counters reported by log handlers",
+    ),
+    "opencanary_slow_callbacks_total": (
+        "counter",
+        "Callbacks slower than profiler.threshold_ms",
+    ),
+    "opencanary_mongodb_template_replies_total": (
+        "counter",
+        "MongoDB replies sent from a template encoded at startup",
+    ),
+    "opencanary_reactor_lag_seconds": (
+        "histogram",
+        "How late the reactor ran a callback scheduled every second",
+    ),
+}
+
+
+class Histogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            yield name + "_bucket", labels + (("le", str(bound)),), total
+        yield name + "_sum", labels, self.sum
+        yield name + "_count", labels, total
+
+
+def formatLabels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in labels
+    )
+
+
+class Registry(object):
+    """
+    Counters, gauges and histograms keyed on (metric name, labels), where
+    labels is a tuple of (name, value) pairs.
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.histograms = {}
+        self.collectors = []
+        # Extra plain text pages served next to the metrics, by URL path
+        self.pages = {}
+        # logtype -> module NAME, learnt from CanaryService.log
+        self.logtypes = {}
+
+    def inc(self, name, labels=(), n=1):
+        self.counters[(name, labels)] += n
+
+    def set(self, name, labels, value):
+        self.gauges[(name, labels)] = value
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def addCollector(self, collector):
+        """collector() is called on every export and yields (name, labels, value)"""
+        self.collectors.append(collector)
+
+    def addPage(self, path, render):
+        """Serve render() as text/plain at path on the metrics port"""
+        self.pages[path] = render
+
+    def moduleName(self, logtype):
+        return self.logtypes.get(logtype, "opencanary")
+
+    def countEvent(self, logdata):
+        module = self.moduleName(logdata.get("logtype"))
+        self.inc("opencanary_events_total", (("module", module),))
+
+    def countIgnored(self, logdata, reason):
+        module = self.moduleName(logdata.get("logtype"))
+        self.inc(
+            "opencanary_events_ignored_total",
+            (("module", module), ("reason", reason)),
+        )
+
+    def countAggregated(self, logdata):
+        module = self.moduleName(logdata.get("logtype"))
+        self.inc("opencanary_events_aggregated_total", (("module", module),))
+
+    def samples(self):
+        for (name, labels), value in self.counters.items():
+            yield name, labels, value
+        for (name, labels), value in self.gauges.items():
+            yield name, labels, value
+        for (name, labels), histogram in self.histograms.items():
+            for sample in histogram.samples(name, labels):
+                yield sample
+        for collector in self.collectors:
+            for sample in collector():
+                yield sample
+
+    def render(self):
+        families = defaultdict(list)
+        for name, labels, value in self.samples():
+            family = name
+            for suffix in ("_bucket", "_sum", "_count"):
+                if name.endswith(suffix) and name[: -len(suffix)] in HELP:
+                    family = name[: -len(suffix)]
+            families[family].append(
+                "%s%s %s" % (name, formatLabels(labels), float(value))
+            )
+
+        lines = []
+        for family in sorted(families):
+            kind, doc = HELP.get(family, ("untyped", family))
+            lines.append("# HELP %s %s" % (family, doc))
+            lines.append("# TYPE %s %s" % (family, kind))
+            lines.extend(families[family])
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def instrumentService(name, svc, registry=registry):
+    """Count the connections accepted by a TCP or SSL service"""
+    if getattr(svc, "method", None) not in ("TCP", "SSL"):
+        return
+    factory = svc.args[1]
+    buildProtocol = factory.buildProtocol
+    labels = (("module", name),)
+    registry.set("opencanary_connections_active", labels, 0)
+
+    def countingBuildProtocol(addr):
+        p = buildProtocol(addr)
+        if p is None:
+            return p
+        registry.inc("opencanary_connections_total", labels)
+        registry.gauges[("opencanary_connections_active", labels)] += 1
+        connectionLost = p.connectionLost
+
+        def countingConnectionLost(reason):
+            registry.gauges[("opencanary_connections_active", labels)] -= 1
+            return connectionLost(reason)
+
+        p.connectionLost = countingConnectionLost
+        return p
+
+    factory.buildProtocol = countingBuildProtocol
+
+
+def instrumentHandler(handler, registry=registry):
+    """Time every record passed to a logging handler"""
+    handle = handler.handle
+    labels = (("handler", handler.name or handler.__class__.__name__),)
+
+    def timedHandle(record):
+        start = time.perf_counter()
+        try:
+            return handle(record)
+        finally:
+            registry.observe(
+                "opencanary_handler_seconds", labels, time.perf_counter() - start
+            )
+
+    handler.handle = timedHandle
+
+    if hasattr(handler, "stats"):
+
+        def collect():
+            for stat, value in sorted(handler.stats().items()):
+                yield "opencanary_handler_stat", labels + (("stat", stat),), value
+
+        registry.addCollector(collect)
+
+
+class LagProbe(object):
+    """Runs every interval seconds and records how late it was"""
+
+    def __init__(self, interval=1.0, registry=registry):
+        self.interval = interval
+        self.registry = registry
+        self.last = None
+
+    def __call__(self):
+        now = reactor.seconds()
+        if self.last is not None:
+            lag = max(0.0, now - self.last - self.interval)
+            self.registry.observe("opencanary_reactor_lag_seconds", (), lag)
+        self.last = now
+
+
+class MetricsResource(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, registry=registry):
+        resource.Resource.__init__(self)
+        self.registry = registry
+
+    def render_GET(self, request):
+        page = self.registry.pages.get(request.path.decode("utf-8", "replace"))
+        if page is not None:
+            request.setHeader(b"Content-Type", b"text/plain; charset=utf-8")
+            return page().encode("utf-8")
+        request.setHeader(b"Content-Type", b"text/plain; version=0.0.4")
+        return self.registry.render().encode("utf-8")
+
+
+def writeTextfile(path, registry=registry):
+    """Atomically replace path with the current metrics"""
+    try:
+        with open(path + ".tmp", "w") as f:
+            f.write(registry.render())
+        # Readable by an exporter running as another user
+        os.chmod(path + ".tmp", 0o644)
+        os.replace(path + ".tmp", path)
+    except IOError as e:
+        print("Failed to write metrics to %s (%s)" % (path, e), file=sys.stderr)
+
+
+class MetricsService(service.MultiService):
+    def __init__(
+        self,
+        port=None,
+        listen_addr="127.0.0.1",
+        textfile=None,
+        interval=15,
+        registry=registry,
+    ):
+        service.MultiService.__init__(self)
+        internet.TimerService(1.0, LagProbe(1.0, registry)).setServiceParent(self)
+        if port:
+            site = server.Site(MetricsResource(registry))
+            site.noisy = False
+            internet.TCPServer(port, site, interface=listen_addr).setServiceParent(self)
+        if textfile:
+            internet.TimerService(
+                interval, writeTextfile, textfile, registry
+            ).setServiceParent(self)
@@ -7,6 +7,7 @@ from twisted.internet.protocol import Factory
 from twisted.internet.protocol import DatagramProtocol
 
 from opencanary.honeycred import buildHoneyCredHook
+from opencanary.metrics import registry
 
 # Monkey-patch-replace Twisted Protocol with CanaryProtocol class
 from twisted.internet import protocol
@@ -58,6 +59,10 @@ class CanaryService(object):
 
         For brevity, protocols may pass in Twisted transport argument
         for logger to get the IPs and ports of the connection.
+
+        Events with credentials are checked against the honeycreds first.
+        If that needs a hash verified on a thread, the event is logged
+        when the check completes, after any events logged meanwhile.
         """
         data = {"logtype": self.logtype, "logdata": logdata}
 
@@ -78,16 +83,30 @@ class CanaryService(object):
 
         # otherwise the module can include IPs and ports as kwargs
         data.update(kwargs)
+        registry.logtypes[data["logtype"]] = self.NAME
 
         # run pre-log hooks
         if getattr(self, "honeyCredHook", None):
             username = logdata.get("USERNAME", None)
             password = logdata.get("PASSWORD", None)
             if username or password:
-                data["honeycred"] = self.honeyCredHook(username, password)
+                # Hash verification may happen on a thread, so the event
+                # is logged once the result is in
+                d = self.honeyCredHook(username, password)
+                d.addErrback(self.honeyCredFailed)
+                d.addCallback(self.logHoneyCred, data)
+                return
 
         self.logger.log(data)
 
+    def honeyCredFailed(self, failure):
+        print("Error checking honeycreds: %s" % failure.getErrorMessage())
+        return False
+
+    def logHoneyCred(self, match, data):
+        data["honeycred"] = match
+        self.logger.log(data)
+
     def getService(self):
         """Return service to be run
 
@@ -109,27 +128,64 @@ class CanaryService(object):
 
 if sys.platform.startswith("linux"):  # noqa: C901
     from twisted.python import filepath
-    from twisted.internet import inotify
+    from twisted.internet import inotify, reactor, task
     from twisted.python._inotify import INotifyError
     from twisted.internet.inotify import IN_CREATE
     import os
 
     class FileSystemWatcher(object):
-        def __init__(self, fileName=None):
+        """
+        Tails a log file and passes the lines appended to it to handleLines.
+
+        The file is read in CHUNK_SIZE chunks and only complete lines are
+        handed on; a partial last line is kept until the rest of it is
+        written, unless it grows past MAX_LINE_BYTES, in which case what
+        there is of it is handed on as a line of its own so that a file
+        without newlines cannot grow the buffer without bound. At most
+        MAX_BYTES_PER_TICK are read per reactor turn, and
+        any backlog beyond that is picked up on the next turn. Rotation is
+        detected by comparing the inode at the path with the open file's
+        once the open file has been read to the end, so nothing written to
+        the old file before it was rotated is missed.
+
+        If a checkpoint file is given, the inode and offset reached are
+        saved to it every CHECKPOINT_INTERVAL seconds and on shutdown, and
+        on start reading resumes from there if the file is still the same
+        one. Otherwise reading starts at the end of the file.
+        """
+
+        CHUNK_SIZE = 64 * 1024
+        MAX_BYTES_PER_TICK = 1024 * 1024
+        MAX_LINE_BYTES = MAX_BYTES_PER_TICK
+        CHECKPOINT_INTERVAL = 5
+
+        def __init__(self, fileName=None, checkpoint=None):
             self.path = fileName
+            self.checkpoint = checkpoint
+            self.saved = None
             self.log_dir = os.path.dirname(os.path.realpath(self.path))
             self.f = None
+            self.inode = None
+            self.offset = 0
+            self.partial = bytearray()
+            self.backlog = False
+            self.pending = None
 
         def reopenFiles(self, skipToEnd=True):
             if self.f:
                 self.f.close()
 
             try:
-                self.f = open(self.path)
-                if skipToEnd:
-                    self.f.seek(0, 2)
+                self.f = open(self.path, "rb")
+                st = os.fstat(self.f.fileno())
+                self.inode = st.st_ino
+                self.offset = st.st_size if skipToEnd else 0
+                self.f.seek(self.offset)
             except IOError:
                 self.f = None
+                self.inode = None
+                self.offset = 0
+            self.partial = bytearray()
 
             self.notifier.startReading()
             try:
@@ -151,25 +207,139 @@ if sys.platform.startswith("linux"):  # noqa: C901
         def start(self):
             self.notifier = inotify.INotify()
             self.reopenFiles()
+            if self.checkpoint is None:
+                return
+
+            self.resume()
+            reactor.callWhenRunning(self.processAuditLines)
+            self.checkpointer = task.LoopingCall(self.saveCheckpoint)
+            reactor.callWhenRunning(
+                self.checkpointer.start, self.CHECKPOINT_INTERVAL, now=False
+            )
+            reactor.addSystemEventTrigger("before", "shutdown", self.saveCheckpoint)
+
+        def resume(self):
+            """Seek to the checkpointed offset if it is for the open file"""
+            try:
+                with open(self.checkpoint) as f:
+                    inode, offset = map(int, f.read().split())
+            except (IOError, ValueError):
+                return
+            if self.f is None or inode != self.inode:
+                return
+            if offset <= os.fstat(self.f.fileno()).st_size:
+                self.f.seek(offset)
+                self.offset = offset
+            self.saved = (inode, offset)
+
+        def saveCheckpoint(self):
+            if self.checkpoint is None or self.inode is None:
+                return
+            # A partial last line is read again after a restart
+            position = (self.inode, self.offset - len(self.partial))
+            if position == self.saved:
+                return
+            try:
+                with open(self.checkpoint + ".tmp", "w") as f:
+                    f.write("%d %d" % position)
+                os.replace(self.checkpoint + ".tmp", self.checkpoint)
+            except IOError as e:
+                print("Failed to save checkpoint %s (%s)" % (self.checkpoint, e))
+                self.checkpoint = None
+                return
+            self.saved = position
 
         def handleLines(self, lines=None):
             pass
 
+        def checkFile(self):
+            """
+            Called at the end of the open file. Reopens the file if it has
+            been rotated and rewinds it if it has been truncated. Returns
+            True if there may be more to read.
+            """
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                st = None
+
+            if st is not None and st.st_ino == self.inode:
+                if st.st_size >= self.offset:
+                    return False
+                self.f.seek(0)
+                self.offset = 0
+                self.partial = bytearray()
+                return True
+
+            self.reopenFiles(skipToEnd=False)
+            return self.f is not None
+
+        def readLines(self):
+            """
+            Yield the complete lines appended since the last read, reading
+            at most MAX_BYTES_PER_TICK. Sets self.backlog if there is more.
+            """
+            budget = self.MAX_BYTES_PER_TICK
+            while self.f is not None:
+                if budget <= 0:
+                    self.backlog = True
+                    return
+
+                chunk = self.f.read(min(self.CHUNK_SIZE, budget))
+                if not chunk:
+                    if self.partial and (self.inode != self.currentInode()):
+                        # The last line of a rotated file had no newline
+                        yield self.partial.decode("utf-8", "replace")
+                        self.partial = bytearray()
+                    if self.checkFile():
+                        continue
+                    return
+
+                budget -= len(chunk)
+                self.offset += len(chunk)
+                for line in self.splitLines(chunk):
+                    yield line.decode("utf-8", "replace")
+
+        def splitLines(self, chunk):
+            """
+            Return the lines chunk completes, carrying its last partial
+            line over. The partial line is extended in place, so a long
+            line is copied once when it completes rather than per chunk.
+            """
+            lines = chunk.split(b"\n")
+            self.partial += lines[0]
+            if len(lines) > 1:
+                lines[0] = bytes(self.partial)
+                self.partial = bytearray(lines.pop())
+            elif len(self.partial) > self.MAX_LINE_BYTES:
+                lines[0] = bytes(self.partial)
+                self.partial = bytearray()
+            else:
+                return []
+            return lines
+
+        def currentInode(self):
+            try:
+                return os.stat(self.path).st_ino
+            except OSError:
+                return None
+
         def processAuditLines(
             self,
         ):
+            self.pending = None
             if not self.f:
                 return
 
-            lines = self.f.read().strip().split("\n")
+            self.backlog = False
+            self.handleLines(lines=self.readLines())
 
-            self.handleLines(lines=lines)
+            if self.backlog and self.pending is None:
+                self.pending = reactor.callLater(0, self.processAuditLines)
 
         def onChange(self, watch, path, mask):
-            # print path, 'changed', mask # or do something else!
-            if mask != 2:
-                self.reopenFiles()
-
+            # Rotation and truncation are noticed once the open file has
+            # been read to the end, so every event is handled the same way
             self.processAuditLines()
 
         def onDirChange(self, watch, path, mask):
@@ -6,12 +6,15 @@ It implements the MongoDB wire protocol to respond realistically to connection a
 """
 
 from opencanary.modules import CanaryService
+from opencanary.framing import FrameBuffer
+from opencanary.metrics import registry
 from twisted.internet.protocol import Protocol, Factory
 from twisted.application import internet
 from twisted.protocols.policies import TimeoutMixin
 import struct
 import re
-from datetime import datetime
+import time
+from datetime import datetime, timezone
 
 # ---------------------------------------------------------------------------
 # Wire protocol opcodes
@@ -33,8 +36,12 @@ MSG_FLAG_BITS_FORMAT = "<I"
 MSG_FLAG_BITS_NONE = 0
 MSG_SECTION_KIND_BODY = 0  # OP_MSG section kind 0: single document body
 MSG_SECTION_KIND_BYTE = b"\x00"
+MSG_RESPONSE_TO_OFFSET = 8  # responseTo field of the message header
 SYNTHETIC_REQUEST_ID = 9999  # request_id used in outbound responses
 
+# OP_REPLY responseFlags, cursorID, startingFrom, numberReturned
+OP_REPLY_HEADER = struct.Struct("<iqii")
+
 # ---------------------------------------------------------------------------
 # BSON element types
 # ---------------------------------------------------------------------------
@@ -46,10 +53,42 @@ BSON_TYPE_BOOLEAN = 0x08
 BSON_TYPE_INT32 = 0x10
 BSON_TYPE_EOD = 0x00  # End-of-document marker
 
+BSON_TYPE_ARRAY = 0x04
+BSON_TYPE_OBJECT_ID = 0x07
+BSON_TYPE_DATETIME = 0x09
+BSON_TYPE_NULL = 0x0A
+BSON_TYPE_REGEX = 0x0B
+BSON_TYPE_DB_POINTER = 0x0C
+BSON_TYPE_CODE = 0x0D
+BSON_TYPE_SYMBOL = 0x0E
+BSON_TYPE_CODE_W_SCOPE = 0x0F
+BSON_TYPE_TIMESTAMP = 0x11
+BSON_TYPE_INT64 = 0x12
+
 BSON_BOOL_TRUE = b"\x01"
 BSON_BOOL_FALSE = b"\x00"
 BSON_MIN_DOC_SIZE = 5  # 4-byte length + 1-byte EOD
 
+# Sizes of the values of the fixed size BSON types
+BSON_FIXED_SIZES = {
+    0x01: 8,  # double
+    0x06: 0,  # undefined
+    0x07: 12,  # ObjectId
+    0x08: 1,  # boolean
+    0x09: 8,  # UTC datetime
+    0x0A: 0,  # null
+    0x10: 4,  # int32
+    0x11: 8,  # timestamp
+    0x12: 8,  # int64
+    0x13: 16,  # decimal128
+    0x7F: 0,  # max key
+    0xFF: 0,  # min key
+}
+
+# Limits on the documents clients send us
+BSON_MAX_DEPTH = 16
+BSON_MAX_ELEMENTS = 1000
+
 # ---------------------------------------------------------------------------
 # BSON string encoding
 # ---------------------------------------------------------------------------
@@ -116,6 +155,211 @@ CONFIG_DEFAULT_LISTEN_ADDR = ""
 # ---------------------------------------------------------------------------
 CMD_COLLECTION_SUFFIX = "$cmd"
 CMD_QUERY_PREFIX = "query:"
+CMD_AUTH = ("saslStart", "authenticate")
+CMD_HELLO = ("ismaster", "isMaster", "hello")
+
+# The only fields of an authentication command that are decoded and logged
+AUTH_FIELDS = frozenset(
+    [
+        "saslStart",
+        "authenticate",
+        "mechanism",
+        "payload",
+        "user",
+        "username",
+        "db",
+        "$db",
+    ]
+)
+
+# Replies sent from a ReplyTemplate are counted in this metric
+TEMPLATE_REPLIES_METRIC = "opencanary_mongodb_template_replies_total"
+
+INT32 = struct.Struct("<i")
+UINT32 = struct.Struct("<I")
+INT64 = struct.Struct("<q")
+DOUBLE = struct.Struct("<d")
+
+
+class BSONError(ValueError):
+    pass
+
+
+class BSONReader(object):
+    """
+    Decodes BSON in place by offset, without copying sub-documents.
+
+    Elements are skipped by their length unless they are wanted, so a
+    document can be searched for a few fields without decoding the rest.
+    Embedded documents are decoded at most max_depth levels deep and at
+    most max_elements elements are looked at in total; a document over
+    either limit is rejected with BSONError rather than parsed.
+    """
+
+    def __init__(self, max_depth=BSON_MAX_DEPTH, max_elements=BSON_MAX_ELEMENTS):
+        self.max_depth = max_depth
+        self.max_elements = max_elements
+
+    def read(self, data, offset=0, fields=None):
+        """
+        Decode the document at data[offset:]. With fields, only the top
+        level elements named in it are decoded and the rest are skipped.
+        """
+        self.data = data
+        self.view = memoryview(data)
+        self.elements = 0
+        try:
+            return self.readDocument(offset, 0, fields)[0]
+        finally:
+            self.view.release()
+            self.data = self.view = None
+
+    def firstKey(self, data, offset=0):
+        """The name of the first element of the document, e.g. the command"""
+        if len(data) < offset + BSON_MIN_DOC_SIZE or data[offset + 4] == BSON_TYPE_EOD:
+            return None
+        end = data.find(b"\x00", offset + 5)
+        if end < 0:
+            raise BSONError("unterminated key")
+        return data[offset + 5 : end].decode("utf-8", errors="replace")
+
+    def readDocument(self, offset, depth, fields=None, array=False):
+        if depth > self.max_depth:
+            raise BSONError("document nested too deeply")
+        if offset + BSON_MIN_DOC_SIZE > len(self.data):
+            raise BSONError("truncated document")
+        end = offset + INT32.unpack_from(self.data, offset)[0]
+        if end < offset + BSON_MIN_DOC_SIZE or end > len(self.data):
+            raise BSONError("invalid document length")
+
+        result = [] if array else {}
+        pos = offset + 4
+        while self.data[pos] != BSON_TYPE_EOD:
+            self.elements += 1
+            if self.elements > self.max_elements:
+                raise BSONError("too many elements")
+            kind = self.data[pos]
+            key, pos = self.readKey(pos + 1, end)
+            size = self.valueSize(kind, pos, end)
+            if fields is None or key in fields:
+                value = self.readValue(kind, pos, size, depth)
+                if value is not self:
+                    if array:
+                        result.append(value)
+                    else:
+                        result[key] = value
+            pos += size
+            if pos >= end:
+                raise BSONError("truncated document")
+        return result, end
+
+    def readKey(self, pos, end):
+        key_end = self.data.find(b"\x00", pos, end)
+        if key_end < 0:
+            raise BSONError("unterminated key")
+        return self.data[pos:key_end].decode("utf-8", errors="replace"), key_end + 1
+
+    def valueSize(self, kind, pos, end):  # noqa: C901
+        """The number of bytes taken by the value of type kind at pos"""
+        if kind in BSON_FIXED_SIZES:
+            size = BSON_FIXED_SIZES[kind]
+        elif kind == BSON_TYPE_REGEX:
+            pattern_end = self.data.find(b"\x00", pos, end)
+            options_end = self.data.find(b"\x00", pattern_end + 1, end)
+            if pattern_end < 0 or options_end < 0:
+                raise BSONError("unterminated regex")
+            size = options_end + 1 - pos
+        else:
+            if pos + 4 > end:
+                raise BSONError("truncated value")
+            length = INT32.unpack_from(self.data, pos)[0]
+            if length < 0:
+                raise BSONError("negative length")
+            if kind in (BSON_TYPE_STRING, BSON_TYPE_CODE, BSON_TYPE_SYMBOL):
+                size = 4 + length
+            elif kind in (BSON_TYPE_DOCUMENT, BSON_TYPE_ARRAY, BSON_TYPE_CODE_W_SCOPE):
+                size = length
+            elif kind == BSON_TYPE_BINARY:
+                size = 5 + length
+            elif kind == BSON_TYPE_DB_POINTER:
+                size = 4 + length + 12
+            else:
+                raise BSONError("unknown element type 0x%02x" % kind)
+        if pos + size > end:
+            raise BSONError("truncated value")
+        return size
+
+    def readValue(self, kind, pos, size, depth):  # noqa: C901
+        """Decode a value, or return self for types that are not decoded"""
+        data = self.data
+        if kind == BSON_TYPE_STRING:
+            return data[pos + 4 : pos + size - 1].decode("utf-8", errors="ignore")
+        if kind == BSON_TYPE_DOCUMENT or kind == BSON_TYPE_ARRAY:
+            return self.readDocument(pos, depth + 1, array=kind == BSON_TYPE_ARRAY)[0]
+        if kind == BSON_TYPE_BINARY:
+            return self.view[pos + 5 : pos + size].tobytes()
+        if kind == BSON_TYPE_INT32:
+            return INT32.unpack_from(data, pos)[0]
+        if kind == BSON_TYPE_BOOLEAN:
+            return data[pos] != 0
+        if kind == BSON_TYPE_DOUBLE:
+            return DOUBLE.unpack_from(data, pos)[0]
+        if kind in (BSON_TYPE_INT64, BSON_TYPE_DATETIME, BSON_TYPE_TIMESTAMP):
+            return INT64.unpack_from(data, pos)[0]
+        if kind == BSON_TYPE_OBJECT_ID:
+            return data[pos : pos + size].hex()
+        if kind == BSON_TYPE_NULL:
+            return None
+        return self
+
+
+def encodeMessage(opcode, request_id, bson_doc):
+    """
+    Wrap an encoded document in a reply message, OP_REPLY for requests
+    made with the legacy OP_QUERY and OP_MSG for everything else.
+    """
+    if opcode == OPCODE_OP_REPLY:
+        body = OP_REPLY_HEADER.pack(0, 0, 0, 1) + bson_doc
+    else:
+        body = (
+            struct.pack(MSG_FLAG_BITS_FORMAT, MSG_FLAG_BITS_NONE)
+            + MSG_SECTION_KIND_BYTE
+            + bson_doc
+        )
+    header = struct.pack(
+        MSG_HEADER_FORMAT,
+        MSG_HEADER_SIZE + len(body),
+        SYNTHETIC_REQUEST_ID,
+        request_id,
+        opcode,
+    )
+    return header + body
+
+
+class ReplyTemplate(object):
+    """
+    A reply message encoded once, at startup. render() patches the
+    responseTo of the request being answered, and the current time into
+    time_field if there is one, in place and copies the message out.
+    """
+
+    def __init__(self, name, opcode, doc, time_field=None):
+        self.name = name
+        bson_doc = MongoDBProtocol.encode_bson(doc)
+        self.message = bytearray(encodeMessage(opcode, 0, bson_doc))
+        wire_format = "OP_REPLY" if opcode == OPCODE_OP_REPLY else "OP_MSG"
+        self.labels = (("reply", name), ("format", wire_format))
+        self.time_offset = None
+        if time_field is not None:
+            key = bytes([BSON_TYPE_DATETIME]) + time_field.encode("utf-8") + b"\x00"
+            self.time_offset = self.message.index(key) + len(key)
+
+    def render(self, request_id):
+        UINT32.pack_into(self.message, MSG_RESPONSE_TO_OFFSET, request_id)
+        if self.time_offset is not None:
+            INT64.pack_into(self.message, self.time_offset, int(time.time() * 1000))
+        registry.inc(TEMPLATE_REPLIES_METRIC, self.labels)
+        return bytes(self.message)
 
 
 class MongoDBProtocol(Protocol, TimeoutMixin):
@@ -126,9 +370,12 @@ class MongoDBProtocol(Protocol, TimeoutMixin):
 
     def __init__(self, factory):
         self.factory = factory
-        self.buffer = b""
+        self.buffer = FrameBuffer()
         self.authenticated = False
         self.transport_log_data = {}
+        # Replies go out in the format of the request being answered
+        self.reply_opcode = OPCODE_OP_MSG
+        self.templates = factory.templates[OPCODE_OP_MSG]
 
     def connectionMade(self):
         """Log new connection attempts"""
@@ -161,11 +408,11 @@ class MongoDBProtocol(Protocol, TimeoutMixin):
         if len(data) > 0:
             self.resetTimeout()
 
-        self.buffer += data
+        self.buffer.append(data)
 
         # MongoDB message format: length (4 bytes), requestID (4), responseTo (4), opCode (4), payload
         while len(self.buffer) >= MSG_HEADER_SIZE:
-            msg_length = struct.unpack(MSG_HEADER_LENGTH_FORMAT, self.buffer[0:4])[0]
+            msg_length = self.buffer.unpack_from(MSG_HEADER_LENGTH_FORMAT)[0]
 
             if (
                 msg_length < MSG_HEADER_SIZE
@@ -180,8 +427,7 @@ class MongoDBProtocol(Protocol, TimeoutMixin):
             if len(self.buffer) < msg_length:
                 break  # Wait for complete message
 
-            message = self.buffer[:msg_length]
-            self.buffer = self.buffer[msg_length:]
+            message = self.buffer.take(msg_length)
 
             try:
                 self.process_message(message)
@@ -198,6 +444,12 @@ class MongoDBProtocol(Protocol, TimeoutMixin):
         )
         payload = message[MSG_HEADER_SIZE:]
 
+        if opcode == OPCODE_OP_QUERY:
+            self.reply_opcode = OPCODE_OP_REPLY
+        else:
+            self.reply_opcode = OPCODE_OP_MSG
+        self.templates = self.factory.templates[self.reply_opcode]
+
         if opcode == OPCODE_OP_QUERY:
             self.handle_op_query(request_id, payload)
         elif opcode == OPCODE_OP_MSG:
@@ -221,7 +473,7 @@ class MongoDBProtocol(Protocol, TimeoutMixin):
         )  # +1 for null, +8 for numberToSkip and numberToReturn
         if query_start < len(payload):
             try:
-                query_doc = self.parse_bson(payload[query_start:])
+                query_doc = self.parse_bson(payload, query_start)
                 self.handle_query(request_id, collection_name, query_doc)
             except Exception:
                 self.send_error_response(request_id, "Invalid BSON")
@@ -233,16 +485,18 @@ class MongoDBProtocol(Protocol, TimeoutMixin):
 
         if len(payload) > 4 and payload[4] == MSG_SECTION_KIND_BODY:
             try:
-                doc = self.parse_bson(payload[5:])
+                # The command is the first key; only decode what gets logged
+                command = self.factory.bson.firstKey(payload, 5)
 
-                if "saslStart" in doc or "authenticate" in doc:
+                if command in CMD_AUTH:
+                    doc = self.parse_bson(payload, 5, fields=AUTH_FIELDS)
                     self.handle_auth_attempt(request_id, doc)
-                elif "ismaster" in doc or "isMaster" in doc or "hello" in doc:
+                elif command in CMD_HELLO:
                     self.send_ismaster_response(request_id)
                 else:
-                    command = list(doc.keys())[0] if doc else "unknown"
-                    self.factory.log_command(self.transport, command, doc)
-                    self.send_error_response(request_id, MONGO_ERR_AUTH_REQUIRED_MSG)
+                    doc = self.parse_bson(payload, 5)
+                    self.factory.log_command(self.transport, command or "unknown", doc)
+                    self.send_template(request_id, "auth_required")
             except Exception:
                 self.send_error_response(request_id, "Invalid BSON")
 
@@ -260,7 +514,7 @@ class MongoDBProtocol(Protocol, TimeoutMixin):
                 self.send_ismaster_response(request_id)
                 return
 
-        self.send_error_response(request_id, MONGO_ERR_AUTH_REQUIRED_MSG)
+        self.send_template(request_id, "auth_required")
 
     def handle_auth_attempt(self, request_id, auth_doc):
         """Log authentication attempts and send response"""
@@ -290,31 +544,11 @@ class MongoDBProtocol(Protocol, TimeoutMixin):
 
     def send_ismaster_response(self, request_id):
         """Send isMaster/hello response with MongoDB version info"""
-        response_doc = {
-            "ismaster": True,
-            "maxBsonObjectSize": MONGO_MAX_BSON_OBJECT_SIZE,
-            "maxMessageSizeBytes": MONGO_MAX_MESSAGE_SIZE_BYTES,
-            "maxWriteBatchSize": MONGO_MAX_WRITE_BATCH_SIZE,
-            "localTime": datetime.utcnow().isoformat(),
-            "logicalSessionTimeoutMinutes": MONGO_LOGICAL_SESSION_TIMEOUT_MIN,
-            "connectionId": MONGO_CONNECTION_ID,
-            "minWireVersion": MONGO_MIN_WIRE_VERSION,
-            "maxWireVersion": MONGO_MAX_WIRE_VERSION,
-            "readOnly": False,
-            "ok": MONGO_OK_TRUE,
-            "version": self.factory.mongo_version,
-        }
-        self.send_op_msg_response(request_id, response_doc)
+        self.send_template(request_id, "ismaster")
 
     def send_auth_failure(self, request_id):
         """Send authentication failure response"""
-        response_doc = {
-            "ok": MONGO_OK_FALSE,
-            "errmsg": MONGO_ERR_AUTH_FAILED_MSG,
-            "code": MONGO_ERR_AUTH_FAILED_CODE,
-            "codeName": MONGO_ERR_AUTH_FAILED_NAME,
-        }
-        self.send_op_msg_response(request_id, response_doc)
+        self.send_template(request_id, "auth_failure")
 
     def send_error_response(self, request_id, error_msg):
         """Send generic error response"""
@@ -324,112 +558,26 @@ class MongoDBProtocol(Protocol, TimeoutMixin):
             "code": MONGO_ERR_UNAUTHORIZED_CODE,
             "codeName": MONGO_ERR_UNAUTHORIZED_NAME,
         }
-        self.send_op_msg_response(request_id, response_doc)
-
-    def send_op_msg_response(self, request_id, doc):
-        """Send OP_MSG response (opcode 2013)"""
-        bson_doc = self.encode_bson(doc)
+        self.send_response(request_id, response_doc)
 
-        flag_bits = struct.pack(MSG_FLAG_BITS_FORMAT, MSG_FLAG_BITS_NONE)
-        payload = flag_bits + MSG_SECTION_KIND_BYTE + bson_doc
-
-        msg_length = MSG_HEADER_SIZE + len(payload)
-        header = struct.pack(
-            MSG_HEADER_FORMAT,
-            msg_length,
-            SYNTHETIC_REQUEST_ID,
-            request_id,
-            OPCODE_OP_MSG,
-        )
+    def send_template(self, request_id, name):
+        """Send one of the replies the factory encoded at startup"""
+        self.transport.write(self.templates[name].render(request_id))
 
-        self.transport.write(header + payload)
-
-    def parse_bson(self, data):  # noqa: C901
-        """
-        Minimal BSON parser for extracting key fields.
-        Handles common cases for authentication.
-        """
-        if len(data) < BSON_MIN_DOC_SIZE:
-            return {}
-
-        doc_length = struct.unpack(BSON_DOC_LEN_FORMAT, data[0:4])[0]
-        if len(data) < doc_length:
-            return {}
-
-        result = {}
-        pos = 4
-
-        while pos < len(data) - 1:
-            element_type = data[pos]
-            if element_type == BSON_TYPE_EOD:
-                break
-
-            pos += 1
-
-            null_pos = data.find(b"\x00", pos)
-            if null_pos == -1:
-                break
-
-            field_name = data[pos:null_pos].decode("utf-8", errors="ignore")
-            pos = null_pos + 1
-
-            if element_type == BSON_TYPE_STRING:
-                if pos + 4 > len(data):
-                    break
-                str_length = struct.unpack(BSON_STRING_FORMAT, data[pos : pos + 4])[0]
-                pos += 4
-                if pos + str_length > len(data):
-                    break
-                value = data[pos : pos + str_length - 1].decode(
-                    "utf-8", errors="ignore"
-                )
-                pos += str_length
-                result[field_name] = value
-
-            elif element_type == BSON_TYPE_BINARY:
-                if pos + 4 > len(data):
-                    break
-                bin_length = struct.unpack(BSON_BIN_LEN_FORMAT, data[pos : pos + 4])[0]
-                pos += 5
-                if pos + bin_length > len(data):
-                    break
-                value = data[pos : pos + bin_length]
-                pos += bin_length
-                result[field_name] = value
-
-            elif element_type == BSON_TYPE_INT32:
-                if pos + 4 > len(data):
-                    break
-                value = struct.unpack("<i", data[pos : pos + 4])[0]
-                pos += 4
-                result[field_name] = value
-
-            elif element_type == BSON_TYPE_BOOLEAN:
-                if pos + 1 > len(data):
-                    break
-                value = data[pos] != BSON_TYPE_EOD
-                pos += 1
-                result[field_name] = value
-
-            elif element_type == BSON_TYPE_DOCUMENT:
-                if pos + 4 > len(data):
-                    break
-                subdoc_length = struct.unpack(BSON_DOC_LEN_FORMAT, data[pos : pos + 4])[
-                    0
-                ]
-                if pos + subdoc_length > len(data):
-                    break
-                pos += subdoc_length  # Simplified: skip sub-documents
-
-            else:
-                break  # Unknown type — stop parsing
+    def send_response(self, request_id, doc):
+        """Send doc as an OP_MSG, or OP_REPLY to an OP_QUERY, response"""
+        bson_doc = self.encode_bson(doc)
+        self.transport.write(encodeMessage(self.reply_opcode, request_id, bson_doc))
 
-        return result
+    def parse_bson(self, data, offset=0, fields=None):
+        """Decode the BSON document at data[offset:], see BSONReader"""
+        return self.factory.bson.read(data, offset, fields)
 
-    def encode_bson(self, doc):
+    @staticmethod
+    def encode_bson(doc):
         """
         Minimal BSON encoder for responses.
-        Handles strings, numbers, and booleans.
+        Handles strings, numbers, booleans and datetimes.
         """
         body = b""
 
@@ -450,6 +598,9 @@ class MongoDBProtocol(Protocol, TimeoutMixin):
                     + key_bytes
                     + (BSON_BOOL_TRUE if value else BSON_BOOL_FALSE)
                 )
+            elif isinstance(value, datetime):
+                millis = int(value.timestamp() * 1000)
+                body += bytes([BSON_TYPE_DATETIME]) + key_bytes + INT64.pack(millis)
             elif isinstance(value, int):
                 body += bytes([BSON_TYPE_INT32]) + key_bytes + struct.pack("<i", value)
             elif isinstance(value, float):
@@ -485,6 +636,50 @@ class CanaryMongoDB(Factory, CanaryService):
             CONFIG_KEY_LISTEN_ADDR, default=CONFIG_DEFAULT_LISTEN_ADDR
         )
         self.logtype = LOG_TYPE_MONGODB
+        self.bson = BSONReader()
+        self.encode_replies()
+
+    def encode_replies(self):
+        """
+        Encode the replies that are the same for every request once, as
+        complete messages in both the OP_MSG format and the OP_REPLY one
+        legacy clients get in answer to OP_QUERY.
+        """
+        ismaster = {
+            "ismaster": True,
+            "maxBsonObjectSize": MONGO_MAX_BSON_OBJECT_SIZE,
+            "maxMessageSizeBytes": MONGO_MAX_MESSAGE_SIZE_BYTES,
+            "maxWriteBatchSize": MONGO_MAX_WRITE_BATCH_SIZE,
+            "localTime": datetime.fromtimestamp(0, timezone.utc),
+            "logicalSessionTimeoutMinutes": MONGO_LOGICAL_SESSION_TIMEOUT_MIN,
+            "connectionId": MONGO_CONNECTION_ID,
+            "minWireVersion": MONGO_MIN_WIRE_VERSION,
+            "maxWireVersion": MONGO_MAX_WIRE_VERSION,
+            "readOnly": False,
+            "ok": MONGO_OK_TRUE,
+            "version": self.mongo_version,
+        }
+        auth_failure = {
+            "ok": MONGO_OK_FALSE,
+            "errmsg": MONGO_ERR_AUTH_FAILED_MSG,
+            "code": MONGO_ERR_AUTH_FAILED_CODE,
+            "codeName": MONGO_ERR_AUTH_FAILED_NAME,
+        }
+        auth_required = {
+            "ok": MONGO_OK_FALSE,
+            "errmsg": MONGO_ERR_AUTH_REQUIRED_MSG,
+            "code": MONGO_ERR_UNAUTHORIZED_CODE,
+            "codeName": MONGO_ERR_UNAUTHORIZED_NAME,
+        }
+        self.templates = {}
+        for opcode in (OPCODE_OP_MSG, OPCODE_OP_REPLY):
+            self.templates[opcode] = {
+                "ismaster": ReplyTemplate(
+                    "ismaster", opcode, ismaster, time_field="localTime"
+                ),
+                "auth_failure": ReplyTemplate("auth_failure", opcode, auth_failure),
+                "auth_required": ReplyTemplate("auth_required", opcode, auth_required),
+            }
 
     def buildProtocol(self, addr):
         """Factory method to build protocol instances"""
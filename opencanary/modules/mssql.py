@@ -1,5 +1,6 @@
 from opencanary.modules import CanaryService
 from opencanary.config import ConfigException
+from opencanary.framing import FrameBuffer
 
 from twisted.protocols.policies import TimeoutMixin
 from twisted.internet.protocol import Protocol
@@ -105,7 +106,7 @@ class MSSQLProtocol(Protocol, TimeoutMixin):
 
     def __init__(self, factory):
         self._busyReceiving = False
-        self._buffer = b""
+        self._buffer = FrameBuffer()
         self.factory = factory
         self.setTimeout(10)
 
@@ -270,12 +271,11 @@ class MSSQLProtocol(Protocol, TimeoutMixin):
             return None
 
         try:
-            header = list(struct.unpack(">BBHHBB", self._buffer[:hlen]))
+            header = list(self._buffer.unpack_from(">BBHHBB"))
             plen = header[2]
             del header[2]
             if len(self._buffer) >= plen:
-                payload = self._buffer[hlen:plen]
-                self._buffer = self._buffer[plen:]
+                payload = self._buffer.take(plen)[hlen:]
                 tds = TDSPacket._make(header + [payload])
                 return tds
             else:
@@ -421,7 +421,7 @@ class MSSQLProtocol(Protocol, TimeoutMixin):
             self.transport.abortConnection()
 
     def dataReceived(self, data):
-        self._buffer += data
+        self._buffer.append(data)
         self.resetTimeout()
 
         if self._busyReceiving:
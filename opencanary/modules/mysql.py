@@ -1,5 +1,6 @@
 from opencanary.modules import CanaryService
 from opencanary.config import ConfigException
+from opencanary.framing import FrameBuffer
 
 from twisted.protocols.policies import TimeoutMixin
 from twisted.internet.protocol import Protocol
@@ -25,7 +26,7 @@ class MySQL(Protocol, TimeoutMixin):
     # https://dev.mysql.com/doc/internals/en/connection-phase-packets.html#packet-Protocol::Handshake
     def __init__(self, factory):
         self._busyReceiving = False
-        self._buffer = b""
+        self._buffer = FrameBuffer()
         self.factory = factory
         self.threadid = factory.next_threadid()
         self.setTimeout(10)
@@ -65,16 +66,15 @@ class MySQL(Protocol, TimeoutMixin):
     def consume_packet(self):
         if len(self._buffer) < MySQL.HEADER_LEN:
             return None, None
-        length = struct.unpack("<I", self._buffer[:3] + b"\x00")[0]
-        seq_id = self._buffer[3]
+        length, length_high, seq_id = self._buffer.unpack_from("<HBB")
+        length |= length_high << 16
 
         # enough buffer data to consume packet?
         if len(self._buffer) < MySQL.HEADER_LEN + length:
             return seq_id, None
 
-        payload = self._buffer[MySQL.HEADER_LEN : MySQL.HEADER_LEN + length]
-
-        self._buffer = self._buffer[MySQL.HEADER_LEN + length :]
+        self._buffer.skip(MySQL.HEADER_LEN)
+        payload = self._buffer.take(length)
 
         return seq_id, payload
 
@@ -133,7 +133,7 @@ class MySQL(Protocol, TimeoutMixin):
         self.transport.write(self.server_greeting())
 
     def dataReceived(self, data):
-        self._buffer += data
+        self._buffer.append(data)
         self.resetTimeout()
 
         if self._busyReceiving:
@@ -1,75 +1,100 @@
 from opencanary.modules import CanaryService
 from opencanary.modules import FileSystemWatcher
 from opencanary import STDPATH
-import os
+import re
 import subprocess
 import shutil
 
+# Matches the --log-prefix of each of the iptables rules set up below
+PREFIX_RE = re.compile(r"(canaryfw|canarynmap(?:NULL|XMAS|FIN)?): ")
 
-class SynLogWatcher(FileSystemWatcher):
-    def __init__(
-        self, logger=None, logFile=None, ignore_localhost=False, ignore_ports=None
-    ):
+LOCALHOST = ("127.0.0.1", "::1")
+
+# The mangle table chain our iptables rules are installed in
+CHAIN = "OPENCANARY"
+LEGACY_RULE_RE = re.compile(r'--(?:log|nflog)-prefix "?canary')
+
+
+def parseLine(line):
+    """
+    Split a kernel log line written by one of our iptables rules into its
+    prefix and a dict of its KEY=value fields (flags such as DF or SYN map
+    to ""). Returns None for any other line.
+    """
+    m = PREFIX_RE.search(line)
+    if m is None:
+        return None
+    fields = line[m.end() :].split()
+    return m.group(1), dict(
+        [tag.split("=", 1) if "=" in tag else (tag, "") for tag in fields]
+    )
+
+
+class PortscanLogger(object):
+    """Turns the fields of a logged packet into a portscan event"""
+
+    def __init__(self, logger=None, ignore_localhost=False, ignore_ports=None):
         if ignore_ports is None:
             ignore_ports = []
         self.logger = logger
         self.ignore_localhost = ignore_localhost
-        self.ignore_ports = ignore_ports
-        FileSystemWatcher.__init__(self, fileName=logFile)
+        self.ignore_ports = set(int(port) for port in ignore_ports)
+        self.logtypes = {
+            "canaryfw": logger.LOG_PORT_SYN,
+            "canarynmapNULL": logger.LOG_PORT_NMAPNULL,
+            "canarynmapXMAS": logger.LOG_PORT_NMAPXMAS,
+            "canarynmapFIN": logger.LOG_PORT_NMAPFIN,
+            "canarynmap": logger.LOG_PORT_NMAPOS,
+        }
+
+    def logPacket(self, prefix, kv):
+        if prefix not in self.logtypes:
+            return
+        try:
+            data = {
+                "src_host": kv.pop("SRC"),
+                "src_port": kv.pop("SPT"),
+                "dst_host": kv.pop("DST"),
+                "dst_port": kv.pop("DPT"),
+            }
+            dst_port = int(data["dst_port"])
+        except (KeyError, ValueError):
+            return
+
+        if self.ignore_localhost and data["src_host"] in LOCALHOST:
+            return
+        if dst_port in self.ignore_ports:
+            return
+
+        data["logtype"] = self.logtypes[prefix]
+        data["logdata"] = kv
+        self.logger.log(data)
+
+
+class SynLogWatcher(PortscanLogger, FileSystemWatcher):
+    """Reads the packets logged by the LOG rules from the kernel log"""
+
+    def __init__(
+        self,
+        logger=None,
+        logFile=None,
+        ignore_localhost=False,
+        ignore_ports=None,
+        checkpoint=None,
+    ):
+        PortscanLogger.__init__(self, logger, ignore_localhost, ignore_ports)
+        FileSystemWatcher.__init__(self, fileName=logFile, checkpoint=checkpoint)
 
-    def handleLines(self, lines=None):  # noqa: C901
+    def handleLines(self, lines=None):
         for line in lines:
-            try:
-                if "canaryfw: " in line:
-                    logtype = self.logger.LOG_PORT_SYN
-                    rubbish, log = line.split("canaryfw: ")
-                elif "canarynmapNULL" in line:
-                    logtype = self.logger.LOG_PORT_NMAPNULL
-                    rubbish, log = line.split("canarynmapNULL: ")
-                elif "canarynmapXMAS" in line:
-                    logtype = self.logger.LOG_PORT_NMAPXMAS
-                    rubbish, log = line.split("canarynmapXMAS: ")
-                elif "canarynmapFIN" in line:
-                    logtype = self.logger.LOG_PORT_NMAPFIN
-                    rubbish, log = line.split("canarynmapFIN: ")
-                elif "canarynmap: " in line:
-                    logtype = self.logger.LOG_PORT_NMAPOS
-                    rubbish, log = line.split("canarynmap: ")
-                else:
-                    continue
-            except ValueError:
-                continue
-            tags = log.split(" ")
-            kv = {}
-            for tag in tags:
-                if tag.find("=") >= 0:
-                    key, val = tag.split("=")
-                else:
-                    key = tag
-                    val = ""
-                kv[key] = val
-
-            # we've seen empty tags creep in. weed them out.
-            if "" in kv.keys():
-                kv.pop("")
-
-            data = {}
-            data["src_host"] = kv.pop("SRC")
-            data["src_port"] = kv.pop("SPT")
-            data["dst_host"] = kv.pop("DST")
-            data["dst_port"] = kv.pop("DPT")
-            data["logtype"] = logtype
-            data["logdata"] = kv
-            if self.ignore_localhost and data.get("src_host", False) == "127.0.0.1":
-                continue
-            if int(data.get("dst_port", -1)) in self.ignore_ports:
-                continue
-
-            self.logger.log(data)
+            parsed = parseLine(line)
+            if parsed is not None:
+                self.logPacket(*parsed)
 
 
 class CanaryPortscan(CanaryService):
     NAME = "portscan"
+    BACKENDS = ("syslog", "nflog")
 
     def __init__(self, config=None, logger=None):
         CanaryService.__init__(self, config=config, logger=logger)
@@ -82,19 +107,41 @@ class CanaryPortscan(CanaryService):
             "portscan.ignore_localhost", default=False
         )
         self.ignore_ports = config.getVal("portscan.ignore_ports", default=[])
+        self.checkpoint = config.getVal(
+            "portscan.checkpoint", default="/var/tmp/opencanary-portscan.offset"
+        )
+        self.backend = config.getVal("portscan.backend", default="syslog")
+        if self.backend not in self.BACKENDS:
+            raise Exception("Unknown portscan.backend %r" % self.backend)
+        self.nflog_group = int(config.getVal("portscan.nflog_group", default=5))
+        self.dry_run = config.getVal("portscan.dry_run", default=False)
         self.config = config
 
     def startYourEngines(self, reactor=None):
-        # Logging rules for loopback interface.
-        # This is separate from the canaryfw rule as the canary watchdog was
-        # causing console-side noise in the logs.
+        from twisted.internet import reactor
+
         self.set_iptables_rules()
+        reactor.addSystemEventTrigger("before", "shutdown", self.remove_iptables_rules)
+
+        if self.backend == "nflog":
+            from opencanary.nflog import NFLogReader
+
+            packets = PortscanLogger(
+                logger=self.logger,
+                ignore_localhost=self.ignore_localhost,
+                ignore_ports=self.ignore_ports,
+            )
+            nflog = NFLogReader(self.nflog_group, packets.logPacket)
+            nflog.start()
+            reactor.addSystemEventTrigger("before", "shutdown", nflog.stop)
+            return
 
         fs = SynLogWatcher(
             logFile=self.audit_file,
             logger=self.logger,
             ignore_localhost=self.ignore_localhost,
             ignore_ports=self.ignore_ports,
+            checkpoint=self.checkpoint or None,
         )
         fs.start()
 
@@ -103,7 +150,111 @@ class CanaryPortscan(CanaryService):
     ):
         pass
 
-    def set_iptables_rules(self):
+    def iptables_rules(self):
+        """The match, log prefix and rate limit of each logging rule"""
+        return [
+            # Logging rules for loopback interface.
+            # This is separate from the canaryfw rule as the canary watchdog was
+            # causing console-side noise in the logs.
+            ("-p tcp -i lo", "canaryfw", "%d/hour" % self.lorate),
+            # Logging rules for canaryfw.
+            # We ignore loopback interface traffic as it is taken care of in above rule
+            ("-p tcp --syn ! -i lo", "canaryfw", "%d/second" % self.synrate),
+            # Match the T3 probe of the nmap OS detection based on TCP flags and TCP options string
+            (
+                '-p tcp --tcp-flags ALL URG,PSH,SYN,FIN -m u32 --u32 "40=0x03030A01 && 44=0x02040109 && 48=0x080Affff && 52=0xffff0000 && 56=0x00000402"',
+                "canarynmap",
+                "%d/second" % self.nmaposrate,
+            ),
+            # Nmap Null Scan
+            (
+                '-p tcp -m u32 --u32 "6&0xFF=0x6 && 0>>22&0x3C@12=0x50000400"',
+                "canarynmapNULL",
+                "%d/second" % self.nmaposrate,
+            ),
+            # Nmap Xmas Scan
+            (
+                '-p tcp -m u32 --u32 "6&0xFF=0x6 && 0>>22&0x3C@12=0x50290400"',
+                "canarynmapXMAS",
+                "%d/second" % self.nmaposrate,
+            ),
+            # Nmap Fin Scan
+            (
+                '-p tcp -m u32 --u32 "6&0xFF=0x6 && 0>>22&0x3C@12=0x50010400"',
+                "canarynmapFIN",
+                "%d/second" % self.nmaposrate,
+            ),
+        ]
+
+    def iptables_target(self, prefix):
+        if self.backend == "nflog":
+            return "-j NFLOG --nflog-group {0} --nflog-prefix {1}".format(
+                self.nflog_group, prefix
+            )
+        return '-j LOG --log-level warning --log-prefix "{0}: "'.format(prefix)
+
+    def iptables_payload(self, install=True):
+        """
+        The iptables-restore input that installs (or removes) our rules.
+
+        The rules live in their own mangle chain, which PREROUTING jumps to.
+        Declaring the chain flushes it, even with --noflush, so installing
+        twice leaves one copy of every rule, and the rest of the table is
+        left alone. iptables-restore applies the whole payload or nothing.
+        """
+        lines = ["*mangle"]
+        jump = False
+        if install:
+            lines.append(":{0} - [0:0]".format(CHAIN))
+            for match, prefix, limit in self.iptables_rules():
+                lines.append(
+                    "-A {0} {1} -m limit --limit {2} {3}".format(
+                        CHAIN, match, limit, self.iptables_target(prefix)
+                    )
+                )
+            for line in self.iptables_saved():
+                if line == "-A PREROUTING -j {0}".format(CHAIN):
+                    jump = True
+                elif line.startswith("-A PREROUTING ") and LEGACY_RULE_RE.search(line):
+                    # Rules older versions appended to PREROUTING directly
+                    lines.append("-D" + line[2:])
+            if not jump:
+                lines.append("-A PREROUTING -j {0}".format(CHAIN))
+        else:
+            lines.append("-D PREROUTING -j {0}".format(CHAIN))
+            lines.append("-F {0}".format(CHAIN))
+            lines.append("-X {0}".format(CHAIN))
+        lines.append("COMMIT")
+        return "\n".join(lines) + "\n"
+
+    def iptables_saved(self):
+        """The current mangle table rules, in iptables-save format"""
+        if self.dry_run:
+            return []
+        return (
+            subprocess.check_output(["sudo", self.iptables + "-save", "-t", "mangle"])
+            .decode("utf-8", "replace")
+            .splitlines()
+        )
+
+    def iptables_restore(self, payload):
+        if self.dry_run:
+            print(payload, end="")
+            return
+        restore = subprocess.run(
+            ["sudo", self.iptables + "-restore", "--noflush"],
+            input=payload.encode("utf-8"),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        if restore.returncode != 0:
+            err = "Portscan module failed to apply iptables rules: %s" % (
+                restore.stdout.decode("utf-8", "replace").strip()
+            )
+            print(err)
+            raise Exception(err)
+
+    def find_iptables(self):
         iptables_path = shutil.which("iptables-legacy", path=STDPATH)
 
         if not iptables_path:
@@ -119,74 +270,15 @@ class CanaryPortscan(CanaryService):
             print(err)
             raise Exception(err)
 
-        os.system(
-            'sudo {0} -t mangle -D PREROUTING -p tcp -i lo -j LOG --log-level=warning --log-prefix="canaryfw: " -m limit --limit="{1}/hour"'.format(
-                iptables_path, self.lorate
-            )
-        )
-        os.system(
-            'sudo {0} -t mangle -A PREROUTING -p tcp -i lo -j LOG --log-level=warning --log-prefix="canaryfw: " -m limit --limit="{1}/hour"'.format(
-                iptables_path, self.lorate
-            )
-        )
-
-        # Logging rules for canaryfw.
-        # We ignore loopback interface traffic as it is taken care of in above rule
-        os.system(
-            'sudo {0} -t mangle -D PREROUTING -p tcp --syn -j LOG --log-level=warning --log-prefix="canaryfw: " -m limit --limit="{1}/second" ! -i lo'.format(
-                iptables_path, self.synrate
-            )
-        )
-        os.system(
-            'sudo {0} -t mangle -A PREROUTING -p tcp --syn -j LOG --log-level=warning --log-prefix="canaryfw: " -m limit --limit="{1}/second" ! -i lo'.format(
-                iptables_path, self.synrate
-            )
-        )
+        return iptables_path
 
-        # Match the T3 probe of the nmap OS detection based on TCP flags and TCP options string
-        os.system(
-            'sudo {0} -t mangle -D PREROUTING -p tcp --tcp-flags ALL URG,PSH,SYN,FIN -m u32 --u32 "40=0x03030A01 && 44=0x02040109 && 48=0x080Affff && 52=0xffff0000 && 56=0x00000402" -j LOG --log-level=warning --log-prefix="canarynmap: " -m limit --limit="{1}/second"'.format(
-                iptables_path, self.nmaposrate
-            )
-        )
-        os.system(
-            'sudo {0} -t mangle -A PREROUTING -p tcp --tcp-flags ALL URG,PSH,SYN,FIN -m u32 --u32 "40=0x03030A01 && 44=0x02040109 && 48=0x080Affff && 52=0xffff0000 && 56=0x00000402" -j LOG --log-level=warning --log-prefix="canarynmap: " -m limit --limit="{1}/second"'.format(
-                iptables_path, self.nmaposrate
-            )
-        )
-
-        # Nmap Null Scan
-        os.system(
-            'sudo {0} -t mangle -D PREROUTING -p tcp -m u32 --u32 "6&0xFF=0x6 && 0>>22&0x3C@12=0x50000400" -j LOG --log-level=warning --log-prefix="canarynmapNULL: " -m limit --limit="{1}/second"'.format(
-                iptables_path, self.nmaposrate
-            )
-        )
-        os.system(
-            'sudo {0} -t mangle -A PREROUTING -p tcp -m u32 --u32 "6&0xFF=0x6 && 0>>22&0x3C@12=0x50000400" -j LOG --log-level=warning --log-prefix="canarynmapNULL: " -m limit --limit="{1}/second"'.format(
-                iptables_path, self.nmaposrate
-            )
-        )
-
-        # Nmap Xmas Scan
-        os.system(
-            'sudo {0} -t mangle -D PREROUTING -p tcp -m u32 --u32 "6&0xFF=0x6 && 0>>22&0x3C@12=0x50290400" -j LOG --log-level=warning --log-prefix="canarynmapXMAS: " -m limit --limit="{1}/second"'.format(
-                iptables_path, self.nmaposrate
-            )
-        )
-        os.system(
-            'sudo {0} -t mangle -A PREROUTING -p tcp -m u32 --u32 "6&0xFF=0x6 && 0>>22&0x3C@12=0x50290400" -j LOG --log-level=warning --log-prefix="canarynmapXMAS: " -m limit --limit="{1}/second"'.format(
-                iptables_path, self.nmaposrate
-            )
-        )
+    def set_iptables_rules(self):
+        if not self.dry_run:
+            self.iptables = self.find_iptables()
+        self.iptables_restore(self.iptables_payload())
 
-        # Nmap Fin Scan
-        os.system(
-            'sudo {0} -t mangle -D PREROUTING -p tcp -m u32 --u32 "6&0xFF=0x6 && 0>>22&0x3C@12=0x50010400" -j LOG --log-level=warning --log-prefix="canarynmapFIN: " -m limit --limit="{1}/second"'.format(
-                iptables_path, self.nmaposrate
-            )
-        )
-        os.system(
-            'sudo {0} -t mangle -A PREROUTING -p tcp -m u32 --u32 "6&0xFF=0x6 && 0>>22&0x3C@12=0x50010400" -j LOG --log-level=warning --log-prefix="canarynmapFIN: " -m limit --limit="{1}/second"'.format(
-                iptables_path, self.nmaposrate
-            )
-        )
+    def remove_iptables_rules(self):
+        try:
+            self.iptables_restore(self.iptables_payload(install=False))
+        except Exception:
+            pass
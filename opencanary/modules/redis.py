@@ -4,45 +4,165 @@ from twisted.internet.protocol import Protocol
 from twisted.internet.protocol import Factory
 from twisted.application import internet
 
+from opencanary.framing import FrameBuffer
+
 import shlex
 
+# Longest inline command or multibulk header line, as in Redis
+MAX_INLINE_LENGTH = 64 * 1024
+# Longest command name echoed back in an unknown command error, as in Redis
+MAX_ECHOED_COMMAND = 128
+
 
 class ProtocolError(Exception):
     def __init__(self, reason):
-        self.message = b"-ERR Protocol error: {reason}\r\n".format(reason=reason)
+        self.message = "-ERR Protocol error: {reason}\r\n".format(reason=reason).encode(
+            "utf-8"
+        )
 
 
-class ArgumentCountError(Exception):
-    def __init__(self, cmd):
-        self.message = b"-ERR wrong number of arguments for '{cmd}' command\r\n".format(
-            cmd=cmd.lower()
-        )
+OK = b"+OK\r\n"
+NOAUTH = b"-NOAUTH Authentication required.\r\n"
+INVALID_PASSWORD = b"-ERR invalid password\r\n"
+UNKNOWN_COMMAND = b"-ERR unknown command '%s'\r\n"
 
 
-class AuthenticationRequiredError(Exception):
-    def __init__(self):
-        self.message = b"-NOAUTH Authentication required.\r\n"
+def unknownCommand(cmd):
+    """The error for an unknown command, echoing at most 128 bytes of it"""
+    name = cmd[:MAX_ECHOED_COMMAND].lower()
+    return UNKNOWN_COMMAND % name.replace(b"\r", b" ").replace(b"\n", b" ")
 
 
-class AuthenticationError(Exception):
-    def __init__(self):
-        self.message = b"-ERR invalid password\r\n"
+def compileCommands(commands):
+    """
+    Turn a {"NAME [SUBCOMMAND]": (min_args, max_args)} table into
+    {b"NAME": {b"SUBCOMMAND" or None: (min_args, max_args, reply)}}, where
+    reply is the pre-encoded wrong number of arguments error.
+    """
+    table = {}
+    for name, (min_args, max_args) in commands.items():
+        words = name.encode("ascii").split(b" ", 1)
+        reply = b"-ERR wrong number of arguments for '%s' command\r\n" % (
+            name.lower().encode("ascii")
+        )
+        sub = words[1] if len(words) > 1 else None
+        table.setdefault(words[0], {})[sub] = (min_args, max_args, reply)
+    return table
 
 
-class UnknownCommandError(Exception):
-    def __init__(self, cmd):
-        cmd.replace("\r", " ").replace("\n", " ")
-        self.message = (
-            "-ERR unknown command '{cmd}'\r\n".format(cmd=cmd.lower())
-        ).encode("utf-8")
+class RESPParser(object):
+    """
+    Incremental parser for RESP multibulk and inline commands.
 
+    Data is parsed as it arrives and the parser remembers where it got to
+    in a command split across reads, so nothing is parsed twice however
+    the stream is fragmented, and every complete command in a read is
+    returned at once. Each command is a list of bytes; nothing is
+    decoded.
 
-class RedisCommandAgain(Exception):
-    pass
+    max_command_size bounds the total size of the bulk strings in one
+    command, checked as each length is announced, so a client cannot
+    make us buffer max_array_length arguments of max_bulk_length each.
+    """
 
+    def __init__(
+        self,
+        max_array_length=1024,
+        max_bulk_length=1024 * 1024,
+        max_command_size=4 * 1024 * 1024,
+    ):
+        self.max_array_length = max_array_length
+        self.max_bulk_length = max_bulk_length
+        self.max_command_size = max_command_size
+        self.buffer = FrameBuffer()
+        self.array = None
+        self.remaining = 0
+        self.bulk = -1
+        self.size = 0
+
+    def feed(self, data):
+        """Add data and return the commands it completes"""
+        self.buffer.append(data)
+        commands = []
+        while len(self.buffer):
+            if self.array is None:
+                if self.buffer.peek(1) == b"*":
+                    if not self.readArrayHeader():
+                        break
+                    continue
+                command = self.readInline()
+                if command is None:
+                    break
+                if command:
+                    commands.append(command)
+                continue
+            if not self.readArrayElements():
+                break
+            commands.append(self.array)
+            self.array = None
+        return commands
 
-class RedisParser:
-    pass
+    def readLine(self, sep=b"\r\n"):
+        end = self.buffer.find(sep)
+        if end < 0:
+            if len(self.buffer) > MAX_INLINE_LENGTH:
+                raise ProtocolError("too big inline request")
+            return None
+        return self.buffer.take(end, len(sep))
+
+    def readArrayHeader(self):
+        line = self.readLine()
+        if line is None:
+            return False
+        try:
+            count = int(line[1:])
+        except ValueError:
+            raise ProtocolError("invalid multibulk length")
+        if count > self.max_array_length:
+            raise ProtocolError("invalid multibulk length")
+        if count > 0:
+            self.array = []
+            self.remaining = count
+            self.size = 0
+        return True
+
+    def readArrayElements(self):
+        """Read bulk strings into self.array, returning True once it is full"""
+        while self.remaining:
+            if self.bulk < 0:
+                line = self.readLine()
+                if line is None:
+                    return False
+                if line[:1] != b"$":
+                    raise ProtocolError(
+                        "expected '$', got '%s'" % line[:1].decode("latin-1")
+                    )
+                try:
+                    self.bulk = int(line[1:])
+                except ValueError:
+                    raise ProtocolError("invalid bulk length")
+                if not 0 <= self.bulk <= self.max_bulk_length:
+                    raise ProtocolError("invalid bulk length")
+                self.size += self.bulk
+                if self.size > self.max_command_size:
+                    raise ProtocolError("too big request")
+            if len(self.buffer) < self.bulk + 2:
+                return False
+            self.array.append(self.buffer.take(self.bulk, 2))
+            self.remaining -= 1
+            self.bulk = -1
+        return True
+
+    def readInline(self):
+        line = self.readLine(b"\n")
+        if line is None:
+            return None
+        try:
+            # latin-1 maps every byte to one character and back
+            tokens = shlex.split(line.rstrip(b"\r").decode("latin-1"))
+        except ValueError:
+            raise ProtocolError("unbalanced quotes in request")
+        return [token.encode("latin-1") for token in tokens]
 
 
 class RedisProtocol(Protocol):
@@ -250,185 +370,87 @@ class RedisProtocol(Protocol):
         "ZSCORE": (2, 2),
         "ZUNIONSTORE": (3, None),
     }
-
-    def _buildResponseAndSend(self, input_cmd, input_args):
-        try:
-            input_cmd = input_cmd.upper()
-
-            if input_cmd not in self.COMMANDS:
-                raise UnknownCommandError(input_cmd)
-
-            arg_min_count = self.COMMANDS[input_cmd][0]
-            arg_max_count = self.COMMANDS[input_cmd][1]
-            input_arg_count = len(input_args)
-
-            if input_arg_count < arg_min_count or (
-                arg_max_count is not None and input_arg_count > arg_max_count
-            ):
-                raise ArgumentCountError(input_cmd)
-
-            if input_cmd == "QUIT":
-                self.transport.write("+OK\r\n")
-                self.transport.loseConnection()
-                return
-
-            if input_cmd == "AUTH":
-                raise AuthenticationError()
-
-            raise AuthenticationRequiredError()
-
-        except (
-            UnknownCommandError,
-            ArgumentCountError,
-            AuthenticationError,
-            AuthenticationRequiredError,
-        ) as e:
-            self._logAlert(input_cmd, input_args)
-            self.transport.write(e.message)
-        return
+    TABLE = compileCommands(COMMANDS)
+
+    def _reply(self, cmd, args):
+        """The reply to a command with an uppercased name, or None to close"""
+        entry = self.TABLE.get(cmd)
+        if entry is None:
+            return unknownCommand(cmd)
+
+        spec = None
+        nargs = len(args)
+        if nargs and len(entry) > 1:
+            spec = entry.get(args[0].upper())
+            nargs -= 1
+        if spec is None:
+            spec = entry.get(None)
+            nargs = len(args)
+        if spec is None:
+            return unknownCommand(cmd)
+
+        min_args, max_args, reply = spec
+        if nargs < min_args or (max_args is not None and nargs > max_args):
+            return reply
+        if cmd == b"QUIT":
+            return None
+        if cmd == b"AUTH":
+            return INVALID_PASSWORD
+        return NOAUTH
 
     def _logAlert(self, cmd, args):
-        args = " ".join(args)
-        if len(args) > self.factory.max_arg_length:
-            args = (
-                args[: self.factory.max_arg_length]
-                + "(and "
-                + str(self.factory.max_arg_length - len(args))
-                + " more bytes)"
+        limit = self.factory.max_arg_length
+        length = sum(map(len, args)) + max(len(args) - 1, 0)
+        if length <= limit:
+            args = b" ".join(args).decode("utf-8", "replace")
+        else:
+            # Only the part that is logged is joined and decoded
+            logged = bytearray()
+            for arg in args:
+                if logged:
+                    logged += b" "
+                logged += arg[: limit - len(logged)]
+                if len(logged) >= limit:
+                    break
+            args = logged[:limit].decode("utf-8", "replace") + "(and %d more bytes)" % (
+                length - limit
             )
-        logdata = {"CMD": cmd, "ARGS": args}
+        logdata = {"CMD": cmd.decode("utf-8", "replace"), "ARGS": args}
         self.factory.log(logdata, transport=self.transport)
 
-    def _processRedisCommand(  # noqa: C901
-        self,
-    ):
-        def _parseInlineCommand(cmd_string):
-            try:
-                tokens = shlex.split(cmd_string)
-                if len(tokens) == 0:
-                    cmd = ""
-                    args = ""
-                else:
-                    cmd = tokens[0]
-                    args = tokens[1:]
-                return cmd, args, ""
-            except ValueError:
-                raise ProtocolError("unbalanced quotes in request")
-
-        def _parseRESPArray(cmd_string):
-            """
-            RESP arrays with strings looks like:
-                *<element_count>\r\n
-                $<string_1_length>\r\n
-                <string_1>\r\n
-                $<string_2_length\r\n
-                <string_2>\r\n
-            """
-            array = []
-
-            if cmd_string[0] != "*":
-                raise ProtocolError("expected '*', got '{c}'".format(c=cmd_string[0]))
-
-            curr_ptr = cmd_string.find("\r\n")
-            if curr_ptr == -1:
-                raise RedisCommandAgain()
-
-            arr_count = cmd_string[1:curr_ptr]
-            curr_ptr += 2  # skip past CRLF
-            try:
-                arr_count = int(arr_count)
-            except ValueError:
-                raise ProtocolError("invalid multibulk length")
-
-            for element_number in range(0, arr_count):
-                elem_str, new_ptr = _parseRESPString(cmd_string[curr_ptr:])
-                array.append(elem_str)
-                curr_ptr += new_ptr
-
-            return array, curr_ptr
-
-        def _parseRESPString(cmd_string):
-            if cmd_string[0] != "$":
-                raise ProtocolError("expected '$', got '{c}'".format(c=cmd_string[0]))
-
-            curr_ptr = cmd_string.find("\r\n")
-            if curr_ptr == -1:
-                raise RedisCommandAgain()
-
-            str_length = cmd_string[1:curr_ptr]
-            curr_ptr += 2  # skip past CRLF
-            try:
-                str_length = int(str_length)
-            except ValueError:
-                raise ProtocolError("invalid bulk length")
-
-            resp_str = cmd_string[
-                curr_ptr : (curr_ptr + str_length + 2)  # noqa: E203
-            ]  # string + CRLF
-            if len(resp_str) + 2 < str_length or resp_str[-2:] != "\r\n":
-                raise RedisCommandAgain()
-
-            curr_ptr += str_length + 2  # string + trailing CRLF
-            return resp_str[:-2], curr_ptr
-
-        def _parseRESPCommand(cmd_string):
-            cmd = ""
-            args = []
-            if cmd_string[0] == "*":
-                try:
-                    array, curr_ptr = _parseRESPArray(cmd_string)
-                except IndexError:
-                    raise RedisCommandAgain()
-            else:
-                raise ProtocolError("expected '$', got '{c}'".format(c=cmd_string[0]))
-            # print array
-            cmd = array[0]
-            args = array[1:]
-            unfinished_data = cmd_string[curr_ptr:]
-
-            return cmd, args, unfinished_data
-
-        commands = []
-        while len(self._data) > 0:
-            if self._data[0] == "*":
-                # print self._data
-                cmd, args, self._data = _parseRESPCommand(self._data)
-                # print cmd, args
-            else:
-                cmd, args, self._data = _parseInlineCommand(self._data)
-            commands.append((cmd, args))
-
-        return commands
+    def connectionMade(self):
+        self.parser = RESPParser(
+            max_array_length=self.factory.max_array_length,
+            max_bulk_length=self.factory.max_bulk_length,
+            max_command_size=self.factory.max_command_size,
+        )
 
     def dataReceived(self, data):
-        """
-        Received data is unbuffered so we buffer it for telnet.
-        """
+        if self.transport.disconnecting:
+            return
         try:
-            try:
-                # A command split over multiple packets is collected into a single
-                # string until it can all be processed. If multiple commands
-                # are in a single packet and missing some data, run again
-
-                if not hasattr(self, "_data"):
-                    self._data = data.decode()
-                else:
-                    self._data += data.decode()
-
-                cmds = self._processRedisCommand()
-
-                for cmd, args in cmds:
-                    self._buildResponseAndSend(cmd, args)
-
-            except RedisCommandAgain:
-                pass
-
+            cmds = self.parser.feed(data)
         except ProtocolError as e:
             self._errorAndClose(e.message)
             return
 
+        replies = []
+        for cmd in cmds:
+            name = cmd[0].upper()
+            reply = self._reply(name, cmd[1:])
+            if reply is None:
+                # QUIT
+                replies.append(OK)
+                self.transport.writeSequence(replies)
+                self.transport.loseConnection()
+                return
+            self._logAlert(name, cmd[1:])
+            replies.append(reply)
+        if replies:
+            self.transport.writeSequence(replies)
+
     def _errorAndClose(self, error_msg):
-        self.transport.write(error_msg + "\r\n")
+        self.transport.write(error_msg)
         self.transport.loseConnection()
 
 
@@ -441,6 +463,13 @@ class CanaryRedis(Factory, CanaryService):
         self.listen_addr = config.getVal("device.listen_addr", default="")
         self.port = config.getVal("redis.port", default=6379)
         self.max_arg_length = config.getVal("redis.max_arg_length", default=30)
+        self.max_array_length = config.getVal("redis.max_array_length", default=1024)
+        self.max_bulk_length = config.getVal(
+            "redis.max_bulk_length", default=1024 * 1024
+        )
+        self.max_command_size = config.getVal(
+            "redis.max_command_size", default=4 * 1024 * 1024
+        )
         self.logtype = logger.LOG_REDIS_COMMAND
 
     def getService(self):
@@ -1,38 +1,58 @@
 import sys
 
+AUDIT_MARKER = "smbd_audit"
+AUDIT_FIELDS = 13
+
+
+def parseAuditLine(line):
+    """
+    Split the full_audit record in a syslog line into its 13 fields, the
+    last of which, the path, may itself contain "|". Returns None for
+    lines from anything else and for truncated records.
+    """
+    start = line.find(AUDIT_MARKER)
+    if start < 0:
+        return None
+    start = line.find(": ", start + len(AUDIT_MARKER))
+    if start < 0:
+        return None
+    fields = line[start + 2 :].rstrip("\r\n").split("|", AUDIT_FIELDS - 1)
+    if len(fields) != AUDIT_FIELDS:
+        return None
+    return fields
+
+
 if sys.platform.startswith("linux"):
     from opencanary.modules import CanaryService, FileSystemWatcher
-    import re
 
     class SambaLogWatcher(FileSystemWatcher):
-        def __init__(self, logFile=None, logger=None):
+        def __init__(self, logFile=None, logger=None, checkpoint=None):
             self.logger = logger
-            FileSystemWatcher.__init__(self, fileName=logFile)
+            FileSystemWatcher.__init__(self, fileName=logFile, checkpoint=checkpoint)
 
         def handleLines(self, lines=None):
-            audit_re = re.compile(r"^.*smbd_audit.*: (.*$)")
-
             for line in lines:
-                matches = audit_re.match(line)
+                fields = parseAuditLine(line)
 
-                # Skip lines that do not match the correct RegEx pattern
-                if matches is None:
+                # Skip lines that are not complete audit records
+                if fields is None:
                     continue
 
-                data = matches.groups()[0].split("|")
-
-                user = data[0]
-                srcHost = data[1]
-                dstHost = data[2]
-                srcHostName = data[3]
-                shareName = data[4]
-                dstHostName = data[5]
-                smbVersion = data[6]
-                smbArch = data[7]
-                domainName = data[9]
-                auditAction = data[10]
-                auditStatus = data[11]
-                path = data[12]
+                (
+                    user,
+                    srcHost,
+                    dstHost,
+                    srcHostName,
+                    shareName,
+                    dstHostName,
+                    smbVersion,
+                    smbArch,
+                    _,
+                    domainName,
+                    auditAction,
+                    auditStatus,
+                    path,
+                ) = fields
 
                 if user == "":
                     user = "anonymous"
@@ -65,6 +85,9 @@ if sys.platform.startswith("linux"):
             self.audit_file = config.getVal(
                 "smb.auditfile", default="/var/log/samba-audit.log"
             )
+            self.checkpoint = config.getVal(
+                "smb.checkpoint", default="/var/tmp/opencanary-smb.offset"
+            )
             self.config = config
 
         def startYourEngines(self, reactor=None):
@@ -74,5 +97,9 @@ if sys.platform.startswith("linux"):
             # except OSError:
             #    os.mkdir('/var/run/samba')
 
-            fs = SambaLogWatcher(logFile=self.audit_file, logger=self.logger)
+            fs = SambaLogWatcher(
+                logFile=self.audit_file,
+                logger=self.logger,
+                checkpoint=self.checkpoint or None,
+            )
             fs.start()
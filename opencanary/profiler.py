@@ -0,0 +1,136 @@
+"""
+Opt-in slow callback profiler.
+
+Every module shares one reactor, so a slow dataReceived or log handler
+delays all the others. With profiler.enabled set, module log methods,
+protocol dataReceived/datagramReceived methods and log handler emit
+methods are timed, and any call that takes longer than
+profiler.threshold_ms is recorded, with its module, in a ring buffer. A
+timer running every tenth of a second records reactor lag in the same
+buffer. The buffer is written to the twistd log on SIGUSR1 and served at
+/slow on the metrics port. In multi-process mode the workers forward
+their slow calls to the main process, whose buffer holds them all.
+"""
+
+import signal
+import time
+from collections import deque
+
+from twisted.application import internet
+from twisted.internet import reactor
+from twisted.python import log
+
+from opencanary.metrics import registry
+
+PROBE_INTERVAL = 0.1
+
+
+class SlowCallbackProfiler(internet.TimerService):
+    def __init__(self, threshold=0.1, size=512, registry=registry):
+        internet.TimerService.__init__(self, PROBE_INTERVAL, self.probe)
+        self.threshold = threshold
+        self.slow = deque(maxlen=size)
+        self.registry = registry
+        self.last = None
+        # Called with every slow call recorded, e.g. to pass it on
+        self.forward = None
+        registry.addPage("/slow", self.dump)
+
+    def record(self, module, name, duration):
+        entry = (time.time(), module, name, duration)
+        self.slow.append(entry)
+        self.registry.inc("opencanary_slow_callbacks_total", (("module", module),))
+        if self.forward is not None:
+            self.forward(entry)
+
+    def recordWorker(self, index, entry):
+        """Add a slow call forwarded by worker index"""
+        when, module, name, duration = entry
+        self.slow.append((when, "%s@worker%d" % (module, index), name, duration))
+
+    def timed(self, module, name, func):
+        """Wrap func so that calls slower than the threshold are recorded"""
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                if duration >= self.threshold:
+                    self.record(module, name, duration)
+
+        return wrapper
+
+    def probe(self):
+        now = reactor.seconds()
+        if self.last is not None:
+            lag = now - self.last - PROBE_INTERVAL
+            if lag >= self.threshold:
+                self.record("reactor", "lag", lag)
+        self.last = now
+
+    def instrumentModule(self, obj):
+        """Time the module's log method, which also runs the pre-log hooks"""
+        if hasattr(obj, "log"):
+            obj.log = self.timed(obj.NAME, "log", obj.log)
+
+    def instrumentService(self, name, svc):
+        """Time dataReceived on each connection, or datagramReceived for UDP"""
+        method = getattr(svc, "method", None)
+        if method == "UDP":
+            proto = svc.args[1]
+            proto.datagramReceived = self.timed(
+                name, "datagramReceived", proto.datagramReceived
+            )
+        elif method in ("TCP", "SSL"):
+            factory = svc.args[1]
+            buildProtocol = factory.buildProtocol
+
+            def timedBuildProtocol(addr):
+                p = buildProtocol(addr)
+                if p is not None:
+                    p.dataReceived = self.timed(name, "dataReceived", p.dataReceived)
+                return p
+
+            factory.buildProtocol = timedBuildProtocol
+
+    def instrumentHandlers(self, handlers):
+        for handler in handlers:
+            handler.emit = self.timed(
+                handler.name or handler.__class__.__name__, "emit", handler.emit
+            )
+
+    def dump(self):
+        lines = []
+        for when, module, name, duration in self.slow:
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(when))
+            lines.append(
+                "%s.%03d %s.%s %.1fms"
+                % (stamp, int(when * 1000) % 1000, module, name, duration * 1000)
+            )
+        return "\n".join(lines) + "\n"
+
+    def printDump(self):
+        log.msg(
+            "Slow callbacks (over %dms):\n%s"
+            % (self.threshold * 1000, self.dump().rstrip("\n") or "none")
+        )
+
+    def startService(self):
+        internet.TimerService.startService(self)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(
+                signal.SIGUSR1,
+                lambda signum, frame: reactor.callFromThread(self.printDump),
+            )
+
+
+def getProfiler(config):
+    """Build the profiler if profiler.enabled is set, else return None"""
+    if not config.getVal("profiler.enabled", default=False):
+        return None
+    return SlowCallbackProfiler(
+        threshold=config.getVal("profiler.threshold_ms", default=100) / 1000.0,
+        size=config.getVal("profiler.size", default=512),
+    )
@@ -0,0 +1,179 @@
+"""
+Admission control for the TCP services.
+
+A flood from one source would otherwise get a protocol instance, buffers
+and log events for every connection. With ratelimit.enabled, every TCP
+and SSL service factory is wrapped so that buildProtocol refuses (and the
+reactor immediately closes) connections over:
+
+ * ratelimit.max_connections concurrent connections in total,
+ * ratelimit.max_connections_per_ip concurrent connections per source,
+ * ratelimit.connections_per_second new connections per source, with
+   bursts of up to ratelimit.burst.
+
+Refused connections are not logged individually. Instead one summary
+event per source is logged every ratelimit.report_interval seconds.
+"""
+
+import socket
+
+from twisted.internet import reactor, task
+
+from opencanary.metrics import registry
+
+
+def packIP(host):
+    """Packed form of an address string, used as a compact table key"""
+    try:
+        return socket.inet_pton(
+            socket.AF_INET6 if ":" in host else socket.AF_INET, host
+        )
+    except (OSError, ValueError):
+        return host.encode("utf-8", "replace")
+
+
+class Source(object):
+    __slots__ = ("host", "tokens", "last", "active", "rejected")
+
+    def __init__(self, host, tokens, now):
+        self.host = host
+        self.tokens = tokens
+        self.last = now
+        self.active = 0
+        self.rejected = {}
+
+
+class AdmissionControl(object):
+    def __init__(
+        self,
+        logger,
+        max_connections=0,
+        max_connections_per_ip=0,
+        connections_per_second=0,
+        burst=None,
+        report_interval=60,
+        clock=reactor,
+    ):
+        self.logger = logger
+        self.clock = clock
+        self.max_connections = max_connections
+        self.max_connections_per_ip = max_connections_per_ip
+        self.rate = connections_per_second
+        self.burst = burst or max(1, connections_per_second)
+        self.active = 0
+        self.sources = {}
+
+        self.reporter = task.LoopingCall(self.report)
+        self.reporter.clock = clock
+        clock.callWhenRunning(self.reporter.start, report_interval, now=False)
+
+    def admit(self, host, name):
+        """Return the Source to charge a new connection to, or None to refuse"""
+        now = self.clock.seconds()
+        key = packIP(host)
+        source = self.sources.get(key)
+        if source is None:
+            source = self.sources[key] = Source(host, self.burst, now)
+
+        reason = None
+        if self.max_connections and self.active >= self.max_connections:
+            reason = "max_connections"
+        elif (
+            self.max_connections_per_ip and source.active >= self.max_connections_per_ip
+        ):
+            reason = "max_connections_per_ip"
+        elif self.rate:
+            source.tokens = min(
+                self.burst, source.tokens + (now - source.last) * self.rate
+            )
+            source.last = now
+            if source.tokens < 1:
+                reason = "connections_per_second"
+            else:
+                source.tokens -= 1
+
+        if reason is not None:
+            source.rejected[name] = source.rejected.get(name, 0) + 1
+            registry.inc(
+                "opencanary_connections_rejected_total",
+                (("module", name), ("reason", reason)),
+            )
+            return None
+
+        source.active += 1
+        self.active += 1
+        return source
+
+    def release(self, source):
+        source.active -= 1
+        self.active -= 1
+
+    def limitService(self, name, svc):
+        """Put the factory of a TCP or SSL service behind admission control"""
+        if getattr(svc, "method", None) not in ("TCP", "SSL"):
+            return
+        factory = svc.args[1]
+        buildProtocol = factory.buildProtocol
+
+        def limitedBuildProtocol(addr):
+            source = self.admit(getattr(addr, "host", ""), name)
+            if source is None:
+                return None
+            try:
+                p = buildProtocol(addr)
+            except Exception:
+                self.release(source)
+                raise
+            if p is None:
+                self.release(source)
+                return p
+            connectionLost = p.connectionLost
+
+            def releasingConnectionLost(reason):
+                self.release(source)
+                return connectionLost(reason)
+
+            p.connectionLost = releasingConnectionLost
+            return p
+
+        factory.buildProtocol = limitedBuildProtocol
+
+    def report(self):
+        """Log one summary per rate limited source and forget idle sources"""
+        now = self.clock.seconds()
+        for key, source in list(self.sources.items()):
+            if source.rejected:
+                self.logger.log(
+                    {
+                        "logtype": self.logger.LOG_BASE_RATE_LIMITED,
+                        "src_host": source.host,
+                        "logdata": {
+                            "msg": "rate limited",
+                            "rejected": sum(source.rejected.values()),
+                            "modules": source.rejected,
+                        },
+                    }
+                )
+                source.rejected = {}
+            elif source.active == 0 and (
+                not self.rate or now - source.last >= self.burst / self.rate
+            ):
+                del self.sources[key]
+
+
+def getAdmissionControl(config, logger):
+    """Build the admission control if ratelimit.enabled is set, else None"""
+    if not config.getVal("ratelimit.enabled", default=False):
+        return None
+    return AdmissionControl(
+        logger,
+        max_connections=config.getVal("ratelimit.max_connections", default=0),
+        max_connections_per_ip=config.getVal(
+            "ratelimit.max_connections_per_ip", default=0
+        ),
+        connections_per_second=config.getVal(
+            "ratelimit.connections_per_second", default=0
+        ),
+        burst=config.getVal("ratelimit.burst", default=0),
+        report_interval=config.getVal("ratelimit.report_interval", default=60),
+    )
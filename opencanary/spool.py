@@ -0,0 +1,221 @@
+"""
+Buffers for log messages that could not be delivered yet.
+
+Both spools store newline-terminated records and hand them back in the
+order they were appended. A reader peeks at a chunk of whole records,
+writes it, and only then acks it, so a record is never lost between
+being read and being written. Records that are written but could still
+be lost with the connection are the reader's to keep: SocketJSONHandler
+holds on to them and writes them again after a reconnect, so delivery
+is at-least-once.
+"""
+
+import mmap
+import os
+import sys
+from collections import deque
+
+
+class MemorySpool(object):
+    """Bounded in-memory spool, used when no spool directory is configured"""
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.records = deque()
+        self.size = 0
+        self.head_offset = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.size - self.head_offset
+
+    def append(self, record):
+        if len(record) > self.max_bytes:
+            self.dropped += 1
+            return
+        while self.size + len(record) > self.max_bytes:
+            self.size -= len(self.records.popleft())
+            self.head_offset = 0
+            self.dropped += 1
+        self.records.append(record)
+        self.size += len(record)
+
+    def peek(self, max_bytes):
+        """Return up to max_bytes of whole records (at least one record)"""
+        chunk = []
+        total = 0
+        for i, record in enumerate(self.records):
+            if i == 0:
+                record = record[self.head_offset :]
+            if chunk and total + len(record) > max_bytes:
+                break
+            chunk.append(record)
+            total += len(record)
+        return b"".join(chunk)
+
+    def ack(self, nbytes):
+        """Forget the first nbytes of spooled data"""
+        while nbytes and self.records:
+            remaining = len(self.records[0]) - self.head_offset
+            if nbytes < remaining:
+                self.head_offset += nbytes
+                return
+            nbytes -= remaining
+            self.size -= len(self.records.popleft())
+            self.head_offset = 0
+
+
+class SegmentSpool(object):
+    """
+    Append-only spool stored as a series of segment files in a directory.
+
+    New records are appended to the newest segment, which is rotated once
+    it reaches segment_bytes. Segments are read back through mmap, and the
+    read position is persisted to a cursor file on every ack, so a restart
+    resumes where delivery left off. When the spool would exceed max_bytes
+    the oldest segments are discarded.
+    """
+
+    SEGMENT_PREFIX = "segment-"
+    SEGMENT_SUFFIX = ".log"
+    CURSOR = "cursor"
+
+    def __init__(
+        self, directory, max_bytes=64 * 1024 * 1024, segment_bytes=4 * 1024 * 1024
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = min(segment_bytes, max_bytes)
+        self.dropped = 0
+        os.makedirs(directory, exist_ok=True)
+
+        self.segments = sorted(
+            int(name[len(self.SEGMENT_PREFIX) : -len(self.SEGMENT_SUFFIX)])
+            for name in os.listdir(directory)
+            if name.startswith(self.SEGMENT_PREFIX)
+            and name.endswith(self.SEGMENT_SUFFIX)
+        )
+        self.sizes = {seq: os.path.getsize(self.path(seq)) for seq in self.segments}
+
+        self.head_offset = 0
+        try:
+            with open(os.path.join(directory, self.CURSOR)) as f:
+                seq, offset = map(int, f.read().split())
+            while self.segments and self.segments[0] < seq:
+                self.remove(self.segments[0])
+            if self.segments and self.segments[0] == seq:
+                self.head_offset = min(offset, self.sizes[seq])
+        except (IOError, ValueError):
+            pass
+
+        if not self.segments:
+            self.segments.append(0)
+            self.sizes[0] = 0
+        else:
+            self.truncate_torn_record(self.segments[-1])
+        self.writer = open(self.path(self.segments[-1]), "ab")
+
+    def truncate_torn_record(self, seq):
+        """Drop a partial record left at the end of a segment by a crash"""
+        tail = self.read(seq, 0)
+        end = tail.rfind(b"\n") + 1
+        if end != len(tail):
+            os.truncate(self.path(seq), end)
+            self.sizes[seq] = end
+            self.head_offset = min(self.head_offset, end)
+
+    def path(self, seq):
+        return os.path.join(
+            self.directory,
+            "%s%020d%s" % (self.SEGMENT_PREFIX, seq, self.SEGMENT_SUFFIX),
+        )
+
+    def __len__(self):
+        return sum(self.sizes.values()) - self.head_offset
+
+    def remove(self, seq):
+        self.segments.remove(seq)
+        del self.sizes[seq]
+        try:
+            os.unlink(self.path(seq))
+        except OSError:
+            pass
+
+    def rotate(self):
+        self.writer.close()
+        seq = self.segments[-1] + 1
+        self.segments.append(seq)
+        self.sizes[seq] = 0
+        self.writer = open(self.path(seq), "ab")
+
+    def drop_oldest(self):
+        """Discard the oldest segment to make room for new records"""
+        seq = self.segments[0]
+        self.dropped += self.read(seq, self.head_offset).count(b"\n")
+        self.remove(seq)
+        self.head_offset = 0
+        self.save_cursor()
+
+    def append(self, record):
+        if len(record) > self.segment_bytes:
+            self.dropped += 1
+            return
+        if self.sizes[self.segments[-1]] + len(record) > self.segment_bytes:
+            self.rotate()
+        while len(self.segments) > 1 and len(self) + len(record) > self.max_bytes:
+            self.drop_oldest()
+
+        try:
+            self.writer.write(record)
+            self.writer.flush()
+        except IOError as e:
+            print(
+                "Failed to write to spool %s (%s)" % (self.directory, e),
+                file=sys.stderr,
+            )
+            self.dropped += 1
+            return
+        self.sizes[self.segments[-1]] += len(record)
+
+    def read(self, seq, offset, max_bytes=None):
+        size = self.sizes[seq]
+        if offset >= size:
+            return b""
+        end = size if max_bytes is None else min(size, offset + max_bytes)
+        with open(self.path(seq), "rb") as f:
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                return mm[offset:end]
+
+    def peek(self, max_bytes):
+        """Return up to max_bytes of whole records from the head segment"""
+        while (
+            len(self.segments) > 1 and self.head_offset >= self.sizes[self.segments[0]]
+        ):
+            self.remove(self.segments[0])
+            self.head_offset = 0
+
+        chunk = self.read(self.segments[0], self.head_offset, max_bytes)
+        end = chunk.rfind(b"\n") + 1
+        if end == 0:
+            # A single record larger than max_bytes: hand it over whole
+            chunk = self.read(self.segments[0], self.head_offset)
+            end = chunk.find(b"\n") + 1
+        return chunk[:end]
+
+    def ack(self, nbytes):
+        """Mark the first nbytes returned by peek() as delivered"""
+        self.head_offset += nbytes
+        head = self.segments[0]
+        if self.head_offset >= self.sizes[head] and len(self.segments) > 1:
+            self.remove(head)
+            self.head_offset = 0
+        self.save_cursor()
+
+    def save_cursor(self):
+        cursor = os.path.join(self.directory, self.CURSOR)
+        try:
+            with open(cursor + ".tmp", "w") as f:
+                f.write("%d %d" % (self.segments[0], self.head_offset))
+            os.replace(cursor + ".tmp", cursor)
+        except IOError as e:
+            print("Failed to save spool cursor (%s)" % e, file=sys.stderr)
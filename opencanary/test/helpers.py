@@ -1,6 +1,8 @@
 import json
 import time
 
+from twisted.internet.task import Clock
+
 LOG_PATH = "/var/tmp/opencanary.log"
 
 
@@ -52,3 +54,17 @@ def get_matching_log(start_line, predicate):
         time.sleep(0.1)
 
     return None
+
+
+class FakeReactor(Clock):
+    """A Clock that also runs startup calls and records shutdown triggers"""
+
+    def __init__(self):
+        Clock.__init__(self)
+        self.triggers = []
+
+    def callWhenRunning(self, f, *args, **kwargs):
+        f(*args, **kwargs)
+
+    def addSystemEventTrigger(self, phase, event, f, *args, **kwargs):
+        self.triggers.append((phase, event, f))
@@ -0,0 +1,120 @@
+import pytest
+
+from helpers import FakeReactor
+from opencanary.aggregate import EventAggregator
+
+
+def event(src_host="192.0.2.1", logtype=4002, dst_port=22, **logdata):
+    return {
+        "src_host": src_host,
+        "dst_host": "198.51.100.1",
+        "dst_port": dst_port,
+        "logtype": logtype,
+        "utc_time": "t",
+        "logdata": logdata,
+    }
+
+
+@pytest.fixture
+def clock():
+    return FakeReactor()
+
+
+@pytest.fixture
+def summaries():
+    return []
+
+
+@pytest.fixture
+def aggregator(clock, summaries):
+    def summarise(src_host, dst_host, dst_port, summary):
+        summaries.append((src_host, summary))
+
+    def make(**kwargs):
+        return EventAggregator(summarise, clock=clock, **kwargs)
+
+    return make
+
+
+def test_window_slides_until_quiet(aggregator, clock, summaries):
+    agg = aggregator(window=10)
+    assert agg.add(event()) is True
+    clock.advance(5)
+    assert agg.add(event()) is False
+    clock.advance(7)
+    # Twelve seconds after the first event, but only seven after the last
+    assert agg.add(event()) is False
+    assert summaries == []
+
+    clock.advance(9)
+    assert summaries == []
+    clock.advance(1)
+    assert [(s, summary["count"]) for s, summary in summaries] == [("192.0.2.1", 3)]
+    assert agg.add(event()) is True
+
+
+def test_single_event_is_not_summarised(aggregator, clock, summaries):
+    agg = aggregator(window=10)
+    agg.add(event())
+    clock.advance(11)
+    assert agg.table == {}
+    assert summaries == []
+
+
+def test_max_duration_splits_busy_source(aggregator, clock, summaries):
+    agg = aggregator(window=10, max_duration=30)
+    logged = []
+    for _ in range(8):
+        logged.append(agg.add(event()))
+        clock.advance(5)
+    # Events at 0..25 share a window, the one at 30 opens the next
+    assert logged == [True] + [False] * 5 + [True, False]
+    assert [summary["count"] for _, summary in summaries] == [6]
+
+
+def test_max_keys_evicts_least_recently_active(aggregator, clock, summaries):
+    agg = aggregator(window=60, max_keys=2)
+    agg.add(event("192.0.2.1"))
+    agg.add(event("192.0.2.2"))
+    agg.add(event("192.0.2.2"))
+    agg.add(event("192.0.2.1"))
+    assert summaries == []
+
+    assert agg.add(event("192.0.2.3")) is True
+    assert [s for s, _ in summaries] == ["192.0.2.2"]
+    assert [key[0] for key in agg.table] == ["192.0.2.1", "192.0.2.3"]
+
+
+def test_credentials_sampled(aggregator, summaries):
+    agg = aggregator(sample_size=2)
+    agg.add(event(USERNAME="root", PASSWORD="a"))
+    agg.add(event(USERNAME="root", PASSWORD="a"))
+    agg.add(event())
+    agg.add(event(USERNAME="admin", PASSWORD="b"))
+    agg.add(event(USERNAME="guest", PASSWORD="c"))
+    agg.flush()
+
+    assert summaries[0][1]["count"] == 5
+    assert summaries[0][1]["credentials"] == [
+        {"USERNAME": "root", "PASSWORD": "a"},
+        {"USERNAME": "admin", "PASSWORD": "b"},
+    ]
+
+
+def test_honeycred_and_sourceless_events_bypass(aggregator):
+    agg = aggregator()
+    agg.add(event())
+    honeycred = event()
+    honeycred["honeycred"] = True
+    assert agg.add(honeycred) is True
+    assert agg.add(event(src_host="")) is True
+    assert agg.table[("192.0.2.1", 4002, 22)].count == 1
+
+
+def test_flush_on_shutdown(aggregator, clock, summaries):
+    agg = aggregator()
+    agg.add(event())
+    agg.add(event())
+    assert clock.triggers == [("before", "shutdown", agg.flush)]
+    agg.flush()
+    assert [summary["count"] for _, summary in summaries] == [2]
@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from opencanary import modules
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(modules, "FileSystemWatcher"), reason="needs inotify"
+)
+
+
+class FakeNotifier(object):
+    def startReading(self):
+        pass
+
+    def ignore(self, path):
+        pass
+
+    def watch(self, path, mask=None, callbacks=None):
+        pass
+
+
+@pytest.fixture
+def watcher(tmp_path):
+    path = str(tmp_path / "kern.log")
+    open(path, "wb").close()
+    watcher = modules.FileSystemWatcher(fileName=path)
+    watcher.notifier = FakeNotifier()
+    watcher.reopenFiles()
+    yield watcher
+    watcher.f.close()
+
+
+def append(watcher, data):
+    with open(watcher.path, "ab") as f:
+        f.write(data)
+
+
+def read(watcher):
+    return list(watcher.readLines())
+
+
+def test_partial_line_carried_over(watcher):
+    watcher.CHUNK_SIZE = 4
+    append(watcher, b"first line\nsec")
+    assert read(watcher) == ["first line"]
+    append(watcher, b"ond line\nthird")
+    assert read(watcher) == ["second line"]
+    assert watcher.partial == b"third"
+
+
+def test_long_line_handed_on_in_pieces(watcher):
+    watcher.CHUNK_SIZE = 4
+    watcher.MAX_LINE_BYTES = 8
+    append(watcher, b"x" * 30)
+    pieces = read(watcher)
+    assert len(pieces) > 1
+    assert all(len(piece) <= 8 + 4 for piece in pieces)
+    assert len(watcher.partial) <= 8
+
+    append(watcher, b"\nok\n")
+    pieces += read(watcher)
+    assert "".join(pieces[:-1]) == "x" * 30
+    assert pieces[-1] == "ok"
+
+
+def test_backlog_beyond_budget(watcher):
+    watcher.CHUNK_SIZE = 4
+    watcher.MAX_BYTES_PER_TICK = 8
+    append(watcher, b"aaa\nbbb\nccc\n")
+    assert read(watcher) == ["aaa", "bbb"]
+    assert watcher.backlog
+    assert read(watcher) == ["ccc"]
+
+
+def test_truncated_file_reread_from_start(watcher):
+    append(watcher, b"old line one\nold line two\n")
+    assert read(watcher) == ["old line one", "old line two"]
+    with open(watcher.path, "wb") as f:
+        f.write(b"new\n")
+    assert read(watcher) == ["new"]
+
+
+def test_rotated_file_read_to_end_then_reopened(watcher):
+    append(watcher, b"before\nunterminated")
+    assert read(watcher) == ["before"]
+    os.rename(watcher.path, watcher.path + ".1")
+    append(watcher, b"after\n")
+    assert read(watcher) == ["unterminated", "after"]
+    assert watcher.inode == os.stat(watcher.path).st_ino
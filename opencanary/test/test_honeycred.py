@@ -0,0 +1,122 @@
+import pytest
+from twisted.internet.defer import Deferred
+
+from opencanary import honeycred
+from opencanary.honeycred import HoneyCredChecker
+
+CREDS = [
+    {"username": "admin", "password": "admin1"},
+    {"username": "root", "password": "toor"},
+    {"username": "guest"},
+]
+
+
+class FakeThreadPool(object):
+    """Stands in for deferToThreadPool, running each job when told to"""
+
+    def __init__(self):
+        self.jobs = []
+
+    def __call__(self, reactor, threadpool, f, *args):
+        d = Deferred()
+        self.jobs.append((d, f, args))
+        return d
+
+    def run(self):
+        d, f, args = self.jobs.pop(0)
+        d.callback(f(*args))
+
+    def fail(self, exc):
+        d, f, args = self.jobs.pop(0)
+        d.errback(exc)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = FakeThreadPool()
+    monkeypatch.setattr(honeycred, "deferToThreadPool", pool)
+    monkeypatch.setattr(honeycred, "getThreadPool", lambda: None)
+    return pool
+
+
+def result(d):
+    """The result d has fired with so far, or None"""
+    results = []
+
+    def record(value):
+        results.append(value)
+        return value
+
+    d.addBoth(record)
+    return results[0] if results else None
+
+
+def test_answered_without_a_thread(pool):
+    checker = HoneyCredChecker(CREDS)
+    assert result(checker(b"nobody", "admin1")) is False
+    assert result(checker(b"guest", "anything")) is True
+    assert pool.jobs == []
+
+
+def test_hash_checked_once_then_cached(pool):
+    checker = HoneyCredChecker(CREDS)
+    d = checker(b"admin", "admin1")
+    assert result(d) is None
+    pool.run()
+    assert result(d) is True
+
+    assert result(checker(b"admin", "admin1")) is True
+    assert result(checker(b"admin", "wrong")) is None
+    pool.run()
+    assert pool.jobs == []
+
+
+def test_concurrent_checks_share_one_job(pool):
+    checker = HoneyCredChecker(CREDS)
+    first = checker(b"root", "toor")
+    second = checker(b"root", "toor")
+    other = checker(b"root", "nope")
+    assert len(pool.jobs) == 2
+
+    pool.run()
+    assert result(first) is True
+    assert result(second) is True
+    assert checker.waiting == {checker.cacheKey(b"root", "nope"): []}
+    pool.run()
+    assert result(other) is False
+
+
+def test_least_recently_used_evicted(pool):
+    checker = HoneyCredChecker(CREDS, cache_size=2)
+    for password in ("a", "b"):
+        checker(b"admin", password)
+        pool.run()
+    # Touch "a" so that "b" is the least recently used
+    checker(b"admin", "a")
+    checker(b"admin", "c")
+    pool.run()
+    assert list(checker.cache) == [
+        checker.cacheKey(b"admin", "a"),
+        checker.cacheKey(b"admin", "c"),
+    ]
+
+    checker(b"admin", "a")
+    assert pool.jobs == []
+    checker(b"admin", "b")
+    assert len(pool.jobs) == 1
+
+
+def test_failure_reaches_every_waiter_and_is_not_cached(pool):
+    checker = HoneyCredChecker(CREDS)
+    first = checker(b"admin", "admin1")
+    second = checker(b"admin", "admin1")
+    pool.fail(RuntimeError("hash backend broke"))
+
+    for d in (first, second):
+        assert result(d).check(RuntimeError)
+        d.addErrback(lambda failure: None)
+    assert checker.cache == {}
+    assert checker.waiting == {}
+
+    checker(b"admin", "admin1")
+    assert len(pool.jobs) == 1
@@ -0,0 +1,61 @@
+import pytest
+
+from opencanary.iphelper import IPRangeSet
+
+
+@pytest.mark.parametrize(
+    "ip, expected",
+    [
+        ("10.1.2.3", True),
+        ("11.0.0.0", False),
+        ("192.168.1.5", True),
+        ("192.168.1.6", False),
+        ("2001:db8::1", True),
+        ("2001:db9::1", False),
+        ("::ffff:10.1.2.3", True),
+        ("::ffff:192.168.1.6", False),
+        # Not IPv4-mapped, so looked up as IPv6
+        ("::10.1.2.3", False),
+    ],
+)
+def test_membership(ip, expected):
+    ranges = IPRangeSet(["10.0.0.0/8", "192.168.1.5", "2001:db8::/32"])
+    assert (ip in ranges) is expected
+
+
+def test_overlapping_and_adjacent_ranges_merge():
+    ranges = IPRangeSet(
+        [
+            "10.0.0.0/24",
+            "10.0.0.128/25",
+            "10.0.1.0/24",
+            "10.0.3.0/24",
+            "2001:db8::/64",
+            "2001:db8:0:1::/64",
+        ]
+    )
+    assert len(ranges) == 3
+    assert "10.0.1.255" in ranges
+    assert "10.0.2.0" not in ranges
+    assert "10.0.3.0" in ranges
+    assert "2001:db8:0:1::ffff" in ranges
+    assert "2001:db8:0:2::" not in ranges
+
+
+def test_invalid_entries_skipped(capsys):
+    ranges = IPRangeSet(["10.0.0.0/8", "not an ip", "10.0.0.0/33", " 192.0.2.1 "])
+    assert len(ranges) == 2
+    assert "192.0.2.1" in ranges
+    assert "not an ip" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize("ip", [None, b"10.1.2.3", 167837955, "", "10.1.2.3/32"])
+def test_non_address_input(ip):
+    ranges = IPRangeSet(["10.0.0.0/8"])
+    assert ip not in ranges
+
+
+def test_empty():
+    ranges = IPRangeSet()
+    assert not ranges
+    assert "10.1.2.3" not in ranges
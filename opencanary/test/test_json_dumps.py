@@ -0,0 +1,36 @@
+import pytest
+
+from opencanary import logger
+
+EVENT = {
+    "dst_host": "192.0.2.1",
+    "dst_port": 22,
+    "local_time": "2015-07-20 13:38:21.281259",
+    "logdata": {
+        "PASSWORD": "päss\nwörd",
+        "USERNAME": b"root\xff\x00",
+        "KEYS": [b"\xde\xad", 1.5, None, True],
+        "SESSION": {"b": bytearray(b"x")},
+    },
+    "logtype": 4002,
+    "node_id": "opencanary-0",
+    "src_host": "198.51.100.7",
+    "src_port": 49635,
+}
+
+
+def stdlib_dumps(monkeypatch, data):
+    monkeypatch.setattr(logger, "orjson", None)
+    return logger.json_dumps(data)
+
+
+def test_stdlib_format(monkeypatch):
+    line = stdlib_dumps(monkeypatch, {"b": 1, "a": "xé"})
+    assert line == '{"a":"xé","b":1}'
+
+
+def test_backends_identical(monkeypatch):
+    pytest.importorskip("orjson")
+    fast = logger.json_dumps(EVENT)
+    assert fast == stdlib_dumps(monkeypatch, EVENT)
+    assert '"USERNAME":"root\\\\xff\\u0000"' in fast
@@ -1,3 +1,8 @@
+import socket
+import struct
+from datetime import datetime
+
+import bson
 import pytest
 from pymongo import MongoClient
 from pymongo.errors import OperationFailure
@@ -14,6 +19,12 @@ MONGODB_CLIENT_OPTIONS = {
     "socketTimeoutMS": 2000,
     "directConnection": True,
 }
+MONGODB_TIMEOUT = 2
+OP_REPLY = 1
+OP_QUERY = 2004
+OP_MSG = 2013
+MSG_HEADER = struct.Struct("<iiii")
+OP_REPLY_HEADER = struct.Struct("<iqii")
 
 
 def get_mongodb_client(uri="mongodb://localhost:27017"):
@@ -35,6 +46,45 @@ def get_mongodb_log(action, start_line, logdata=None):
     return get_matching_log(start_line, is_matching_log)
 
 
+def send_message(s, opcode, body, request_id=1):
+    s.sendall(
+        MSG_HEADER.pack(MSG_HEADER.size + len(body), request_id, 0, opcode) + body
+    )
+
+
+def read_message(s):
+    """Read one reply, returning (response_to, opcode, body)"""
+    data = b""
+    while len(data) < MSG_HEADER.size or len(data) < MSG_HEADER.unpack_from(data)[0]:
+        chunk = s.recv(4096)
+        if not chunk:
+            raise EOFError("connection closed after %d bytes" % len(data))
+        data += chunk
+    _, _, response_to, opcode = MSG_HEADER.unpack_from(data)
+    return response_to, opcode, data[MSG_HEADER.size :]
+
+
+def op_msg(s, doc, request_id=1):
+    """Send an OP_MSG command with a raw BSON body and decode the reply"""
+    send_message(s, OP_MSG, b"\x00\x00\x00\x00\x00" + doc, request_id)
+    response_to, opcode, body = read_message(s)
+    assert (response_to, opcode) == (request_id, OP_MSG)
+    return bson.decode(body[5:])
+
+
+def embedded(key, body):
+    """A BSON document holding one embedded document element, raw body"""
+    element = b"\x03" + key + b"\x00" + body
+    return struct.pack("<i", 4 + len(element) + 1) + element + b"\x00"
+
+
+def nested(depth):
+    doc = {"a": 1}
+    for _ in range(depth):
+        doc = {"a": doc}
+    return doc
+
+
 @pytest.fixture
 def log_start():
     return get_log_count()
@@ -112,3 +162,52 @@ def test_mongodb_command_attempt(mongodb_client, log_start):
     assert last_log["logdata"]["action"] == "mongodb.command"
     assert last_log["logdata"]["command"] == "listDatabases"
     assert "listDatabases" in last_log["logdata"]["query"]
+
+
+@pytest.mark.parametrize(
+    "doc",
+    [
+        bson.encode({"find": "x", "filter": nested(20)}),
+        bson.encode({"find": "x", "filter": {str(i): i for i in range(1001)}}),
+        # The embedded document claims to run past the end of its parent
+        embedded(b"find", b"\xff\x00\x00\x00\x00"),
+        embedded(b"find", b"\x00\x00\x00\x00\x00"),
+    ],
+    ids=["too-deep", "too-many-elements", "truncated-length", "zero-length"],
+)
+def test_mongodb_invalid_bson_keeps_connection(doc):
+    """
+    Documents over the decoder's limits, or with impossible lengths, are
+    answered with an error and the connection stays usable.
+    """
+    with socket.create_connection(("localhost", MONGODB_PORT), MONGODB_TIMEOUT) as s:
+        reply = op_msg(s, doc, request_id=7)
+        assert reply["ok"] == 0
+        assert reply["errmsg"] == "Invalid BSON"
+
+        reply = op_msg(s, bson.encode({"hello": 1, "$db": "admin"}), request_id=8)
+        assert reply["ismaster"] is True
+
+
+def test_mongodb_legacy_ismaster():
+    """
+    Old drivers open with isMaster over OP_QUERY and expect an OP_REPLY.
+    """
+    query = (
+        struct.pack("<i", 0)
+        + b"admin.$cmd\x00"
+        + struct.pack("<ii", 0, -1)
+        + bson.encode({"isMaster": 1})
+    )
+    with socket.create_connection(("localhost", MONGODB_PORT), MONGODB_TIMEOUT) as s:
+        send_message(s, OP_QUERY, query, request_id=42)
+        response_to, opcode, body = read_message(s)
+
+    assert opcode == OP_REPLY
+    assert response_to == 42
+    flags, cursor_id, starting_from, returned = OP_REPLY_HEADER.unpack_from(body)
+    assert (cursor_id, returned) == (0, 1)
+    reply = bson.decode(body[OP_REPLY_HEADER.size :])
+    assert reply["ismaster"] is True
+    assert reply["version"] == MONGODB_VERSION
+    assert isinstance(reply["localTime"], datetime)
@@ -0,0 +1,179 @@
+import socket
+import struct
+
+from opencanary.logger import LoggerBase
+from opencanary.modules.portscan import PortscanLogger, parseLine
+from opencanary.nflog import (
+    NFGENMSG,
+    NFLogReader,
+    NFNL_SUBSYS_ULOG,
+    NFULA_PAYLOAD,
+    NFULA_PREFIX,
+    NFULNL_MSG_PACKET,
+    NLMSGHDR,
+    attribute,
+)
+
+
+class FakeNetlinkSocket(object):
+    """Hands out recorded netlink datagrams, then would block"""
+
+    def __init__(self, datagrams):
+        self.datagrams = list(datagrams)
+        self.sent = []
+
+    def setblocking(self, flag):
+        pass
+
+    def send(self, data):
+        self.sent.append(data)
+
+    def recv(self, size):
+        if not self.datagrams:
+            raise BlockingIOError()
+        return self.datagrams.pop(0)
+
+    def fileno(self):
+        return -1
+
+    def close(self):
+        pass
+
+
+class FakeLogger(LoggerBase):
+    def __init__(self):
+        self.events = []
+
+    def log(self, logdata):
+        self.events.append(logdata)
+
+
+def tcpSyn(sport, dport):
+    return struct.pack("!HHIIBBHHH", sport, dport, 1, 0, 0x50, 0x02, 64240, 0, 0)
+
+
+def packetMessage(family, prefix, payload):
+    body = (
+        NFGENMSG.pack(family, 0, 0)
+        + attribute(NFULA_PREFIX, prefix + b"\0")
+        + attribute(NFULA_PAYLOAD, payload)
+    )
+    kind = (NFNL_SUBSYS_ULOG << 8) | NFULNL_MSG_PACKET
+    return NLMSGHDR.pack(NLMSGHDR.size + len(body), kind, 0, 0, 0) + body
+
+
+def ipv4Syn(src, dst, sport, dport):
+    tcp = tcpSyn(sport, dport)
+    header = struct.pack(
+        "!BBHHHBBH4s4s",
+        0x45,
+        0,
+        20 + len(tcp),
+        4242,
+        0x4000,
+        64,
+        socket.IPPROTO_TCP,
+        0,
+        socket.inet_aton(src),
+        socket.inet_aton(dst),
+    )
+    return header + tcp
+
+
+def ipv6Syn(src, dst, sport, dport):
+    tcp = tcpSyn(sport, dport)
+    header = struct.pack(
+        "!IHBB16s16s",
+        6 << 28,
+        len(tcp),
+        socket.IPPROTO_TCP,
+        64,
+        socket.inet_pton(socket.AF_INET6, src),
+        socket.inet_pton(socket.AF_INET6, dst),
+    )
+    return header + tcp
+
+
+def readAll(datagrams):
+    packets = []
+    reader = NFLogReader(
+        5,
+        lambda prefix, fields: packets.append((prefix, fields)),
+        sock=FakeNetlinkSocket(datagrams),
+    )
+    reader.doRead()
+    return packets
+
+
+def test_ipv4_syn():
+    packets = readAll(
+        [
+            packetMessage(
+                socket.AF_INET,
+                b"canaryfw",
+                ipv4Syn("192.0.2.7", "198.51.100.1", 40000, 22),
+            )
+        ]
+    )
+    assert len(packets) == 1
+    prefix, fields = packets[0]
+    assert prefix == "canaryfw"
+    assert fields["SRC"] == "192.0.2.7"
+    assert fields["DST"] == "198.51.100.1"
+    assert fields["SPT"] == "40000"
+    assert fields["DPT"] == "22"
+    assert fields["TTL"] == "64"
+    assert fields["ID"] == "4242"
+    assert fields["WINDOW"] == "64240"
+    assert "DF" in fields and "SYN" in fields and "ACK" not in fields
+
+
+def test_ipv6_and_batched_messages():
+    message = packetMessage(
+        socket.AF_INET6,
+        b"canarynmapNULL",
+        ipv6Syn("2001:db8::7", "2001:db8::1", 40000, 443),
+    )
+    packets = readAll([message + message])
+    assert len(packets) == 2
+    prefix, fields = packets[0]
+    assert prefix == "canarynmapNULL"
+    assert fields["SRC"] == "2001:db8::7"
+    assert fields["DPT"] == "443"
+    assert fields["LEN"] == "60"
+    assert fields["HOPLIMIT"] == "64"
+
+
+def test_same_events_as_kernel_log():
+    line = (
+        "Jan 31 12:00:00 host kernel: [1.000000] canaryfw: IN= OUT= "
+        "SRC=192.0.2.7 DST=198.51.100.1 LEN=40 TOS=0x00 PREC=0x00 TTL=64 "
+        "ID=4242 DF PROTO=TCP SPT=40000 DPT=22 WINDOW=64240 RES=0x00 SYN URGP=0"
+    )
+    syslog = FakeLogger()
+    PortscanLogger(logger=syslog).logPacket(*parseLine(line))
+
+    nflog = FakeLogger()
+    packets = PortscanLogger(logger=nflog, ignore_ports=[443])
+    reader = NFLogReader(
+        5,
+        packets.logPacket,
+        sock=FakeNetlinkSocket(
+            [
+                packetMessage(
+                    socket.AF_INET,
+                    b"canaryfw",
+                    ipv4Syn("192.0.2.7", "198.51.100.1", 40000, 22),
+                ),
+                packetMessage(
+                    socket.AF_INET,
+                    b"canaryfw",
+                    ipv4Syn("192.0.2.7", "198.51.100.1", 40000, 443),
+                ),
+            ]
+        ),
+    )
+    reader.doRead()
+
+    assert nflog.events == syslog.events
+    assert nflog.events[0]["logtype"] == LoggerBase.LOG_PORT_SYN
@@ -0,0 +1,159 @@
+import pytest
+from twisted.internet.address import IPv4Address
+
+from helpers import FakeReactor
+from opencanary.ratelimit import AdmissionControl, packIP
+
+
+class FakeLogger(object):
+    LOG_BASE_RATE_LIMITED = 1008
+
+    def __init__(self):
+        self.events = []
+
+    def log(self, logdata):
+        self.events.append(logdata)
+
+
+class FakeProtocol(object):
+    def __init__(self):
+        self.lost = False
+
+    def connectionLost(self, reason):
+        self.lost = True
+
+
+class FakeFactory(object):
+    def __init__(self, build=FakeProtocol):
+        self.build = build
+
+    def buildProtocol(self, addr):
+        return self.build()
+
+
+class FakeService(object):
+    method = "TCP"
+
+    def __init__(self, factory):
+        self.args = (2222, factory)
+
+
+def addr(host):
+    return IPv4Address("TCP", host, 40000)
+
+
+@pytest.fixture
+def clock():
+    return FakeReactor()
+
+
+@pytest.fixture
+def logger():
+    return FakeLogger()
+
+
+@pytest.fixture
+def admission(clock, logger):
+    def make(**kwargs):
+        return AdmissionControl(logger, clock=clock, **kwargs)
+
+    return make
+
+
+def test_token_bucket_refills(admission, clock):
+    ac = admission(connections_per_second=2, burst=3)
+    for _ in range(3):
+        ac.release(ac.admit("192.0.2.1", "ssh"))
+    assert ac.admit("192.0.2.1", "ssh") is None
+
+    clock.advance(0.5)
+    ac.release(ac.admit("192.0.2.1", "ssh"))
+    assert ac.admit("192.0.2.1", "ssh") is None
+
+    # Refilling stops at the burst size
+    clock.advance(60)
+    for _ in range(3):
+        assert ac.admit("192.0.2.1", "ssh") is not None
+    assert ac.admit("192.0.2.1", "ssh") is None
+
+
+def test_per_ip_cap(admission):
+    ac = admission(max_connections_per_ip=2)
+    first = ac.admit("192.0.2.1", "ssh")
+    assert ac.admit("192.0.2.1", "ssh") is not None
+    assert ac.admit("192.0.2.1", "ssh") is None
+    assert ac.admit("192.0.2.2", "ssh") is not None
+
+    ac.release(first)
+    assert ac.admit("192.0.2.1", "ssh") is not None
+
+
+def test_global_cap(admission):
+    ac = admission(max_connections=2)
+    first = ac.admit("192.0.2.1", "ssh")
+    assert ac.admit("192.0.2.2", "ssh") is not None
+    assert ac.admit("192.0.2.3", "ssh") is None
+    assert ac.active == 2
+
+    ac.release(first)
+    assert ac.admit("192.0.2.3", "ssh") is not None
+
+
+def test_connection_lost_releases(admission):
+    ac = admission(max_connections_per_ip=1)
+    factory = FakeFactory()
+    ac.limitService("ssh", FakeService(factory))
+
+    p = factory.buildProtocol(addr("192.0.2.1"))
+    assert factory.buildProtocol(addr("192.0.2.1")) is None
+    p.connectionLost(None)
+    assert p.lost
+    assert ac.active == 0
+    assert factory.buildProtocol(addr("192.0.2.1")) is not None
+
+
+def test_failed_build_protocol_releases(admission):
+    ac = admission(max_connections_per_ip=1)
+
+    def fail():
+        raise RuntimeError("no protocol")
+
+    factory = FakeFactory(fail)
+    ac.limitService("ssh", FakeService(factory))
+    with pytest.raises(RuntimeError):
+        factory.buildProtocol(addr("192.0.2.1"))
+    assert ac.active == 0
+
+    factory.build = lambda: None
+    assert factory.buildProtocol(addr("192.0.2.1")) is None
+    assert ac.active == 0
+    assert ac.sources[packIP("192.0.2.1")].active == 0
+
+
+def test_report_summarises_and_prunes(admission, clock, logger):
+    ac = admission(
+        max_connections_per_ip=1,
+        connections_per_second=1,
+        burst=5,
+        report_interval=60,
+    )
+    held = ac.admit("192.0.2.1", "ssh")
+    ac.admit("192.0.2.1", "ssh")
+    ac.admit("192.0.2.1", "ftp")
+    ac.release(ac.admit("192.0.2.2", "ssh"))
+
+    clock.advance(60)
+    assert [e["src_host"] for e in logger.events] == ["192.0.2.1"]
+    assert logger.events[0]["logdata"]["rejected"] == 2
+    assert logger.events[0]["logdata"]["modules"] == {"ssh": 1, "ftp": 1}
+    # The idle source has had burst / rate seconds to refill and is dropped,
+    # the one with a live connection is kept
+    assert set(ac.sources) == {packIP("192.0.2.1")}
+
+    clock.advance(60)
+    assert len(logger.events) == 1
+    assert set(ac.sources) == {packIP("192.0.2.1")}
+
+    ac.release(held)
+    clock.advance(60)
+    assert ac.sources == {}
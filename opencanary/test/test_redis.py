@@ -1,5 +1,6 @@
 import pytest
 import redis
+import socket
 
 from helpers import get_log_count, get_matching_log
 from opencanary.logger import LoggerBase
@@ -88,3 +89,62 @@ def test_redis_unknown_command_is_logged(log_start):
     assert log["logtype"] == REDIS_LOG_TYPE
     assert log["dst_port"] == REDIS_PORT
     assert log["logdata"]["CMD"] == "CANARY_UNKNOWN"
+
+
+def test_redis_unknown_command_name_is_truncated():
+    """
+    Only the first 128 bytes of an unknown command are echoed back.
+    """
+    command = b"X" * 100000
+    request = b"*1\r\n$%d\r\n%s\r\n" % (len(command), command)
+    with socket.create_connection((REDIS_HOST, REDIS_PORT), REDIS_TIMEOUT) as s:
+        s.sendall(request)
+        reply = b""
+        while not reply.endswith(b"\r\n"):
+            data = s.recv(1024)
+            if not data:
+                break
+            reply += data
+
+    assert reply == b"-ERR unknown command '%s'\r\n" % (b"x" * 128)
+
+
+def test_redis_oversized_command_closes_connection():
+    """
+    A command whose arguments add up to more than redis.max_command_size
+    is refused before it is buffered.
+    """
+    bulk = b"$1048576\r\n" + b"A" * 1048576 + b"\r\n"
+    request = b"*6\r\n$3\r\nSET\r\n" + bulk * 4 + b"$1048576\r\n"
+    with socket.create_connection((REDIS_HOST, REDIS_PORT), REDIS_TIMEOUT) as s:
+        s.sendall(request)
+        reply = b""
+        while True:
+            data = s.recv(1024)
+            if not data:
+                break
+            reply += data
+
+    assert reply == b"-ERR Protocol error: too big request\r\n"
+
+
+def test_redis_pipelined_commands_are_logged(log_start):
+    """
+    Every command in a pipeline should be answered and logged.
+    """
+    pipeline = (
+        b"*4\r\n$6\r\nCONFIG\r\n$3\r\nSET\r\n$3\r\ndir\r\n$20\r\n/tmp/canary_pipeline\r\n"
+        b"*3\r\n$7\r\nSLAVEOF\r\n$9\r\n192.0.2.1\r\n$4\r\n6379\r\n"
+    )
+    with socket.create_connection((REDIS_HOST, REDIS_PORT), REDIS_TIMEOUT) as s:
+        s.sendall(pipeline)
+        replies = b""
+        while replies.count(b"\r\n") < 2:
+            data = s.recv(1024)
+            if not data:
+                break
+            replies += data
+
+    assert replies.count(b"\r\n") == 2
+    assert get_redis_log(log_start, "CONFIG", "/tmp/canary_pipeline") is not None
+    assert get_redis_log(log_start, "SLAVEOF", "192.0.2.1") is not None
@@ -0,0 +1,133 @@
+import socket
+import time
+
+import pytest
+
+from opencanary.logger import (
+    TIOCOUTQ,
+    SocketJSONHandler,
+    SocketJSONProtocol,
+    unacknowledgedBytes,
+)
+
+pytestmark = pytest.mark.skipif(
+    TIOCOUTQ is None, reason="needs the kernel's unacknowledged byte count"
+)
+
+
+class FakeTransport(object):
+    """Buffers writes like a Twisted transport until flushed to the socket"""
+
+    bufferSize = 64 * 1024
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b""
+        self.closed = False
+
+    def write(self, data):
+        self.buffer += data
+
+    def writeSomeData(self, data):
+        return self.sock.send(data)
+
+    def flush(self):
+        # Through the attribute, as doWrite does, so the handler sees it
+        n = self.writeSomeData(self.buffer)
+        self.buffer = self.buffer[n:]
+
+    def getHandle(self):
+        return self.sock
+
+    def registerProducer(self, producer, streaming):
+        pass
+
+    def loseConnection(self):
+        self.closed = True
+
+
+@pytest.fixture
+def connect():
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    socks = []
+
+    def connect():
+        client = socket.create_connection(server.getsockname())
+        collector, _ = server.accept()
+        socks.extend((client, collector))
+        return FakeTransport(client), collector
+
+    yield connect
+    for sock in socks + [server]:
+        sock.close()
+
+
+@pytest.fixture
+def handler():
+    handler = SocketJSONHandler("127.0.0.1", 9)
+    yield handler
+    handler.transport = None
+    handler.close()
+
+
+def send(handler, *records):
+    for record in records:
+        handler.send(record + "\n")
+    handler.flush()
+
+
+def collectorClosed(handler, transport):
+    protocol = SocketJSONProtocol()
+    protocol.factory = handler.factory
+    protocol.transport = transport
+    protocol.readConnectionLost()
+    handler.connectionLost()
+
+
+def readAll(collector, transport):
+    data = b""
+    while unacknowledgedBytes(transport):
+        time.sleep(0.01)
+    collector.setblocking(False)
+    try:
+        while True:
+            chunk = collector.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    except BlockingIOError:
+        pass
+    return data
+
+
+def test_no_resend_after_collector_read_everything(handler, connect):
+    transport, collector = connect()
+    handler.connectionMade(transport)
+    send(handler, "a0", "a1", "a2")
+    transport.flush()
+    assert readAll(collector, transport) == b"a0\na1\na2\n"
+    collectorClosed(handler, transport)
+    assert transport.closed
+
+    transport, collector = connect()
+    handler.connectionMade(transport)
+    send(handler, "b0")
+    assert transport.buffer == b"b0\n"
+    assert handler.stats()["resend_bytes"] == 0
+
+
+def test_resend_what_never_left_the_transport(handler, connect):
+    transport, collector = connect()
+    handler.connectionMade(transport)
+    send(handler, "a0")
+    transport.flush()
+    readAll(collector, transport)
+    send(handler, "a1", "a2")
+    collectorClosed(handler, transport)
+
+    transport, collector = connect()
+    handler.connectionMade(transport)
+    send(handler, "b0")
+    assert transport.buffer == b"a1\na2\nb0\n"
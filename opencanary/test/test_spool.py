@@ -0,0 +1,127 @@
+import os
+
+from opencanary.spool import MemorySpool, SegmentSpool
+
+
+def records(n, size=5):
+    """n distinct newline-terminated records of size bytes each"""
+    return [(b"%d" % i).rjust(size - 1, b"r") + b"\n" for i in range(n)]
+
+
+def segmentFiles(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith("segment-"))
+
+
+def test_memory_peek_and_partial_ack():
+    spool = MemorySpool(max_bytes=100)
+    r = records(3)
+    for record in r:
+        spool.append(record)
+    assert spool.peek(12) == r[0] + r[1]
+    spool.ack(7)
+    assert len(spool) == 8
+    assert spool.peek(100) == r[1][2:] + r[2]
+
+
+def test_memory_cap_drops_oldest():
+    spool = MemorySpool(max_bytes=12)
+    r = records(4)
+    for record in r:
+        spool.append(record)
+    assert spool.dropped == 2
+    assert spool.peek(100) == r[2] + r[3]
+
+
+def test_memory_oversized_record():
+    spool = MemorySpool(max_bytes=12)
+    spool.append(b"x" * 12 + b"\n")
+    assert spool.dropped == 1
+    assert len(spool) == 0
+
+
+def test_memory_peek_hands_over_large_record_whole():
+    spool = MemorySpool(max_bytes=100)
+    spool.append(b"x" * 20 + b"\n")
+    assert spool.peek(4) == b"x" * 20 + b"\n"
+
+
+def test_restart_resumes_from_cursor(tmp_path):
+    r = records(3)
+    spool = SegmentSpool(str(tmp_path))
+    for record in r:
+        spool.append(record)
+    spool.ack(len(spool.peek(5)))
+    spool.writer.close()
+
+    spool = SegmentSpool(str(tmp_path))
+    assert len(spool) == 10
+    assert spool.peek(100) == r[1] + r[2]
+
+
+def test_restart_truncates_torn_record(tmp_path):
+    r = records(2)
+    spool = SegmentSpool(str(tmp_path))
+    for record in r:
+        spool.append(record)
+    spool.writer.write(b"torn")
+    spool.writer.close()
+
+    spool = SegmentSpool(str(tmp_path))
+    assert len(spool) == 10
+    spool.append(r[0])
+    assert spool.peek(100) == r[0] + r[1] + r[0]
+
+
+def test_cap_drops_oldest_segment(tmp_path):
+    spool = SegmentSpool(str(tmp_path), max_bytes=30, segment_bytes=10)
+    r = records(8)
+    for record in r[:6]:
+        spool.append(record)
+    assert spool.dropped == 0
+    spool.ack(len(r[0]))
+
+    for record in r[6:]:
+        spool.append(record)
+    # Only the unacked record in the discarded segment counts as dropped
+    assert spool.dropped == 1
+    assert len(spool) == 30
+    assert len(segmentFiles(str(tmp_path))) == 4 - 1
+    assert spool.peek(100) == r[2] + r[3]
+
+
+def test_oversized_record(tmp_path):
+    spool = SegmentSpool(str(tmp_path), max_bytes=30, segment_bytes=10)
+    spool.append(b"x" * 10 + b"\n")
+    assert spool.dropped == 1
+    assert len(spool) == 0
+    assert spool.peek(100) == b""
+
+
+def test_peek_hands_over_large_record_whole(tmp_path):
+    spool = SegmentSpool(str(tmp_path))
+    spool.append(b"x" * 20 + b"\n")
+    assert spool.peek(4) == b"x" * 20 + b"\n"
+
+
+def test_peek_and_ack_across_rotation(tmp_path):
+    spool = SegmentSpool(str(tmp_path), max_bytes=100, segment_bytes=10)
+    r = records(4)
+    for record in r:
+        spool.append(record)
+    assert len(segmentFiles(str(tmp_path))) == 2
+
+    # peek never spans segments
+    chunk = spool.peek(100)
+    assert chunk == r[0] + r[1]
+    spool.ack(len(chunk))
+    assert len(segmentFiles(str(tmp_path))) == 1
+
+    chunk = spool.peek(100)
+    assert chunk == r[2] + r[3]
+    spool.ack(len(chunk))
+    assert len(spool) == 0
+    assert spool.peek(100) == b""
+
+    spool.writer.close()
+    spool = SegmentSpool(str(tmp_path), max_bytes=100, segment_bytes=10)
+    assert len(spool) == 0
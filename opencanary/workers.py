@@ -0,0 +1,316 @@
+"""
+Multi-process mode.
+
+With workers.count above 1, the supervisor (the twistd process running
+opencanary.tac) opens every TCP listener itself, while it still has the
+privileges to bind low ports, and passes the listening sockets on to a set
+of worker processes. Each worker runs its own reactor and accepts on the
+inherited sockets, so the kernel spreads connections, and the CPU work of
+key exchanges and handshakes, over all of them. Workers send their events
+back to the supervisor over a pipe and the supervisor logs them through the
+configured handlers. UDP and log-file based modules stay in the supervisor.
+
+workers.pinning restricts a module to some of the workers, e.g.
+{"ssh": [1, 2, 3]}, and workers.cpu_affinity pins each worker to one CPU.
+
+Workers count connections in their own metrics registry and send what
+changed to the supervisor every METRICS_INTERVAL seconds over the same
+pipe. The supervisor adds the counters to its registry and exports
+each gauge as the sum over the running workers.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import socket
+import sys
+
+from twisted.application import service
+from twisted.internet import protocol, reactor, stdio, task
+from twisted.protocols.tls import TLSMemoryBIOFactory
+
+from opencanary.logger import LoggerBase, json_dumps
+from opencanary.metrics import instrumentService, registry
+from opencanary.profiler import getProfiler
+from opencanary.ratelimit import getAdmissionControl
+
+# File descriptors of the supervisor -> worker plumbing
+LOG_FD = 3
+FIRST_LISTEN_FD = 4
+
+RESPAWN_DELAY = 1
+METRICS_INTERVAL = 1
+
+
+def isShareable(svc):
+    """Can this service's listening socket be shared with the workers?"""
+    return getattr(svc, "method", None) in ("TCP", "SSL")
+
+
+def openListener(svc):
+    """Create the listening socket that svc would have opened itself"""
+    port = svc.args[0]
+    interface = svc.kwargs.get("interface", "")
+    family = socket.AF_INET6 if ":" in interface else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((interface, port))
+    sock.listen(svc.kwargs.get("backlog", 50))
+    sock.setblocking(False)
+    return sock
+
+
+class WorkerProcessProtocol(protocol.ProcessProtocol):
+    """Supervisor side of one worker: reads its events off the log pipe"""
+
+    def __init__(self, supervisor, index):
+        self.supervisor = supervisor
+        self.index = index
+        self.buffer = b""
+
+    def childDataReceived(self, childFD, data):
+        if childFD != LOG_FD:
+            return
+        lines = (self.buffer + data).split(b"\n")
+        self.buffer = lines.pop()
+        for line in lines:
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            if "slow" in msg:
+                self.supervisor.slowCallback(self.index, msg["slow"])
+                continue
+            if "metrics" in msg:
+                self.supervisor.updateMetrics(self.index, msg["metrics"])
+                continue
+            event = msg["event"]
+            registry.logtypes.setdefault(event.get("logtype"), msg["module"])
+            self.supervisor.logger.log(event)
+
+    def processEnded(self, reason):
+        self.supervisor.workerEnded(self.index, reason)
+
+
+class WorkerSupervisor(service.Service):
+    def __init__(self, logger, count, pinning=None, cpu_affinity=False, profiler=None):
+        self.logger = logger
+        self.profiler = profiler
+        self.count = count
+        self.pinning = pinning or {}
+        self.cpu_affinity = cpu_affinity
+        self.listeners = []
+        self.sockets = []
+        self.processes = {}
+        # Last gauge values reported by each worker
+        self.gauges = {}
+
+    def logMsg(self, msg):
+        self.logger.log({"logdata": {"msg": {"logdata": msg}}}, retry=False)
+
+    def slowCallback(self, index, entry):
+        if self.profiler is not None:
+            self.profiler.recordWorker(index, entry)
+
+    def updateMetrics(self, index, metrics):
+        for name, labels, delta in metrics.get("counters", []):
+            registry.inc(name, tuple(map(tuple, labels)), delta)
+        gauges = self.gauges.setdefault(index, {})
+        for name, labels, value in metrics.get("gauges", []):
+            key = (name, tuple(map(tuple, labels)))
+            gauges[key] = value
+            self.sumGauge(key)
+
+    def sumGauge(self, key):
+        total = sum(gauges.get(key, 0) for gauges in self.gauges.values())
+        registry.set(key[0], key[1], total)
+
+    def addListener(self, klass, index, svc):
+        """Serve svc, the index'th service of klass, from the workers"""
+        self.listeners.append((klass, index, svc))
+
+    def serves(self, index, name):
+        workers = self.pinning.get(name)
+        if not workers:
+            return True
+        return index in workers
+
+    def privilegedStartService(self):
+        for klass, index, svc in self.listeners:
+            self.sockets.append(openListener(svc))
+        service.Service.privilegedStartService(self)
+
+    def startService(self):
+        service.Service.startService(self)
+        for index in range(self.count):
+            self.spawn(index)
+
+    def stopService(self):
+        service.Service.stopService(self)
+        for process in self.processes.values():
+            try:
+                process.signalProcess("TERM")
+            except Exception:
+                pass
+        for sock in self.sockets:
+            sock.close()
+
+    def spawn(self, index):
+        childFDs = {0: "w", 1: 1, 2: 2, LOG_FD: "r"}
+        args = [sys.executable, "-m", "opencanary.workers", "--index", str(index)]
+        fd = FIRST_LISTEN_FD
+        for (klass, n, svc), sock in zip(self.listeners, self.sockets):
+            if not self.serves(index, klass.NAME):
+                continue
+            childFDs[fd] = sock.fileno()
+            args += [
+                "--listen",
+                "%s.%s:%d:%d" % (klass.__module__, klass.__name__, n, fd),
+            ]
+            fd += 1
+        if self.cpu_affinity:
+            args += ["--cpu", str(index % os.cpu_count())]
+
+        self.processes[index] = reactor.spawnProcess(
+            WorkerProcessProtocol(self, index),
+            sys.executable,
+            args,
+            env=os.environ,
+            path=os.getcwd(),
+            childFDs=childFDs,
+        )
+
+    def workerEnded(self, index, reason):
+        self.processes.pop(index, None)
+        # Its connections went with it
+        for key in self.gauges.pop(index, {}):
+            self.sumGauge(key)
+        if not self.running:
+            return
+        self.logMsg(
+            "Worker %d exited (%s), restarting it" % (index, reason.getErrorMessage())
+        )
+        reactor.callLater(RESPAWN_DELAY, self.spawn, index)
+
+
+class WorkerLogger(LoggerBase):
+    """Stands in for the logger in a worker: events go to the supervisor"""
+
+    def __init__(self):
+        self.transport = None
+
+    def send(self, msg):
+        self.transport.write(json_dumps(msg).encode("utf-8") + b"\n")
+
+    def log(self, logdata, retry=True):
+        # The module name goes along so the supervisor can count per module
+        self.send(
+            {"module": registry.moduleName(logdata.get("logtype")), "event": logdata}
+        )
+
+    def error(self, data):
+        self.log({"logdata": data})
+
+
+class MetricsForwarder(object):
+    """Sends the counters and gauges that changed to the supervisor"""
+
+    def __init__(self, logger, registry=registry):
+        self.logger = logger
+        self.registry = registry
+        self.sent = {}
+
+    def changed(self, values):
+        for key, value in list(values.items()):
+            if self.sent.get(key) != value:
+                yield key, value
+
+    def __call__(self):
+        counters = []
+        for (name, labels), value in self.changed(self.registry.counters):
+            counters.append((name, labels, value - self.sent.get((name, labels), 0)))
+            self.sent[(name, labels)] = value
+        gauges = []
+        for (name, labels), value in self.changed(self.registry.gauges):
+            gauges.append((name, labels, value))
+            self.sent[(name, labels)] = value
+        if counters or gauges:
+            self.logger.send({"metrics": {"counters": counters, "gauges": gauges}})
+
+
+class SupervisorPipe(protocol.Protocol):
+    """The worker's end of the pipes to the supervisor"""
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def connectionMade(self):
+        self.logger.transport = self.transport
+
+    def connectionLost(self, reason):
+        # The supervisor has gone away, so should we
+        if reactor.running:
+            reactor.stop()
+
+
+def adopt(svc, fd):
+    """Start serving svc on the inherited listening socket fd"""
+    factory = svc.args[1]
+    if svc.method == "SSL":
+        factory = TLSMemoryBIOFactory(svc.args[2], False, factory)
+    sock = socket.socket(fileno=fd)
+    reactor.adoptStreamPort(sock.fileno(), sock.family, factory)
+    sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenCanary worker process")
+    parser.add_argument("--index", type=int, required=True)
+    parser.add_argument("--listen", action="append", default=[])
+    parser.add_argument("--cpu", type=int)
+    args = parser.parse_args(argv)
+
+    if args.cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {args.cpu})
+
+    from opencanary.config import config
+
+    logger = WorkerLogger()
+    stdio.StandardIO(SupervisorPipe(logger), stdin=0, stdout=LOG_FD)
+    admission = getAdmissionControl(config, logger)
+    profiler = getProfiler(config)
+    if profiler is not None:
+        # The supervisor's buffer is the one SIGUSR1 and /slow show
+        profiler.forward = lambda entry: logger.send({"slow": entry})
+
+    modules = {}
+    for spec in args.listen:
+        path, index, fd = spec.rsplit(":", 2)
+        if path not in modules:
+            modname, classname = path.rsplit(".", 1)
+            klass = getattr(importlib.import_module(modname), classname)
+            obj = klass(config=config, logger=logger)
+            if profiler is not None:
+                profiler.instrumentModule(obj)
+            svcs = obj.getService()
+            modules[path] = (obj, svcs if isinstance(svcs, list) else [svcs])
+        obj, svcs = modules[path]
+        svc = svcs[int(index)]
+        if admission is not None:
+            admission.limitService(obj.NAME, svc)
+        instrumentService(obj.NAME, svc)
+        if profiler is not None:
+            profiler.instrumentService(obj.NAME, svc)
+        adopt(svc, int(fd))
+
+    if profiler is not None:
+        profiler.startService()
+    forward = MetricsForwarder(logger)
+    task.LoopingCall(forward).start(METRICS_INTERVAL, now=False)
+    reactor.addSystemEventTrigger("before", "shutdown", forward)
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
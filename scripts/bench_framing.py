@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Compare receive buffering throughput: bytes concatenation vs FrameBuffer.
+
+Usage: python scripts/bench_framing.py [message size] [chunk size]
+
+Feeds MongoDB style length-prefixed messages through the framing loop
+MongoDBProtocol.dataReceived used before FrameBuffer and through the
+current one, in three streams: one large message dripped in small
+chunks, many small pipelined messages arriving together, and a mix.
+
+Only the fragmented stream gets faster, by two orders of magnitude.
+The pipelined and mixed streams run at about the same speed with either
+loop, give or take run to run noise, since the cost there is per
+message rather than in copying the rest of the buffer.
+"""
+
+import struct
+import sys
+import timeit
+
+from opencanary.framing import FrameBuffer
+
+HEADER = struct.Struct("<I")
+
+
+def message(size):
+    return HEADER.pack(size) + b"\x00" * (size - HEADER.size)
+
+
+def chunked(stream, size):
+    return [stream[i : i + size] for i in range(0, len(stream), size)]
+
+
+class Legacy(object):
+    def __init__(self):
+        self.buffer = b""
+        self.frames = 0
+
+    def dataReceived(self, data):
+        self.buffer += data
+        while len(self.buffer) >= 16:
+            length = HEADER.unpack(self.buffer[0:4])[0]
+            if len(self.buffer) < length:
+                break
+            self.buffer[:length]
+            self.buffer = self.buffer[length:]
+            self.frames += 1
+
+
+class Framed(object):
+    def __init__(self):
+        self.buffer = FrameBuffer()
+        self.frames = 0
+
+    def dataReceived(self, data):
+        self.buffer.append(data)
+        while len(self.buffer) >= 16:
+            length = self.buffer.unpack_from(HEADER)[0]
+            if len(self.buffer) < length:
+                break
+            self.buffer.take(length)
+            self.frames += 1
+
+
+def run(klass, chunks):
+    proto = klass()
+    for chunk in chunks:
+        proto.dataReceived(chunk)
+    return proto.frames
+
+
+def main() -> int:
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 4_000_000
+    chunk = int(sys.argv[2]) if len(sys.argv) > 2 else 1460
+
+    small = message(200) * (size // 200)
+    streams = (
+        ("fragmented", chunked(message(size), chunk)),
+        ("pipelined", chunked(small, 65536)),
+        ("mixed", chunked((message(size // 8) + small[: size // 8]) * 4, chunk)),
+    )
+
+    for name, chunks in streams:
+        frames = run(Legacy, chunks)
+        assert run(Framed, chunks) == frames
+        print(
+            "%s: %d bytes, %d chunks, %d messages" % (name, size, len(chunks), frames)
+        )
+        for label, klass in (("legacy", Legacy), ("FrameBuffer", Framed)):
+            elapsed = min(timeit.repeat(lambda: run(klass, chunks), number=1, repeat=3))
+            print("%12s %10.1f MB/s" % (label, sum(map(len, chunks)) / elapsed / 1e6))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
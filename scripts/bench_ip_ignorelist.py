@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Compare ip.ignorelist lookup cost: per-entry check_ip() vs IPRangeSet.
+
+Usage: python scripts/bench_ip_ignorelist.py [lookups]
+"""
+
+import random
+import sys
+import timeit
+
+from opencanary.iphelper import IPRangeSet, check_ip
+
+SIZES = (1, 10, 100, 1000)
+
+
+def random_ranges(n):
+    rng = random.Random(n)
+    ranges = []
+    for _ in range(n):
+        addr = ".".join(str(rng.randrange(256)) for _ in range(4))
+        ranges.append("%s/%d" % (addr, rng.choice((16, 24, 28, 32))))
+    return ranges
+
+
+def linear(ip, ranges):
+    for network_range in ranges:
+        if check_ip(ip, network_range):
+            return True
+    return False
+
+
+def main() -> int:
+    lookups = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rng = random.Random(0)
+    ips = [".".join(str(rng.randrange(256)) for _ in range(4)) for _ in range(lookups)]
+
+    print("%8s %16s %16s" % ("ranges", "check_ip (us)", "IPRangeSet (us)"))
+    for size in SIZES:
+        ranges = random_ranges(size)
+        compiled = IPRangeSet(ranges)
+        old = timeit.timeit(lambda: [linear(ip, ranges) for ip in ips], number=1)
+        new = timeit.timeit(lambda: [ip in compiled for ip in ips], number=1)
+        print("%8d %16.2f %16.2f" % (size, old / lookups * 1e6, new / lookups * 1e6))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Compare MongoDB handshake reply cost: encoding per request vs ReplyTemplate.
+
+Usage: python scripts/bench_mongodb_replies.py [replies]
+
+The legacy path is how send_ismaster_response built the isMaster reply
+before the factory encoded it once at startup.
+"""
+
+import sys
+import timeit
+from datetime import datetime
+
+from opencanary.modules.mongodb import (
+    OPCODE_OP_MSG,
+    CanaryMongoDB,
+    MongoDBProtocol,
+    encodeMessage,
+)
+
+
+class Config(object):
+    def getVal(self, key, default):
+        return default
+
+
+def legacy(factory, request_id):
+    doc = {
+        "ismaster": True,
+        "maxBsonObjectSize": 16_777_216,
+        "maxMessageSizeBytes": 48_000_000,
+        "maxWriteBatchSize": 100_000,
+        "localTime": datetime.utcnow().isoformat(),
+        "logicalSessionTimeoutMinutes": 30,
+        "connectionId": 1,
+        "minWireVersion": 0,
+        "maxWireVersion": 8,
+        "readOnly": False,
+        "ok": 1.0,
+        "version": factory.mongo_version,
+    }
+    return encodeMessage(OPCODE_OP_MSG, request_id, MongoDBProtocol.encode_bson(doc))
+
+
+def main() -> int:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    factory = CanaryMongoDB(config=Config())
+    template = factory.templates[OPCODE_OP_MSG]["ismaster"]
+
+    for label, reply in (
+        ("legacy", lambda i: legacy(factory, i)),
+        ("ReplyTemplate", template.render),
+    ):
+        elapsed = min(
+            timeit.repeat(lambda: [reply(i) for i in range(n)], number=1, repeat=3)
+        )
+        print("%14s %12.0f replies/s" % (label, n / elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Compare portscan kern.log parsing throughput: old per-prefix split vs parseLine().
+
+Usage: python scripts/bench_portscan_parser.py [kern.log] [lines]
+
+Without a kern.log a synthetic corpus is used, with one in five lines
+coming from some other part of the kernel.
+"""
+
+import random
+import sys
+import timeit
+
+from opencanary.modules.portscan import parseLine
+
+PREFIXES = (
+    "canaryfw",
+    "canarynmap",
+    "canarynmapNULL",
+    "canarynmapXMAS",
+    "canarynmapFIN",
+)
+
+
+def synthetic(n):
+    rng = random.Random(0)
+    lines = []
+    for i in range(n):
+        stamp = "Jan 31 12:00:%02d canary kernel: [%d.%06d] " % (i % 60, i, i)
+        if i % 5 == 4:
+            lines.append(stamp + "usb 1-1: new high-speed USB device number %d" % i)
+            continue
+        if i % 7 == 0:
+            src = "2001:db8::%x" % rng.randrange(65536)
+            dst = "2001:db8::1"
+            ip = "LEN=80 TC=0 HOPLIMIT=64 FLOWLBL=%d" % rng.randrange(1 << 20)
+        else:
+            src = "192.0.2.%d" % rng.randrange(256)
+            dst = "198.51.100.1"
+            ip = "LEN=60 TOS=0x00 PREC=0x00 TTL=64 ID=%d DF" % rng.randrange(65536)
+        lines.append(
+            stamp + "%s: IN=eth0 OUT= MAC=00:16:3e:00:00:01:00:16:3e:00:00:02:08:00 "
+            "SRC=%s DST=%s %s PROTO=TCP SPT=%d DPT=%d WINDOW=64240 RES=0x00 SYN URGP=0"
+            % (
+                rng.choice(PREFIXES),
+                src,
+                dst,
+                ip,
+                rng.randrange(1024, 65536),
+                rng.randrange(1, 1024),
+            )
+        )
+    return lines
+
+
+def legacy(line):  # noqa: C901
+    """The parser SynLogWatcher.handleLines used before parseLine()"""
+    try:
+        if "canaryfw: " in line:
+            rubbish, log = line.split("canaryfw: ")
+        elif "canarynmapNULL" in line:
+            rubbish, log = line.split("canarynmapNULL: ")
+        elif "canarynmapXMAS" in line:
+            rubbish, log = line.split("canarynmapXMAS: ")
+        elif "canarynmapFIN" in line:
+            rubbish, log = line.split("canarynmapFIN: ")
+        elif "canarynmap: " in line:
+            rubbish, log = line.split("canarynmap: ")
+        else:
+            return None
+    except ValueError:
+        return None
+    kv = {}
+    for tag in log.split(" "):
+        if tag.find("=") >= 0:
+            key, val = tag.split("=")
+        else:
+            key = tag
+            val = ""
+        kv[key] = val
+    if "" in kv.keys():
+        kv.pop("")
+    return kv
+
+
+def main() -> int:
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], errors="replace") as f:
+            lines = f.read().splitlines()
+    else:
+        lines = synthetic(int(sys.argv[2]) if len(sys.argv) > 2 else 100000)
+
+    for parsed, old in zip(map(parseLine, lines), map(legacy, lines)):
+        assert (parsed and parsed[1]) == old, (parsed, old)
+
+    print("%d lines" % len(lines))
+    for name, parse in (("legacy", legacy), ("parseLine", parseLine)):
+        elapsed = min(timeit.repeat(lambda: [parse(line) for line in lines], number=1))
+        print("%10s %12.0f lines/s" % (name, len(lines) / elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
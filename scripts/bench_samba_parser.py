@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Compare Samba audit log parsing throughput: old regex vs parseAuditLine().
+
+Usage: python scripts/bench_samba_parser.py [samba-audit.log] [lines]
+
+Without an audit log a synthetic corpus is used, with one in five lines
+coming from some other daemon and one in fifty a truncated record.
+"""
+
+import random
+import re
+import sys
+import timeit
+
+from opencanary.modules.samba import parseAuditLine
+
+ACTIONS = ("open", "pread", "pwrite", "close", "unlinkat", "renameat")
+
+
+def synthetic(n):
+    rng = random.Random(0)
+    lines = []
+    for i in range(n):
+        stamp = "Jan 31 12:00:%02d canary " % (i % 60)
+        if i % 5 == 4:
+            lines.append(stamp + "sshd[%d]: Connection closed by 192.0.2.1" % i)
+            continue
+        record = "|".join(
+            [
+                rng.choice(("", "alice", "bob")),
+                "192.0.2.%d" % rng.randrange(256),
+                "198.51.100.1",
+                "WORKSTATION%d" % rng.randrange(100),
+                "myshare",
+                "CANARY",
+                "SMB3_11",
+                "Win10",
+                "",
+                "CORP",
+                rng.choice(ACTIONS),
+                "ok",
+                "/srv/share/dir%d/report %d.docx" % (rng.randrange(10), i),
+            ]
+        )
+        if i % 50 == 3:
+            record = record[: len(record) // 3]
+        lines.append(stamp + "smbd_audit[%d]: %s" % (1000 + i % 7, record))
+    return lines
+
+
+def legacy(line):
+    """The parser SambaLogWatcher.handleLines used before parseAuditLine()"""
+    audit_re = re.compile(r"^.*smbd_audit.*: (.*$)")
+    matches = audit_re.match(line)
+    if matches is None:
+        return None
+    data = matches.groups()[0].split("|")
+    try:
+        data[12]
+    except IndexError:
+        return None
+    return data
+
+
+def main() -> int:
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], errors="replace") as f:
+            lines = f.read().splitlines()
+    else:
+        lines = synthetic(int(sys.argv[2]) if len(sys.argv) > 2 else 100000)
+
+    for parsed, old in zip(map(parseAuditLine, lines), map(legacy, lines)):
+        assert parsed == old, (parsed, old)
+
+    print("%d lines" % len(lines))
+    for name, parse in (("legacy", legacy), ("parseAuditLine", parseAuditLine)):
+        elapsed = min(timeit.repeat(lambda: [parse(line) for line in lines], number=1))
+        print("%14s %12.0f lines/s" % (name, len(lines) / elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())